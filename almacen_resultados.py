@@ -0,0 +1,173 @@
+"""Almacenamiento persistente (SQLite) de las piezas de cada Excel procesado"""
+import sqlite3
+import threading
+from datetime import datetime
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS cargas_excel (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clave_contenido TEXT NOT NULL UNIQUE,
+    referencia_excel TEXT,
+    nombre_archivo TEXT,
+    fecha_carga TEXT NOT NULL,
+    num_piezas INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resultados_piezas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    carga_id INTEGER NOT NULL REFERENCES cargas_excel(id) ON DELETE CASCADE,
+    referencia_excel TEXT,
+    fecha_carga TEXT NOT NULL,
+    of INTEGER NOT NULL,
+    pieza INTEGER NOT NULL,
+    porcentaje INTEGER NOT NULL,
+    par_izquierda REAL,
+    par_derecha REAL,
+    consumo_izquierda REAL,
+    consumo_derecha REAL,
+    valor_columna_l REAL
+);
+CREATE INDEX IF NOT EXISTS idx_resultados_referencia ON resultados_piezas(referencia_excel, fecha_carga);
+CREATE INDEX IF NOT EXISTS idx_resultados_of_pieza ON resultados_piezas(of, pieza);
+CREATE INDEX IF NOT EXISTS idx_resultados_pieza ON resultados_piezas(pieza);
+CREATE INDEX IF NOT EXISTS idx_resultados_fecha ON resultados_piezas(fecha_carga);
+CREATE INDEX IF NOT EXISTS idx_cargas_referencia ON cargas_excel(referencia_excel, fecha_carga);
+'''
+
+COLUMNAS_RESULTADO = ['referencia_excel', 'fecha_carga', 'of', 'pieza', 'porcentaje', 'par_izquierda',
+                      'par_derecha', 'consumo_izquierda', 'consumo_derecha', 'valor_columna_l']
+
+# Límite de filas por página en las consultas
+MAX_POR_PAGINA = 1000
+
+
+class AlmacenResultados:
+    """Guarda las piezas de cada Excel procesado en SQLite y permite consultarlas con filtros.
+
+    La base de datos se crea (y se migra el esquema) en el primer uso, no al crear el objeto.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._preparada = False
+        self._lock = threading.Lock()
+
+    def _preparar(self):
+        with self._lock:
+            if self._preparada:
+                return
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            try:
+                conexion.execute('PRAGMA journal_mode=WAL')
+                conexion.executescript(ESQUEMA)
+            finally:
+                conexion.close()
+            self._preparada = True
+
+    def _conectar(self):
+        if not self._preparada:
+            self._preparar()
+        # Una conexión por operación: el servidor puede atender peticiones en varios hilos
+        conexion = sqlite3.connect(self.ruta, timeout=30)
+        conexion.row_factory = sqlite3.Row
+        conexion.execute('PRAGMA foreign_keys=ON')
+        return conexion
+
+    def guardar(self, clave_contenido, referencia_excel, piezas, nombre_archivo=None):
+        """Guardar las piezas de un Excel (diccionario de la API) en una sola transacción.
+
+        Si el mismo archivo (misma clave de contenido) ya está guardado no se duplica.
+        Devuelve el id de la carga.
+        """
+        return self._guardar(clave_contenido, referencia_excel, len(piezas), piezas.values(), nombre_archivo)
+
+    def guardar_tabla(self, clave_contenido, referencia_excel, tabla, nombre_archivo=None):
+        """Como `guardar`, desde una TablaPiezas: las piezas se convierten y se insertan de una en una"""
+        piezas = (pieza_info for _, pieza_info in tabla.iterar(tabla.orden_claves()))
+        return self._guardar(clave_contenido, referencia_excel, len(tabla), piezas, nombre_archivo)
+
+    def _guardar(self, clave_contenido, referencia_excel, num_piezas, piezas, nombre_archivo):
+        fecha_carga = datetime.now().isoformat(timespec='seconds')
+        conexion = self._conectar()
+        try:
+            with conexion:
+                fila = conexion.execute('SELECT id FROM cargas_excel WHERE clave_contenido = ?',
+                                        (clave_contenido,)).fetchone()
+                if fila is not None:
+                    return fila['id']
+
+                cursor = conexion.execute(
+                    'INSERT INTO cargas_excel (clave_contenido, referencia_excel, nombre_archivo, fecha_carga, num_piezas) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (clave_contenido, referencia_excel, nombre_archivo, fecha_carga, num_piezas)
+                )
+                carga_id = cursor.lastrowid
+                filas = (
+                    (carga_id, referencia_excel, fecha_carga, pieza_info['of'], pieza_info['pieza'], int(percent),
+                     carga.get('izquierda', 0), carga.get('derecha', 0), carga.get('consumo_izquierda', 0),
+                     carga.get('consumo_derecha', 0), carga.get('valor_columna_l', 0))
+                    for pieza_info in piezas
+                    for percent, carga in pieza_info['cargas'].items()
+                )
+                conexion.executemany(
+                    'INSERT INTO resultados_piezas (carga_id, referencia_excel, fecha_carga, of, pieza, porcentaje, '
+                    'par_izquierda, par_derecha, consumo_izquierda, consumo_derecha, valor_columna_l) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    filas
+                )
+                return carga_id
+        finally:
+            conexion.close()
+
+    @staticmethod
+    def _filtros(referencia=None, of=None, pieza=None, desde=None, hasta=None):
+        condiciones, parametros = [], []
+        if referencia:
+            condiciones.append('referencia_excel = ?')
+            parametros.append(referencia)
+        if of is not None:
+            condiciones.append('of = ?')
+            parametros.append(of)
+        if pieza is not None:
+            condiciones.append('pieza = ?')
+            parametros.append(pieza)
+        # Las fechas se comparan como texto ISO; 'hasta' incluye todo el día indicado
+        if desde:
+            condiciones.append('fecha_carga >= ?')
+            parametros.append(desde)
+        if hasta:
+            condiciones.append('fecha_carga <= ?')
+            parametros.append(hasta if 'T' in hasta else f'{hasta}T23:59:59')
+        donde = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+        return donde, parametros
+
+    def _paginar(self, tabla, columnas, orden, filtros, pagina, por_pagina):
+        por_pagina = max(1, min(por_pagina, MAX_POR_PAGINA))
+        pagina = max(1, pagina)
+        donde, parametros = self._filtros(**filtros)
+        conexion = self._conectar()
+        try:
+            total = conexion.execute(f'SELECT COUNT(*) FROM {tabla}{donde}', parametros).fetchone()[0]
+            filas = conexion.execute(
+                f'SELECT {", ".join(columnas)} FROM {tabla}{donde} ORDER BY {orden} LIMIT ? OFFSET ?',
+                parametros + [por_pagina, (pagina - 1) * por_pagina]
+            ).fetchall()
+        finally:
+            conexion.close()
+        return {
+            'total': total,
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'resultados': [dict(fila) for fila in filas]
+        }
+
+    def consultar(self, pagina=1, por_pagina=100, **filtros):
+        """Resultados por pieza y porcentaje, filtrados por referencia/OF/pieza/fechas y paginados"""
+        return self._paginar('resultados_piezas', ['carga_id'] + COLUMNAS_RESULTADO,
+                             'fecha_carga DESC, of, pieza, porcentaje', filtros, pagina, por_pagina)
+
+    def consultar_cargas(self, pagina=1, por_pagina=100, referencia=None, desde=None, hasta=None):
+        """Excel guardados, del más reciente al más antiguo"""
+        return self._paginar('cargas_excel',
+                             ['id', 'clave_contenido', 'referencia_excel', 'nombre_archivo', 'fecha_carga', 'num_piezas'],
+                             'fecha_carga DESC, id DESC',
+                             {'referencia': referencia, 'desde': desde, 'hasta': hasta}, pagina, por_pagina)
@@ -1,62 +1,238 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from flask import Flask, render_template, request, jsonify, send_file, g
+import atexit
 import json
+import logging
 import os
+import time
 from io import BytesIO
 from datetime import datetime
-import base64
-import pandas as pd
 import re
 
+# pandas, openpyxl, NumPy y ReportLab se importan en la primera petición que los usa (procesador_excel,
+# ingesta_lote, evaluacion_tolerancias, informes_pdf, informes_lote): las páginas y /api/data no los necesitan
+from almacen_resultados import AlmacenResultados
+from cache_resultados import CacheResultados, clave_contenido
+from datos_estaciones import (ESTACION_POR_DEFECTO, AlmacenEstaciones, AlmacenEstacionesCompartido,
+                              EsperasAgotadasError)
+from estado_compartido import BaseDatosEstado
+from metricas import (anotar, con_peticion, funciones_principales, iniciar_peticion, metricas, nuevo_perfil,
+                      peticion_actual, terminar_peticion, tramo)
+from patrones import registro_patrones
+from trabajos_informes import ColaLlenaError, ColaTrabajos, ColaTrabajosCompartida
+
 app = Flask(__name__)
 
-# Almacenamiento de datos en memoria
-data_store = {
-    '0': {'izquierda': 0, 'derecha': 0, 'consumo_izquierda': 0, 'consumo_derecha': 0},
-    '100': {'izquierda': 0, 'derecha': 0, 'consumo_izquierda': 0, 'consumo_derecha': 0}
-}
+# Tamaño (bytes) a partir del cual /api/procesar-excel lee el Excel en streaming por defecto
+UMBRAL_LECTURA_STREAMING = int(os.environ.get('UMBRAL_LECTURA_STREAMING', 2 * 1024 * 1024))
+
+# Caché de resultados de /api/procesar-excel: LRU en memoria y, opcionalmente, en disco
+cache_excel = CacheResultados(
+    max_bytes=int(os.environ.get('CACHE_EXCEL_MAX_BYTES', 64 * 1024 * 1024)),
+    directorio=os.environ.get('CACHE_EXCEL_DIR') or None
+)
+
+# Histórico de piezas procesadas en SQLite: solo con RESULTADOS_DB (ruta del archivo), que se abre en el primer uso
+ruta_resultados_db = os.environ.get('RESULTADOS_DB')
+almacen_resultados = AlmacenResultados(ruta_resultados_db) if ruta_resultados_db else None
+
+# Estado común a todos los procesos worker en SQLite: solo con ESTADO_DB (servidor.py la define con varios
+# workers). Sin ella, las estaciones de /api/data y los trabajos en segundo plano están en la memoria del proceso
+ruta_estado_db = os.environ.get('ESTADO_DB')
+estado_db = BaseDatosEstado(ruta_estado_db) if ruta_estado_db else None
+
+# Cola de trabajos para generar informes en segundo plano
+parametros_trabajos = dict(
+    max_concurrentes=int(os.environ.get('TRABAJOS_CONCURRENTES', 2)),
+    directorio=os.environ.get('TRABAJOS_DIR') or None,
+    retencion_s=int(os.environ.get('TRABAJOS_RETENCION_S', 3600)),
+    max_trabajos=int(os.environ.get('TRABAJOS_MAX', 200)),
+    max_pendientes=int(os.environ.get('TRABAJOS_MAX_PENDIENTES', 20))
+)
+cola_informes = (ColaTrabajosCompartida(estado_db, **parametros_trabajos) if estado_db is not None
+                 else ColaTrabajos(**parametros_trabajos))
+atexit.register(cola_informes.cerrar)
+# Segundos que se indican en Retry-After cuando la cola de informes está llena
+REINTENTO_TRABAJOS_S = 30
+
+# Valores de la página principal por estación de ensayo (?estacion= o cabecera X-Estacion).
+# Cada long-poll de /api/data/cambios ocupa un hilo: MAX_ESPERAS_CAMBIOS debe ser menor que SERVIDOR_THREADS
+parametros_estaciones = dict(max_estaciones=int(os.environ.get('MAX_ESTACIONES', 100)),
+                             max_esperas=int(os.environ.get('MAX_ESPERAS_CAMBIOS', 16)))
+datos_estaciones = (AlmacenEstacionesCompartido(estado_db, **parametros_estaciones) if estado_db is not None
+                    else AlmacenEstaciones(**parametros_estaciones))
+
+# Tiempo máximo (s) que /api/data/cambios mantiene abierta la petición esperando un cambio
+MAX_ESPERA_CAMBIOS = 60
+# Segundos que el navegador espera antes de volver a intentar el long-poll cuando no hay hueco (503)
+REINTENTO_CAMBIOS_S = 5
+
+# ?perfil=1 en cualquier petición devuelve las funciones con más tiempo (cProfile) en lugar de la respuesta
+PERFIL_PETICIONES = os.environ.get('PERFIL_PETICIONES') == '1'
+
+# Registro estructurado (una línea JSON por petición) en el logger 'cargas.peticiones'
+LOG_PETICIONES = os.environ.get('LOG_PETICIONES') == '1'
+registro_peticiones = logging.getLogger('cargas.peticiones')
+if LOG_PETICIONES:
+    registro_peticiones.setLevel(logging.INFO)
+    if not registro_peticiones.handlers:
+        registro_peticiones.addHandler(logging.StreamHandler())
+
+@app.before_request
+def iniciar_metricas_peticion():
+    """Empezar a medir la petición (y a perfilarla si se pide)"""
+    g.token_metricas = iniciar_peticion(request.endpoint or 'desconocido')
+    g.inicio_peticion = time.perf_counter()
+    if PERFIL_PETICIONES and request.args.get('perfil'):
+        g.perfil = nuevo_perfil()
+
+@app.after_request
+def registrar_metricas_peticion(respuesta):
+    """Registrar la duración, el tamaño y los tramos de la petición"""
+    peticion = peticion_actual()
+    if peticion is None:
+        return respuesta
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        # Las respuestas en streaming se generan aquí para que entren en el perfil (send_file ya tiene el archivo)
+        if not respuesta.direct_passthrough:
+            respuesta.get_data()
+        perfil.disable()
+        limite = request.args.get('perfil', '')
+        respuesta = jsonify({
+            'endpoint': peticion['endpoint'],
+            'estado': respuesta.status_code,
+            'segundos': round(time.perf_counter() - g.inicio_peticion, 6),
+            'tramos': peticion['tramos'],
+            'datos': peticion['datos'],
+            'funciones': funciones_principales(perfil, int(limite) if limite.isdigit() and int(limite) > 1 else 25)
+        })
+    
+    segundos = time.perf_counter() - g.inicio_peticion
+    endpoint = peticion['endpoint']
+    metricas.incrementar('cargas_peticiones_total', endpoint=endpoint, metodo=request.method,
+                         estado=respuesta.status_code)
+    metricas.observar('cargas_peticion_segundos', segundos, endpoint=endpoint)
+    if request.content_length:
+        metricas.observar('cargas_peticion_bytes', request.content_length, endpoint=endpoint)
+    
+    if LOG_PETICIONES:
+        registro_peticiones.info(json.dumps({
+            'fecha': datetime.now().isoformat(timespec='milliseconds'),
+            'endpoint': endpoint,
+            'metodo': request.method,
+            'ruta': request.path,
+            'estado': respuesta.status_code,
+            'segundos': round(segundos, 6),
+            'bytes_peticion': request.content_length,
+            'bytes_respuesta': respuesta.content_length,
+            'tramos': peticion['tramos'],
+            **peticion['datos']
+        }, ensure_ascii=False))
+    return respuesta
+
+@app.teardown_request
+def terminar_metricas_peticion(error=None):
+    token = g.pop('token_metricas', None)
+    if token is not None:
+        terminar_peticion(token)
+
+@app.route('/metrics', methods=['GET'])
+def exportar_metricas():
+    """Métricas en formato de texto de Prometheus"""
+    estadisticas_cache = cache_excel.estadisticas()
+    medidores = {
+        f'cargas_cache_excel_{clave}': (f'Caché de Excel procesados: {clave}', estadisticas_cache[clave])
+        for clave in ('entradas', 'bytes', 'max_bytes', 'aciertos', 'aciertos_disco', 'fallos', 'desalojos')
+    }
+    medidores['cargas_patrones_recargas'] = ('Veces que se ha leído patrones_carga.json', registro_patrones.recargas)
+    medidores['cargas_estaciones'] = ('Estaciones con datos en /api/data', len(datos_estaciones))
+    medidores['cargas_esperas_cambios'] = ('Clientes esperando en /api/data/cambios', datos_estaciones.esperando)
+    medidores['cargas_trabajos_pendientes'] = ('Trabajos de informes en cola o ejecutándose', cola_informes.pendientes())
+    return app.response_class(metricas.exportar(medidores), mimetype='text/plain; version=0.0.4')
+
+def registrar_excel(columnas, tabla, modo_lectura):
+    """Filas leídas y piezas obtenidas de un Excel"""
+    filas = len(columnas['pieza']) if columnas is not None else 0
+    metricas.observar('cargas_filas_procesadas', filas, modo=modo_lectura)
+    metricas.observar('cargas_piezas_procesadas', len(tabla), origen='excel')
+    anotar(filas=filas, piezas=len(tabla), modo_lectura=modo_lectura)
+
+def registrar_pdf(buffer, tipo, num_piezas):
+    """Tamaño del PDF generado (en un BytesIO o, en el informe masivo paginado, en un archivo temporal)"""
+    pdf_bytes = buffer.seek(0, os.SEEK_END)
+    buffer.seek(0)
+    metricas.observar('cargas_pdf_bytes', pdf_bytes, tipo=tipo)
+    metricas.observar('cargas_piezas_procesadas', num_piezas, origen=f'informe_{tipo}')
+    anotar(pdf_bytes=pdf_bytes, piezas=num_piezas)
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def estacion_peticion():
+    """Estación de la petición: ?estacion=, cabecera X-Estacion o la estación por defecto"""
+    estacion = request.args.get('estacion') or request.headers.get('X-Estacion') or ESTACION_POR_DEFECTO
+    return AlmacenEstaciones.validar_estacion(estacion)
+
 @app.route('/api/data', methods=['GET'])
 def get_data():
-    """Obtener todos los datos"""
-    return jsonify(data_store)
+    """Obtener todos los datos de la estación (304 si no han cambiado)"""
+    try:
+        estacion = estacion_peticion()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    instantanea = datos_estaciones.obtener(estacion)
+    respuesta = respuesta_json_condicional(instantanea.json_bytes, datos_estaciones.etag(estacion, instantanea))
+    respuesta.headers['X-Version'] = str(instantanea.version)
+    return respuesta
 
 @app.route('/api/data', methods=['POST'])
 def update_data():
-    """Actualizar datos"""
-    global data_store
+    """Actualizar datos de la estación"""
     try:
-        new_data = request.json
-        for percentage, values in new_data.items():
-            if percentage in data_store:
-                data_store[percentage] = {
-                    'izquierda': float(values.get('izquierda', 0)),
-                    'derecha': float(values.get('derecha', 0)),
-                    'consumo_izquierda': float(values.get('consumo_izquierda', 0)),
-                    'consumo_derecha': float(values.get('consumo_derecha', 0))
-                }
-        return jsonify({'success': True, 'data': data_store})
+        estacion = estacion_peticion()
+        instantanea = datos_estaciones.actualizar(estacion, request.json, origen=request.args.get('cliente'))
+        return jsonify({'success': True, 'data': instantanea.datos, 'version': instantanea.version})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/data/cambios', methods=['GET'])
+def esperar_cambios_data():
+    """Long-poll: responder cuando la versión de la estación sea distinta de ?version= (204 si no cambia)"""
+    try:
+        estacion = estacion_peticion()
+        version = int(request.args.get('version', -1))
+        espera = min(max(float(request.args.get('timeout', 25)), 0), MAX_ESPERA_CAMBIOS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        instantanea = datos_estaciones.esperar_cambio(estacion, version, espera)
+    except EsperasAgotadasError as e:
+        respuesta = jsonify({'error': str(e)})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(REINTENTO_CAMBIOS_S)
+        return respuesta
+    if instantanea is None:
+        return app.response_class(status=204)
+    return jsonify({'version': instantanea.version, 'origen': instantanea.origen, 'data': instantanea.datos})
+
+def respuesta_json_condicional(cuerpo, etag):
+    """Respuesta con JSON ya serializado y ETag; 304 si el navegador ya tiene esa versión"""
+    if etag in request.if_none_match:
+        respuesta = app.response_class(status=304)
+    else:
+        respuesta = app.response_class(cuerpo, mimetype='application/json')
+    respuesta.set_etag(etag)
+    # El navegador guarda la respuesta pero la revalida siempre (el archivo puede cambiar)
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    return respuesta
+
 @app.route('/api/patrones', methods=['GET'])
 def get_patrones():
     """Obtener todos los patrones de carga"""
     try:
-        json_path = os.path.join(os.path.dirname(__file__), 'patrones_carga.json')
-        with open(json_path, 'r', encoding='utf-8') as f:
-            patrones = json.load(f)
-        return jsonify(patrones)
+        cuerpo, etag = registro_patrones.todos_json()
+        return respuesta_json_condicional(cuerpo, etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -64,24 +240,95 @@ def get_patrones():
 def get_patron(patron_id):
     """Obtener un patrón específico"""
     try:
-        json_path = os.path.join(os.path.dirname(__file__), 'patrones_carga.json')
-        with open(json_path, 'r', encoding='utf-8') as f:
-            patrones = json.load(f)
-        if patron_id in patrones:
-            return jsonify(patrones[patron_id])
+        cuerpo, etag = registro_patrones.patron_json(patron_id)
+        if cuerpo is not None:
+            return respuesta_json_condicional(cuerpo, etag)
         else:
             return jsonify({'error': 'Patrón no encontrado'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/patrones/cercanos', methods=['POST'])
+def buscar_patrones_cercanos():
+    """Patrón de patrones_carga.json más parecido a cada pieza (distancia y confianza) y al lote"""
+    from indice_patrones import patrones_cercanos
+    try:
+        data = request.json
+        piezas = data.get('piezas', {})
+        if not piezas:
+            return jsonify({'error': 'No hay piezas para comparar'}), 400
+        candidatos = data.get('candidatos')
+        if candidatos is not None and not isinstance(candidatos, list):
+            return jsonify({'error': 'candidatos debe ser una lista de ids de patrón'}), 400
+        
+        with tramo('patrones_cercanos'):
+            resultado = patrones_cercanos(piezas, candidatos, detalle=request.args.get('detalle', '1') != '0')
+        return jsonify({'success': True, **resultado})
+    except KeyError as e:
+        return jsonify({'success': False, 'error': e.args[0]}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
 @app.route('/carga-masiva')
 def carga_masiva():
     """Vista para carga masiva de datos desde Excel"""
     return render_template('carga_masiva.html')
 
+def lineas_ndjson(referencia_excel, piezas, al_terminar=None):
+    """Respuesta NDJSON de /api/procesar-excel: referencia, una línea por pieza y fin.
+
+    `piezas` genera (clave, pieza) en orden de OF y pieza; cada pieza se serializa y se suelta antes de
+    pasar a la siguiente. `al_terminar` se llama después de enviar la línea de fin sin errores.
+    """
+    yield app.json.dumps({'tipo': 'inicio', 'referencia_excel': referencia_excel}) + '\n'
+    num_piezas = 0
+    try:
+        for clave_pieza, pieza_info in piezas:
+            num_piezas += 1
+            yield app.json.dumps({'tipo': 'pieza', 'id': clave_pieza, **pieza_info}) + '\n'
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        yield app.json.dumps({'tipo': 'error', 'error': f'Error al procesar el archivo: {str(e)}'}) + '\n'
+        return
+    yield app.json.dumps({'tipo': 'fin', 'num_piezas': num_piezas}) + '\n'
+    if al_terminar is not None:
+        al_terminar()
+
+def cuerpo_json_tabla(referencia_excel, tabla):
+    """Bytes de la respuesta JSON de /api/procesar-excel serializados pieza a pieza desde la tabla.
+
+    Mismo cuerpo que jsonify({'referencia_excel': ..., 'piezas': tabla.a_dict()}) sin crear el diccionario
+    de todas las piezas.
+    """
+    salida = BytesIO()
+    salida.write(b'{"piezas":{')
+    for i, (clave_pieza, pieza_info) in enumerate(tabla.iterar(tabla.orden_claves())):
+        if i:
+            salida.write(b',')
+        salida.write(f'{app.json.dumps(clave_pieza)}:{app.json.dumps(pieza_info, separators=(",", ":"))}'.encode())
+    salida.write(f'}},"referencia_excel":{app.json.dumps(referencia_excel)}}}\n'.encode())
+    return salida.getvalue()
+
+def guardar_tabla_procesada(clave_cache, referencia_excel, tabla, nombre_archivo, usar_cache):
+    """Guardar en el histórico y en la caché un Excel enviado en NDJSON, directamente desde la tabla"""
+    if almacen_resultados is not None:
+        try:
+            with tramo('historico'):
+                almacen_resultados.guardar_tabla(clave_cache, referencia_excel, tabla, nombre_archivo)
+        except Exception as e:
+            print(f"Error al guardar los resultados en la base de datos: {e}")
+    if usar_cache:
+        with tramo('cache_ndjson'):
+            cache_excel.guardar(clave_cache, cuerpo_json_tabla(referencia_excel, tabla))
+
 @app.route('/api/procesar-excel', methods=['POST'])
 def procesar_excel():
     """Procesar archivo Excel y extraer datos de par (Nm)"""
+    from estadisticas_spc import acumulador_spc
+    from lectura_incremental import leer_libro_incremental
+    from modelo_piezas import TablaPiezas
+    from procesador_excel import MODOS_LECTURA, VERSION_PROCESADOR, FormatoExcelError, leer_libro, tabla_piezas
     try:
         if 'file' not in request.files:
             return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
@@ -89,352 +336,414 @@ def procesar_excel():
         file = request.files['file']
         if file.filename == '':
             return jsonify({'error': 'No se seleccionó ningún archivo'}), 400
-        
-        # Leer solo la pestaña "Análisis de test"
+        nombre_archivo = file.filename
+        
+        # Modo de lectura: 'streaming' (openpyxl solo lectura) o 'completa' (pd.read_excel)
+        # Si no se indica, los archivos grandes se leen en streaming
+        modo_lectura = request.args.get('lectura') or request.form.get('lectura')
+        if modo_lectura and modo_lectura not in MODOS_LECTURA:
+            return jsonify({'error': f'Modo de lectura no válido: {modo_lectura}'}), 400
+        
+        # Lectura incremental: si el libro ya se leyó y solo tiene filas nuevas al final, se leen solo esas
+        incremental = (request.args.get('incremental') or request.form.get('incremental')) == '1'
+        
+        # Formato de respuesta: 'json' (un objeto con todas las piezas) o 'ndjson' (una pieza por línea)
+        formato = request.args.get('formato') or request.form.get('formato') or 'json'
+        if formato not in ('json', 'ndjson'):
+            return jsonify({'error': f'Formato no válido: {formato}'}), 400
+        
+        # Un archivo ya procesado se devuelve directamente desde la caché (clave = SHA-256 del contenido)
+        with tramo('lectura_peticion'):
+            datos_archivo = file.read()
+        usar_cache = request.args.get('cache', '1') != '0'
+        with tramo('hash_contenido'):
+            clave_cache = clave_contenido(datos_archivo, VERSION_PROCESADOR)
+        anotar(bytes_excel=len(datos_archivo))
+        if usar_cache:
+            cuerpo = cache_excel.obtener(clave_cache)
+            if cuerpo is not None:
+                resultado = json.loads(cuerpo)
+                # Las estadísticas y el histórico también reciben el Excel servido desde la caché
+                # (una pieza repetida sustituye a la anterior y el histórico no duplica la misma clave)
+                with tramo('estadisticas_spc'):
+                    acumulador_spc.anadir(resultado['referencia_excel'], TablaPiezas.desde_dict(resultado['piezas']))
+                if almacen_resultados is not None:
+                    try:
+                        with tramo('historico'):
+                            almacen_resultados.guardar(clave_cache, resultado['referencia_excel'],
+                                                       resultado['piezas'], nombre_archivo)
+                    except Exception as e:
+                        print(f"Error al guardar los resultados en la base de datos: {e}")
+                if formato == 'ndjson':
+                    piezas = sorted(resultado['piezas'].items(), key=lambda item: (item[1]['of'], item[1]['pieza']))
+                    respuesta = app.response_class(con_peticion(lineas_ndjson(resultado['referencia_excel'], piezas)),
+                                                   mimetype='application/x-ndjson')
+                else:
+                    respuesta = app.response_class(cuerpo, mimetype='application/json')
+                respuesta.headers['X-Cache'] = 'HIT'
+                respuesta.headers['X-Cache-Clave'] = clave_cache
+                anotar(cache='HIT')
+                return respuesta
+        file = BytesIO(datos_archivo)
+        
+        if incremental:
+            modo_lectura = 'incremental'
+        elif not modo_lectura:
+            modo_lectura = 'streaming' if len(datos_archivo) > UMBRAL_LECTURA_STREAMING else 'completa'
+        
+        info_incremental = None
         try:
-            df = pd.read_excel(file, sheet_name='Análisis de test', header=None)
-        except ValueError:
-            # Si no existe la pestaña, intentar leer la primera
-            file.seek(0)  # Resetear el archivo
-            df = pd.read_excel(file, header=None)
-            return jsonify({'error': 'No se encontró la pestaña "Análisis de test"'}), 400
-        
-        # Extraer referencia del título (fila 0, columna 0)
-        referencia_excel = None
-        if len(df) > 0 and pd.notna(df.iloc[0, 0]):
-            titulo = str(df.iloc[0, 0])
-            # Buscar patrón de referencia en el título
-            match = re.search(r'Referencia\s+([a-zA-Z0-9]+)', titulo)
-            if match:
-                referencia_excel = match.group(1)
-        
-        # Los encabezados están en la fila 2 (índice 2)
-        # Datos empiezan en la fila 3 (índice 3)
-        if len(df) < 3:
-            return jsonify({'error': 'El archivo Excel no tiene el formato esperado'}), 400
-        
-        # Mapeo de NumPaso a porcentaje: solo pasos 0 y 4 (0% y 100%)
-        paso_to_percent = {0: '0', 4: '100'}
-        
-        # Procesar datos agrupados por Pieza y NumPaso
-        # Usar un diccionario para acumular valores y contar ocurrencias
-        datos_acumulados = {}
-        # Diccionario separado para consumos del paso 5 (solo para el 100%)
-        consumos_paso5 = {}
-        
-        # Iterar desde la fila 3 (índice 3) en adelante
-        # Detener cuando encontremos líneas en blanco (todas las columnas relevantes vacías)
-        for idx in range(3, len(df)):
-            row = df.iloc[idx]
-            
-            # Verificar si la fila está completamente vacía o tiene líneas en blanco
-            # Verificar columnas clave: Pieza (columna B, índice 1), OF (columna D, índice 3), NumPaso (columna E, índice 4)
-            # valores de par (columnas H e I, índices 7 y 8) y consumo (columnas J e K, índices 9 y 10)
-            # Si todas las columnas relevantes están vacías, detener el procesamiento
-            try:
-                if (pd.isna(row.iloc[1]) and pd.isna(row.iloc[3]) and pd.isna(row.iloc[4]) and 
-                    pd.isna(row.iloc[7]) and pd.isna(row.iloc[8]) and 
-                    pd.isna(row.iloc[9]) and pd.isna(row.iloc[10])):
-                    # Si todas las columnas relevantes están vacías, detener el procesamiento
-                    break
-            except IndexError:
-                # Si no hay suficientes columnas, detener el procesamiento
-                break
-            
-            # Verificar que la fila tenga datos válidos en Pieza
-            try:
-                if pd.isna(row.iloc[1]):  # Columna Pieza
-                    continue
-            except IndexError:
-                continue
-            
-            try:
-                pieza = int(row.iloc[1])  # Columna B (índice 1): Pieza
-                of = int(row.iloc[3]) if pd.notna(row.iloc[3]) else None  # Columna D (índice 3): OF (Orden de Fabricación)
-                num_paso = int(row.iloc[4]) if pd.notna(row.iloc[4]) else None  # Columna E (índice 4): NumPaso
-                
-                # Validar que OF y num_paso sean válidos
-                if of is None or num_paso is None:
-                    continue
-                
-                # Columnas J e K (índices 9 y 10) contienen los valores de consumo en amperios
-                consumo_izda = round(float(row.iloc[9]), 2) if pd.notna(row.iloc[9]) else 0  # Columna J (índice 9): Consumo Izquierda (A)
-                consumo_drch = round(float(row.iloc[10]), 2) if pd.notna(row.iloc[10]) else 0  # Columna K (índice 10): Consumo Derecha (A)
-                
-                # Si es NumPaso 5, guardar los consumos y el valor de la columna L para el 100%
-                if num_paso == 5:
-                    key_paso5 = (of, pieza)
-                    # Columna L (índice 11) contiene un valor adicional para el paso 5
-                    valor_columna_l = round(float(row.iloc[11]), 2) if pd.notna(row.iloc[11]) and len(row) > 11 else 0
-                    consumos_paso5[key_paso5] = {
-                        'consumo_izquierda': consumo_izda,
-                        'consumo_derecha': consumo_drch,
-                        'valor_columna_l': valor_columna_l
-                    }
-                    continue
-                
-                # Para pasos 0 y 4, procesar normalmente
-                if num_paso not in paso_to_percent:
-                    continue
-                
-                # Columnas H e I (índices 7 y 8) contienen los valores de par en Nm
-                # Redondear a 1 decimal para mantener la precisión del Excel
-                par_izda = round(float(row.iloc[7]), 1) if pd.notna(row.iloc[7]) else 0  # Columna H (índice 7): Par Izquierda
-                par_drch = round(float(row.iloc[8]), 1) if pd.notna(row.iloc[8]) else 0  # Columna I (índice 8): Par Derecha
-                
-                percent = paso_to_percent[num_paso]
-                # Clave incluye OF y Pieza para diferenciar piezas del mismo número pero de distintas OF
-                key = (of, pieza, percent)
-                
-                # Si hay múltiples filas con el mismo OF, Pieza y NumPaso, se sobrescribe con la última
-                # (no se promedia, se toma el último valor encontrado)
-                datos_acumulados[key] = {
-                    'izquierda': [par_izda],  # Solo guardar el último valor
-                    'derecha': [par_drch],
-                    'consumo_izquierda': consumo_izda,  # Consumo en amperios
-                    'consumo_derecha': consumo_drch
-                }
-                
-            except (ValueError, IndexError) as e:
-                continue
-        
-        # Calcular promedios y organizar por OF y Pieza
-        datos_por_pieza = {}
-        for (of, pieza, percent), valores in datos_acumulados.items():
-            # Clave única que combina OF y Pieza
-            clave_pieza = f'OF{of}_Pieza{pieza}'
-            
-            if clave_pieza not in datos_por_pieza:
-                datos_por_pieza[clave_pieza] = {
-                    'referencia': f'Pieza {pieza} - OF {of}',
-                    'of': of,
-                    'pieza': pieza,
-                    'cargas': {
-                        '0': {'izquierda': 0, 'derecha': 0, 'consumo_izquierda': 0, 'consumo_derecha': 0, 'valor_columna_l': 0},
-                        '100': {'izquierda': 0, 'derecha': 0, 'consumo_izquierda': 0, 'consumo_derecha': 0, 'valor_columna_l': 0}
-                    }
-                }
-            
-            # Calcular promedio y redondear a 1 decimal (para par)
-            avg_izda = round(sum(valores['izquierda']) / len(valores['izquierda']), 1) if valores['izquierda'] else 0
-            avg_drch = round(sum(valores['derecha']) / len(valores['derecha']), 1) if valores['derecha'] else 0
-            
-            datos_por_pieza[clave_pieza]['cargas'][percent]['izquierda'] = avg_izda
-            datos_por_pieza[clave_pieza]['cargas'][percent]['derecha'] = avg_drch
-            
-            # Para el 100%, usar consumos del paso 5 si están disponibles, sino usar los del paso 4
-            if percent == '100':
-                key_paso5 = (of, pieza)
-                if key_paso5 in consumos_paso5:
-                    # Usar consumos del paso 5 para el 100%
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_izquierda'] = consumos_paso5[key_paso5].get('consumo_izquierda', 0)
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_derecha'] = consumos_paso5[key_paso5].get('consumo_derecha', 0)
-                    # Añadir el valor de la columna L del paso 5
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['valor_columna_l'] = consumos_paso5[key_paso5].get('valor_columna_l', 0)
+            with tramo(f'lectura_excel_{modo_lectura}'):
+                if incremental:
+                    referencia_excel, columnas, info_incremental = leer_libro_incremental(datos_archivo)
                 else:
-                    # Si no hay paso 5, usar los del paso 4
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_izquierda'] = valores.get('consumo_izquierda', 0)
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_derecha'] = valores.get('consumo_derecha', 0)
-                    datos_por_pieza[clave_pieza]['cargas'][percent]['valor_columna_l'] = 0
-            else:
-                # Para el 0%, usar consumos normalmente
-                datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_izquierda'] = valores.get('consumo_izquierda', 0)
-                datos_por_pieza[clave_pieza]['cargas'][percent]['consumo_derecha'] = valores.get('consumo_derecha', 0)
-                datos_por_pieza[clave_pieza]['cargas'][percent]['valor_columna_l'] = 0
+                    referencia_excel, columnas = leer_libro(file, modo_lectura)
+        except FormatoExcelError as e:
+            return jsonify({'error': str(e)}), 400
+        with tramo('agregacion'):
+            tabla = tabla_piezas(columnas)
+        registrar_excel(columnas, tabla, modo_lectura)
+        with tramo('estadisticas_spc'):
+            acumulador_spc.anadir(referencia_excel, tabla)
+        cabeceras = {}
+        if info_incremental is not None:
+            anotar(**{f'incremental_{clave}': valor for clave, valor in info_incremental.items()})
+            cabeceras['X-Lectura-Incremental'] = (f"{info_incremental['modo']}; reutilizadas={info_incremental['filas_reutilizadas']}; "
+                                                  f"leidas={info_incremental['filas_leidas']}")
+        
+        if formato == 'ndjson':
+            # El histórico y la caché se llenan desde la tabla al terminar: no se conservan las piezas enviadas
+            def al_terminar():
+                guardar_tabla_procesada(clave_cache, referencia_excel, tabla, nombre_archivo, usar_cache)
+            
+            respuesta = app.response_class(
+                con_peticion(lineas_ndjson(referencia_excel, tabla.iterar(), al_terminar)),
+                mimetype='application/x-ndjson',
+                headers=cabeceras
+            )
+            if usar_cache:
+                respuesta.headers['X-Cache'] = 'MISS'
+                respuesta.headers['X-Cache-Clave'] = clave_cache
+            return respuesta
+        
+        with tramo('diccionario_piezas'):
+            piezas = tabla.a_dict()
         
-        # Convertir a formato JSON
         resultado = {
             'referencia_excel': referencia_excel,
-            'piezas': {}
+            'piezas': piezas
         }
         
-        for pieza, datos in sorted(datos_por_pieza.items()):
-            resultado['piezas'][str(pieza)] = datos
+        # Guardar las piezas en el histórico (un fallo aquí no impide devolver el resultado)
+        if almacen_resultados is not None:
+            try:
+                with tramo('historico'):
+                    almacen_resultados.guardar(clave_cache, referencia_excel, piezas, nombre_archivo)
+            except Exception as e:
+                print(f"Error al guardar los resultados en la base de datos: {e}")
         
-        return jsonify(resultado)
+        with tramo('serializacion'):
+            respuesta = jsonify(resultado)
+        respuesta.headers.update(cabeceras)
+        if usar_cache:
+            cache_excel.guardar(clave_cache, respuesta.get_data())
+            respuesta.headers['X-Cache'] = 'MISS'
+            respuesta.headers['X-Cache-Clave'] = clave_cache
+        return respuesta
         
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Error al procesar el archivo: {str(e)}'}), 500
 
-@app.route('/api/generar-informe-masivo', methods=['POST'])
-def generar_informe_masivo():
-    """Generar un informe PDF para carga masiva con múltiples piezas"""
+@app.route('/api/procesar-excel-lote', methods=['POST'])
+def procesar_excel_lote():
+    """Procesar en paralelo varios Excel (o un ZIP con Excel) y combinar sus piezas"""
+    from estadisticas_spc import acumulador_spc
+    from ingesta_lote import procesar_lote
+    from modelo_piezas import TablaPiezas
+    from procesador_excel import MODOS_LECTURA
     try:
-        data = request.json
-        referencia_excel = data.get('referencia_excel', None)
-        piezas = data.get('piezas', {})
-        referencia_bmw = data.get('referencia_bmw', None)
-        dispersion_par = data.get('dispersion_par', 0)
-        dispersion_consumo = data.get('dispersion_consumo', 0)
-        # Mantener compatibilidad con versiones anteriores
-        if dispersion_par == 0 and dispersion_consumo == 0:
-            dispersion_par = data.get('dispersion', 0)
-        imagen_grafico_pares = data.get('imagen_grafico_pares', None)
-        imagen_grafico_consumos = data.get('imagen_grafico_consumos', None)
+        archivos = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not archivos:
+            return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
         
-        if not piezas:
-            return jsonify({'error': 'No hay piezas para generar el informe'}), 400
+        modo_lectura = request.args.get('lectura') or request.form.get('lectura')
+        if modo_lectura and modo_lectura not in MODOS_LECTURA:
+            return jsonify({'error': f'Modo de lectura no válido: {modo_lectura}'}), 400
         
-        # Crear el PDF en memoria
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(
-            buffer, 
-            pagesize=A4,
-            leftMargin=15*mm,
-            rightMargin=15*mm,
-            topMargin=10*mm,
-            bottomMargin=15*mm
-        )
-        elements = []
-        
-        # Estilos
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            textColor=colors.HexColor('#667eea'),
-            spaceAfter=10,
-            alignment=TA_CENTER
-        )
+        workers = request.args.get('workers') or request.form.get('workers')
+        if workers is not None:
+            if not workers.isdigit() or int(workers) < 1:
+                return jsonify({'error': 'El número de workers debe ser un entero positivo'}), 400
+            workers = int(workers)
         
-        # Título
-        titulo = "Informe de Par Masivo"
-        if referencia_excel:
-            titulo += f" - {referencia_excel}"
-        elements.append(Paragraph(titulo, title_style))
-        elements.append(Spacer(1, 6))
-        
-        # Información general
-        info_data = [
-            ['Fecha:', datetime.now().strftime('%d/%m/%Y %H:%M:%S')],
-            ['Número de piezas:', str(len(piezas))]
-        ]
-        
-        if referencia_excel:
-            info_data.append(['Referencia Excel:', referencia_excel])
-        if referencia_bmw:
-            info_data.append(['Referencia BMW:', referencia_bmw])
-        if dispersion_par > 0:
-            info_data.append(['Dispersión Par:', f'{dispersion_par}%'])
-        if dispersion_consumo > 0:
-            info_data.append(['Dispersión Consumo:', f'{dispersion_consumo}%'])
-        
-        info_table = Table(info_data, colWidths=[60*mm, 130*mm])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.grey),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 4),
-            ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(info_table)
-        elements.append(Spacer(1, 10))
-        
-        # Tabla resumen de todas las piezas (solo 0% y 100%)
-        resumen_headers = [['Pieza', '0% Par (Nm)', '0% Consumo (A)', '100% Par (Nm)', '100% Consumo (A)', 'Ruido']]
-        resumen_data = resumen_headers.copy()
-        
-        # Ordenar piezas por OF y número de pieza
-        piezas_ordenadas = sorted(piezas.items(), key=lambda x: (
-            x[1].get('of', 0),
-            x[1].get('pieza', 0)
-        ))
-        
-        for pieza_id, pieza_info in piezas_ordenadas:
-            referencia = pieza_info.get('referencia', pieza_id)
-            cargas = pieza_info.get('cargas', {})
-            
-            # Calcular valores para 0% y 100%
-            valores = []
-            for percent in ['0', '100']:
-                if percent in cargas:
-                    izda = cargas[percent].get('izquierda', 0)
-                    drch = cargas[percent].get('derecha', 0)
-                    promedio_par = (abs(izda) + abs(drch)) / 2
-                    consumo_izda = cargas[percent].get('consumo_izquierda', 0)
-                    consumo_drch = cargas[percent].get('consumo_derecha', 0)
-                    promedio_consumo = (abs(consumo_izda) + abs(consumo_drch)) / 2
-                    valores.append(f'{promedio_par:.1f}')
-                    valores.append(f'{promedio_consumo:.2f}')
-                else:
-                    valores.append('-')
-                    valores.append('-')
-            
-            # Añadir valor de columna L solo para el 100%
-            valor_columna_l = cargas.get('100', {}).get('valor_columna_l', 0)
-            valores.append(f'{valor_columna_l:.2f}' if valor_columna_l > 0 else '-')
-            
-            resumen_data.append([referencia] + valores)
-        
-        resumen_table = Table(resumen_data, colWidths=[45*mm, 25*mm, 25*mm, 25*mm, 25*mm, 25*mm])
-        resumen_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-        ]))
-        elements.append(resumen_table)
-        elements.append(Spacer(1, 10))
-        
-        # Añadir gráfico de pares si está disponible
-        if imagen_grafico_pares:
-            try:
-                # Decodificar la imagen base64
-                imagen_data = imagen_grafico_pares.split(',')[1] if ',' in imagen_grafico_pares else imagen_grafico_pares
-                imagen_bytes = base64.b64decode(imagen_data)
-                
-                # Crear objeto Image desde bytes
-                img_buffer = BytesIO(imagen_bytes)
-                img = Image(img_buffer, width=170*mm, height=120*mm)
-                img.hAlign = 'CENTER'
-                
-                elements.append(Paragraph('Gráfico de Par (Nm)', styles['Heading2']))
-                elements.append(Spacer(1, 12))
-                elements.append(img)
-            except Exception as e:
-                print(f"Error al añadir gráfico de pares al PDF: {e}")
+        resultado, procesados = procesar_lote([(f.filename, f.read()) for f in archivos], modo_lectura,
+                                              workers, UMBRAL_LECTURA_STREAMING)
         
-        # Salto de página antes del gráfico de consumos
-        if imagen_grafico_consumos:
-            elements.append(PageBreak())
+        for info in procesados:
+            acumulador_spc.anadir(info['referencia_excel'], TablaPiezas.desde_dict(info['piezas']))
         
-        # Añadir gráfico de consumos si está disponible
-        if imagen_grafico_consumos:
-            try:
-                # Decodificar la imagen base64
-                imagen_data = imagen_grafico_consumos.split(',')[1] if ',' in imagen_grafico_consumos else imagen_grafico_consumos
-                imagen_bytes = base64.b64decode(imagen_data)
-                
-                # Crear objeto Image desde bytes
-                img_buffer = BytesIO(imagen_bytes)
-                img = Image(img_buffer, width=170*mm, height=120*mm)
-                img.hAlign = 'CENTER'
-                
-                elements.append(Paragraph('Gráfico de Consumo (A)', styles['Heading2']))
-                elements.append(Spacer(1, 12))
-                elements.append(img)
-            except Exception as e:
-                print(f"Error al añadir gráfico de consumos al PDF: {e}")
+        # Guardar cada Excel correcto en el histórico (un fallo aquí no impide devolver el resultado)
+        if almacen_resultados is not None:
+            for info in procesados:
+                try:
+                    almacen_resultados.guardar(info['clave'], info['referencia_excel'], info['piezas'], info['archivo'])
+                except Exception as e:
+                    print(f"Error al guardar los resultados en la base de datos: {e}")
         
-        # Construir PDF
-        doc.build(elements)
-        buffer.seek(0)
+        return jsonify({'success': True, **resultado})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Error al procesar los archivos: {str(e)}'}), 500
+
+@app.route('/api/exportar', methods=['POST'])
+def exportar_resultados():
+    """Exportar las piezas de uno o varios Excel (o ZIP) como tabla larga en CSV, Parquet o Excel"""
+    import tempfile
+    from exportacion_resultados import (COLUMNAS_EVALUACION, COLUMNAS_EXPORTACION, FORMATOS_EXPORTACION,
+                                        escribir_csv, escribir_parquet, escribir_xlsx, parquet_disponible,
+                                        tabla_larga)
+    from ingesta_lote import expandir_archivos, procesar_archivos
+    from procesador_excel import MODOS_LECTURA
+    try:
+        archivos = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not archivos:
+            return jsonify({'error': 'No se proporcionó ningún archivo'}), 400
         
-        # Nombre del archivo
-        nombre_archivo = f"Informe_Masivo_{referencia_excel.replace(' ', '_') if referencia_excel else datetime.now().strftime('%Y%m%d')}.pdf"
+        parametros = request.args.to_dict() | request.form.to_dict()
+        formato = parametros.get('formato', 'csv')
+        if formato not in FORMATOS_EXPORTACION:
+            return jsonify({'error': f'Formato no válido: {formato}'}), 400
+        if formato == 'parquet' and not parquet_disponible():
+            return jsonify({'error': 'La exportación a Parquet necesita pyarrow (pip install pyarrow)'}), 501
+        modo_lectura = parametros.get('lectura')
+        if modo_lectura and modo_lectura not in MODOS_LECTURA:
+            return jsonify({'error': f'Modo de lectura no válido: {modo_lectura}'}), 400
+        workers = parametros.get('workers')
+        if workers is not None:
+            if not workers.isdigit() or int(workers) < 1:
+                return jsonify({'error': 'El número de workers debe ser un entero positivo'}), 400
+            workers = int(workers)
+        
+        # Resultado OK / NOK frente a un patrón (opcional)
+        referencia_bmw = parametros.get('referencia_bmw')
+        patron = None
+        if referencia_bmw:
+            patron = registro_patrones.todos().get(referencia_bmw)
+            if patron is None:
+                return jsonify({'error': 'Patrón no encontrado'}), 404
+        dispersion_par = float(parametros.get('dispersion_par', 0) or 0)
+        dispersion_consumo = float(parametros.get('dispersion_consumo', 0) or 0)
+        evaluar = bool(patron) and (dispersion_par > 0 or dispersion_consumo > 0)
+        
+        with tramo('lectura_excel_lote'):
+            excel, errores = expandir_archivos([(f.filename, f.read()) for f in archivos])
+            infos, _ = procesar_archivos(excel, modo_lectura, workers, UMBRAL_LECTURA_STREAMING)
+        procesados = [info for info in infos if info['estado'] == 'ok']
+        errores += [info for info in infos if info['estado'] != 'ok']
+        if not procesados:
+            return jsonify({'error': 'No se pudo procesar ningún archivo', 'archivos': errores}), 400
+        anotar(archivos=len(procesados), errores=len(errores), formato=formato)
+        
+        columnas = COLUMNAS_EXPORTACION + (COLUMNAS_EVALUACION if evaluar else [])
+        
+        def bloques():
+            # Una tabla larga por Excel: solo el bloque en curso está en memoria como filas
+            for info in procesados:
+                with tramo('tabla_larga'):
+                    bloque = tabla_larga(info.pop('tabla'), info['referencia_excel'], info['archivo'],
+                                         patron, dispersion_par, dispersion_consumo)
+                metricas.incrementar('cargas_filas_exportadas_total', len(bloque['valor']), formato=formato)
+                yield bloque
+        
+        mimetype, extension = FORMATOS_EXPORTACION[formato]
+        nombre_base = procesados[0]['referencia_excel'] if len(procesados) == 1 else None
+        nombre_archivo = f"Resultados_{(nombre_base or datetime.now().strftime('%Y%m%d')).replace(' ', '_')}.{extension}"
+        cabeceras = {'Content-Disposition': f'attachment; filename="{nombre_archivo}"',
+                     'X-Exportacion-Archivos': str(len(procesados)),
+                     'X-Exportacion-Errores': str(len(errores))}
+        
+        # CSV: se envía a medida que se genera cada bloque
+        if formato == 'csv':
+            return app.response_class(con_peticion(escribir_csv(bloques(), columnas)), mimetype=mimetype,
+                                      headers=cabeceras)
+        
+        # Parquet y Excel se escriben en un archivo temporal (el formato necesita el archivo completo)
+        destino = tempfile.TemporaryFile()
+        with tramo(f'escritura_{formato}'):
+            if formato == 'parquet':
+                escribir_parquet(bloques(), columnas, destino)
+            else:
+                escribir_xlsx(bloques(), columnas, destino)
+        destino.seek(0)
+        respuesta = send_file(destino, mimetype=mimetype, as_attachment=True, download_name=nombre_archivo)
+        respuesta.headers.update({clave: valor for clave, valor in cabeceras.items() if clave.startswith('X-')})
+        return respuesta
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Error al exportar los resultados: {str(e)}'}), 500
+
+@app.route('/api/resultados', methods=['GET'])
+def consultar_resultados():
+    """Consultar el histórico de piezas por referencia, OF, pieza y rango de fechas (paginado)"""
+    if almacen_resultados is None:
+        return jsonify({'error': 'El histórico de resultados está desactivado'}), 404
+    return jsonify(almacen_resultados.consultar(
+        pagina=request.args.get('pagina', 1, type=int),
+        por_pagina=request.args.get('por_pagina', 100, type=int),
+        referencia=request.args.get('referencia'),
+        of=request.args.get('of', type=int),
+        pieza=request.args.get('pieza', type=int),
+        desde=request.args.get('desde'),
+        hasta=request.args.get('hasta')
+    ))
+
+@app.route('/api/resultados/cargas', methods=['GET'])
+def consultar_cargas_excel():
+    """Consultar los Excel guardados en el histórico (paginado)"""
+    if almacen_resultados is None:
+        return jsonify({'error': 'El histórico de resultados está desactivado'}), 404
+    return jsonify(almacen_resultados.consultar_cargas(
+        pagina=request.args.get('pagina', 1, type=int),
+        por_pagina=request.args.get('por_pagina', 100, type=int),
+        referencia=request.args.get('referencia'),
+        desde=request.args.get('desde'),
+        hasta=request.args.get('hasta')
+    ))
+
+@app.route('/api/cache-excel', methods=['GET'])
+def estado_cache_excel():
+    """Obtener los contadores de la caché de Excel procesados"""
+    return jsonify(cache_excel.estadisticas())
+
+@app.route('/api/cache-excel', methods=['DELETE'])
+@app.route('/api/cache-excel/<clave>', methods=['DELETE'])
+def invalidar_cache_excel(clave=None):
+    """Invalidar una entrada de la caché de Excel procesados (o toda la caché)"""
+    if clave is not None and not re.fullmatch(r'[0-9a-f]{64}-v[\w.]+', clave):
+        return jsonify({'error': 'Clave de caché no válida'}), 400
+    return jsonify({'success': True, 'eliminadas': cache_excel.invalidar(clave)})
+
+@app.route('/api/evaluar-tolerancias', methods=['POST'])
+def evaluar_tolerancias():
+    """Evaluar todas las piezas frente a un patrón y sus dispersiones (OK / NOK por pieza)"""
+    from evaluacion_tolerancias import evaluar_piezas
+    try:
+        data = request.json
+        piezas = data.get('piezas', {})
+        if not piezas:
+            return jsonify({'error': 'No hay piezas para evaluar'}), 400
+        
+        # Patrón de patrones_carga.json por su referencia o enviado directamente
+        patron = data.get('patron')
+        referencia_bmw = data.get('referencia_bmw')
+        if patron is None and referencia_bmw:
+            patron = registro_patrones.todos().get(referencia_bmw)
+            if patron is None:
+                return jsonify({'error': 'Patrón no encontrado'}), 404
+        if not patron:
+            return jsonify({'error': 'Indique referencia_bmw o un patrón'}), 400
+        
+        dispersion_par = float(data.get('dispersion_par', 0) or 0)
+        dispersion_consumo = float(data.get('dispersion_consumo', 0) or 0)
+        if dispersion_par <= 0 and dispersion_consumo <= 0:
+            return jsonify({'error': 'La dispersión de par o de consumo debe ser mayor que 0'}), 400
+        
+        evaluacion = evaluar_piezas(piezas, patron, dispersion_par, dispersion_consumo,
+                                    detalle=request.args.get('detalle', '1') != '0')
+        return jsonify({'success': True, 'referencia_bmw': referencia_bmw, **evaluacion})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+def parametros_estadisticas(fuente):
+    """Patrón, dispersiones y percentiles de /api/estadisticas (JSON o parámetros de la URL).
+
+    Lanza ValueError si algún valor no es válido y LookupError si el patrón no existe.
+    """
+    patron = fuente.get('patron')
+    referencia_bmw = fuente.get('referencia_bmw')
+    if patron is None and referencia_bmw:
+        patron = registro_patrones.todos().get(referencia_bmw)
+        if patron is None:
+            raise LookupError('Patrón no encontrado')
+    if patron is not None and not isinstance(patron, dict):
+        raise ValueError('El patrón debe ser un objeto con las cargas por porcentaje')
+    dispersion_par = float(fuente.get('dispersion_par', 0) or 0)
+    dispersion_consumo = float(fuente.get('dispersion_consumo', 0) or 0)
+    percentiles = fuente.get('percentiles') or [5, 50, 95]
+    if isinstance(percentiles, str):
+        percentiles = percentiles.split(',')
+    percentiles = [float(p) for p in percentiles]
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise ValueError('Los percentiles deben estar entre 0 y 100')
+    return {'patron': patron, 'dispersion_par': dispersion_par, 'dispersion_consumo': dispersion_consumo,
+            'percentiles': percentiles}
+
+@app.route('/api/estadisticas', methods=['POST'])
+def calcular_estadisticas_piezas():
+    """Estadísticas SPC (por OF y total) de las piezas enviadas"""
+    from estadisticas_spc import calcular_estadisticas
+    from modelo_piezas import TablaPiezas
+    try:
+        data = request.json
+        piezas = data.get('piezas', {})
+        if not piezas:
+            return jsonify({'error': 'No hay piezas para calcular las estadísticas'}), 400
+        parametros = parametros_estadisticas(data)
+        with tramo('estadisticas_spc'):
+            estadisticas = calcular_estadisticas(TablaPiezas.desde_dict(piezas), **parametros)
+        return jsonify({'success': True, 'referencia_bmw': data.get('referencia_bmw'), **estadisticas})
+    except LookupError as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+@app.route('/api/estadisticas', methods=['GET'])
+def referencias_estadisticas():
+    """Referencias con piezas acumuladas de los Excel procesados"""
+    from estadisticas_spc import acumulador_spc
+    return jsonify(acumulador_spc.referencias())
+
+@app.route('/api/estadisticas/<referencia_excel>', methods=['GET'])
+def estadisticas_referencia(referencia_excel):
+    """Estadísticas SPC de las piezas acumuladas de una referencia_excel"""
+    from estadisticas_spc import acumulador_spc
+    try:
+        parametros = parametros_estadisticas(request.args)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    with tramo('estadisticas_spc'):
+        estadisticas = acumulador_spc.estadisticas(referencia_excel, **parametros)
+    if estadisticas is None:
+        return jsonify({'error': 'No hay piezas de esa referencia'}), 404
+    return jsonify({'referencia_excel': referencia_excel, 'referencia_bmw': request.args.get('referencia_bmw'),
+                    **estadisticas})
+
+@app.route('/api/estadisticas', methods=['DELETE'])
+@app.route('/api/estadisticas/<referencia_excel>', methods=['DELETE'])
+def reiniciar_estadisticas(referencia_excel=None):
+    """Olvidar las piezas acumuladas de una referencia (o de todas)"""
+    from estadisticas_spc import acumulador_spc
+    return jsonify({'success': True, 'eliminadas': acumulador_spc.eliminar(referencia_excel)})
+
+@app.route('/api/generar-informe-masivo', methods=['POST'])
+def generar_informe_masivo():
+    """Generar un informe PDF para carga masiva con múltiples piezas"""
+    from informes_pdf import construir_informe_masivo
+    try:
+        data = request.json
+        if not data.get('piezas', {}):
+            return jsonify({'error': 'No hay piezas para generar el informe'}), 400
+        
+        buffer, nombre_archivo = construir_informe_masivo(data)
+        registrar_pdf(buffer, 'masivo', len(data['piezas']))
         
         return send_file(
             buffer,
@@ -447,161 +756,109 @@ def generar_informe_masivo():
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/generar-informe', methods=['POST'])
-def generar_informe():
-    """Generar un informe PDF"""
+@app.route('/api/generar-informes-lote', methods=['POST'])
+def generar_informes_lote():
+    """Generar un informe individual por pieza en paralelo y devolverlos en un ZIP"""
+    from informes_lote import WORKERS_INFORMES, generar_zip_informes
+    from pool_procesos import limitar_workers
     try:
         data = request.json
-        referencia = data.get('referencia', 'Sin referencia')
-        cargas = data.get('cargas', {})
-        referencia_bmw = data.get('referencia_bmw', None)
-        dispersion_par = data.get('dispersion_par', 0)
-        dispersion_consumo = data.get('dispersion_consumo', 0)
-        # Mantener compatibilidad con versiones anteriores
-        if dispersion_par == 0 and dispersion_consumo == 0:
-            dispersion_par = data.get('dispersion', 0)
-        ruido = data.get('ruido', 0)
-        imagen_grafico_pares = data.get('imagen_grafico_pares', None)
-        imagen_grafico_consumos = data.get('imagen_grafico_consumos', None)
-        # Mantener compatibilidad con versiones anteriores
-        if not imagen_grafico_pares and not imagen_grafico_consumos:
-            imagen_grafico_pares = data.get('imagen_grafico', None)
-        
-        # Crear el PDF en memoria con márgenes reducidos
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(
-            buffer, 
-            pagesize=A4,
-            leftMargin=15*mm,
-            rightMargin=15*mm,
-            topMargin=10*mm,
-            bottomMargin=15*mm
-        )
-        elements = []
-        
-        # Estilos
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=16,
-            textColor=colors.HexColor('#667eea'),
-            spaceAfter=10,
-            alignment=TA_CENTER
-        )
-        
-        # Título
-        elements.append(Paragraph(f"Informe de Par - {referencia}", title_style))
-        elements.append(Spacer(1, 6))
-        
-        # Información general
-        info_data = [
-            ['Referencia:', referencia],
-            ['Fecha:', datetime.now().strftime('%d/%m/%Y %H:%M:%S')]
-        ]
-        
-        if referencia_bmw:
-            info_data.append(['Referencia BMW:', referencia_bmw])
-        if dispersion_par > 0:
-            info_data.append(['Dispersión Par:', f'{dispersion_par}%'])
-        if dispersion_consumo > 0:
-            info_data.append(['Dispersión Consumo:', f'{dispersion_consumo}%'])
-        
-        info_table = Table(info_data, colWidths=[60*mm, 130*mm])
-        info_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (0, -1), colors.grey),
-            ('TEXTCOLOR', (0, 0), (0, -1), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-            ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('TOPPADDING', (0, 0), (-1, -1), 4),
-            ('BACKGROUND', (1, 0), (1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black)
-        ]))
-        elements.append(info_table)
-        elements.append(Spacer(1, 10))
-        
-        # Tabla de cargas (solo 0% y 100%)
-        carga_headers = [['Porcentaje', 'Par Izquierda (Nm)', 'Par Derecha (Nm)', 'Consumo Izquierda (A)', 'Consumo Derecha (A)', 'Ruido']]
-        carga_data = carga_headers.copy()
-        
-        for percent in ['0', '100']:
-            if percent in cargas:
-                # Para el 100%, mostrar el valor del ruido del box; para el 0%, mostrar '-'
-                valor_ruido = ruido if percent == '100' else 0
-                carga_data.append([
-                    f'{percent}%',
-                    f"{cargas[percent].get('izquierda', 0):.1f}",
-                    f"{cargas[percent].get('derecha', 0):.1f}",
-                    f"{cargas[percent].get('consumo_izquierda', 0):.2f}",
-                    f"{cargas[percent].get('consumo_derecha', 0):.2f}",
-                    f"{valor_ruido:.2f}" if valor_ruido > 0 else '-'
-                ])
-        
-        carga_table = Table(carga_data, colWidths=[30*mm, 30*mm, 30*mm, 30*mm, 30*mm, 30*mm])
-        carga_table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 1, colors.black),
-            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-        ]))
-        elements.append(Paragraph('Datos de Par y Consumo', styles['Heading2']))
-        elements.append(Spacer(1, 6))
-        elements.append(carga_table)
-        elements.append(Spacer(1, 10))
-        
-        # Añadir gráfico de pares si está disponible
-        if imagen_grafico_pares:
-            try:
-                # Decodificar la imagen base64
-                imagen_data = imagen_grafico_pares.split(',')[1] if ',' in imagen_grafico_pares else imagen_grafico_pares
-                imagen_bytes = base64.b64decode(imagen_data)
-                
-                # Crear objeto Image desde bytes
-                img_buffer = BytesIO(imagen_bytes)
-                img = Image(img_buffer, width=170*mm, height=120*mm)
-                img.hAlign = 'CENTER'
-                
-                elements.append(Paragraph('Gráfico de Par (Nm)', styles['Heading2']))
-                elements.append(Spacer(1, 12))
-                elements.append(img)
-            except Exception as e:
-                print(f"Error al añadir gráfico de pares al PDF: {e}")
+        piezas = data.get('piezas', {})
+        if not piezas:
+            return jsonify({'error': 'No hay piezas para generar los informes'}), 400
         
-        # Salto de página antes del gráfico de consumos
-        if imagen_grafico_consumos:
-            elements.append(PageBreak())
+        workers = data.get('workers')
+        if workers is not None and (not isinstance(workers, int) or workers < 1):
+            return jsonify({'error': 'El número de workers debe ser un entero positivo'}), 400
         
-        # Añadir gráfico de consumos si está disponible
-        if imagen_grafico_consumos:
-            try:
-                # Decodificar la imagen base64
-                imagen_data = imagen_grafico_consumos.split(',')[1] if ',' in imagen_grafico_consumos else imagen_grafico_consumos
-                imagen_bytes = base64.b64decode(imagen_data)
-                
-                # Crear objeto Image desde bytes
-                img_buffer = BytesIO(imagen_bytes)
-                img = Image(img_buffer, width=170*mm, height=120*mm)
-                img.hAlign = 'CENTER'
-                
-                elements.append(Paragraph('Gráfico de Consumo (A)', styles['Heading2']))
-                elements.append(Spacer(1, 12))
-                elements.append(img)
-            except Exception as e:
-                print(f"Error al añadir gráfico de consumos al PDF: {e}")
+        # Datos comunes a todos los informes (referencia BMW y dispersiones)
+        comunes = {
+            'referencia_bmw': data.get('referencia_bmw', None),
+            'dispersion_par': data.get('dispersion_par', 0),
+            'dispersion_consumo': data.get('dispersion_consumo', 0)
+        }
         
-        # Construir PDF
-        doc.build(elements)
-        buffer.seek(0)
+        referencia_excel = data.get('referencia_excel', None)
+        nombre_archivo = f"Informes_{referencia_excel.replace(' ', '_') if referencia_excel else datetime.now().strftime('%Y%m%d')}.zip"
         
-        # Nombre del archivo
-        nombre_archivo = f"Informe_{referencia.replace(' ', '_')}.pdf"
+        try:
+            contenido = generar_zip_informes(piezas, comunes, workers)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        respuesta = app.response_class(con_peticion(contenido), mimetype='application/zip')
+        respuesta.headers['Content-Disposition'] = f'attachment; filename="{nombre_archivo}"'
+        respuesta.headers['X-Num-Informes'] = str(len(piezas))
+        # Procesos que usa el pool: `workers` no pasa de INFORMES_WORKERS (o del número de CPUs)
+        respuesta.headers['X-Informes-Workers'] = str(limitar_workers(workers, WORKERS_INFORMES))
+        return respuesta
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/trabajos/informe-masivo', methods=['POST'])
+@app.route('/api/trabajos/informe', methods=['POST'])
+def enviar_trabajo_informe():
+    """Encolar la generación de un informe PDF y devolver el id del trabajo"""
+    from informes_pdf import construir_informe, construir_informe_masivo
+    try:
+        data = request.json
+        if request.path.endswith('/informe-masivo'):
+            if not data.get('piezas', {}):
+                return jsonify({'error': 'No hay piezas para generar el informe'}), 400
+            id_trabajo = cola_informes.enviar('informe_masivo', construir_informe_masivo, data)
+        else:
+            id_trabajo = cola_informes.enviar('informe', construir_informe, data)
+        
+        return jsonify({
+            'success': True,
+            'id': id_trabajo,
+            'estado': cola_informes.estado(id_trabajo)['estado'],
+            'url_estado': f'/api/trabajos/{id_trabajo}',
+            'url_descarga': f'/api/trabajos/{id_trabajo}/descarga'
+        }), 202
+    except ColaLlenaError as e:
+        respuesta = jsonify({'error': str(e)})
+        respuesta.status_code = 503
+        respuesta.headers['Retry-After'] = str(REINTENTO_TRABAJOS_S)
+        return respuesta
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/trabajos/<id_trabajo>', methods=['GET'])
+def estado_trabajo(id_trabajo):
+    """Obtener el estado y el progreso de un trabajo"""
+    estado = cola_informes.estado(id_trabajo)
+    if estado is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    return jsonify(estado)
+
+@app.route('/api/trabajos/<id_trabajo>/descarga', methods=['GET'])
+def descargar_trabajo(id_trabajo):
+    """Descargar el PDF de un trabajo terminado"""
+    estado = cola_informes.estado(id_trabajo)
+    if estado is None:
+        return jsonify({'error': 'Trabajo no encontrado'}), 404
+    resultado = cola_informes.resultado(id_trabajo)
+    if resultado is None:
+        return jsonify({'error': f'El trabajo no ha terminado (estado: {estado["estado"]})'}), 409
+    
+    ruta, nombre_archivo = resultado
+    return send_file(
+        ruta,
+        mimetype='application/pdf',
+        as_attachment=True,
+        download_name=nombre_archivo
+    )
+
+@app.route('/api/generar-informe', methods=['POST'])
+def generar_informe():
+    """Generar un informe PDF"""
+    from informes_pdf import construir_informe
+    try:
+        buffer, nombre_archivo = construir_informe(request.json)
+        registrar_pdf(buffer, 'individual', 1)
         
         return send_file(
             buffer,
@@ -0,0 +1,84 @@
+"""Medir el tiempo de importación de app.py (python -X importtime) frente a un presupuesto.
+
+Cada medición arranca un intérprete nuevo. Además de `import app`, comprueba que pandas, openpyxl,
+NumPy y ReportLab no se importan al arrancar (se cargan en la primera petición que los usa).
+
+Uso:
+    python benchmarks/bench_arranque.py [--repeticiones 5] [--presupuesto-ms 400] [--modulos 15]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+RAIZ = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MODULOS_PESADOS = ('pandas', 'openpyxl', 'numpy', 'reportlab')
+PRESUPUESTO_MS = 400
+
+# "import time:       self [us] |  cumulative | imported package"
+_LINEA_IMPORTTIME = re.compile(r'import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)')
+
+_SCRIPT = ('import sys, app; '
+           'print(",".join(m for m in {pesados!r} if m in sys.modules))').format(pesados=MODULOS_PESADOS)
+
+
+def importar_app():
+    """Ejecutar `import app` con -X importtime; devuelve ({módulo: µs acumulados}, módulos pesados cargados)"""
+    entorno = dict(os.environ, RESULTADOS_DB='')
+    proceso = subprocess.run([sys.executable, '-X', 'importtime', '-c', _SCRIPT], cwd=RAIZ, env=entorno,
+                             capture_output=True, text=True, check=True)
+    acumulados = {}
+    for linea in proceso.stderr.splitlines():
+        coincidencia = _LINEA_IMPORTTIME.match(linea)
+        if coincidencia:
+            # Solo los módulos de primer nivel (sin sangría) suman el tiempo total
+            acumulados[coincidencia.group(4)] = (int(coincidencia.group(2)), len(coincidencia.group(3)) <= 1)
+    pesados = [m for m in proceso.stdout.strip().split(',') if m]
+    return acumulados, pesados
+
+
+def medir_arranque(repeticiones=5, modulos=15):
+    """Mediana del tiempo de importación de app y de los módulos que más tardan"""
+    medidas = [importar_app() for _ in range(repeticiones)]
+    tiempos_app = sorted(acumulados['app'][0] for acumulados, _ in medidas)
+    tiempos_total = sorted(sum(us for us, primer_nivel in acumulados.values() if primer_nivel)
+                           for acumulados, _ in medidas)
+    ultimo = medidas[-1][0]
+    principales = sorted(((nombre, us) for nombre, (us, _) in ultimo.items() if nombre != 'app'),
+                         key=lambda item: item[1], reverse=True)[:modulos]
+    return {
+        'import_app_ms': round(tiempos_app[len(tiempos_app) // 2] / 1000, 1),
+        'import_total_ms': round(tiempos_total[len(tiempos_total) // 2] / 1000, 1),
+        'repeticiones': repeticiones,
+        'modulos_pesados': medidas[-1][1],
+        'principales': [{'modulo': nombre, 'ms': round(us / 1000, 1)} for nombre, us in principales],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--presupuesto-ms', type=float, default=PRESUPUESTO_MS)
+    parser.add_argument('--modulos', type=int, default=15, help='Módulos más lentos a mostrar')
+    args = parser.parse_args()
+
+    arranque = medir_arranque(args.repeticiones, args.modulos)
+    print(f"{'Módulo':<40} {'ms':>8}")
+    for fila in arranque['principales']:
+        print(f"{fila['modulo']:<40} {fila['ms']:>8.1f}")
+    print(f"\nimport app: {arranque['import_app_ms']:.1f} ms (mediana de {args.repeticiones}), "
+          f"presupuesto {args.presupuesto_ms:.0f} ms")
+
+    errores = []
+    if arranque['modulos_pesados']:
+        errores.append(f"Módulos pesados importados al arrancar: {', '.join(arranque['modulos_pesados'])}")
+    if arranque['import_app_ms'] > args.presupuesto_ms:
+        errores.append('Se ha superado el presupuesto de arranque')
+    if errores:
+        raise SystemExit('\n'.join(errores))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+"""Medir /api/procesar-excel, /api/generar-informe y /api/generar-informe-masivo con libros sintéticos.
+
+Cada escenario es OFs x piezas por OF x repeticiones del ensayo. Para cada endpoint se guardan los
+percentiles de latencia, el rendimiento y el pico de memoria en un JSON, para comparar ejecuciones,
+junto con el tiempo de importación de app.py (bench_arranque.py).
+
+Uso:
+    python benchmarks/bench_endpoints.py [--escenarios 2x20x1 10x40x2] [--iteraciones 10]
+                                         [--salida resultados.json] [--comparar anterior.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from io import BytesIO
+
+import numpy as np
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, RAIZ)
+
+# El benchmark no debe escribir en el histórico de resultados.db
+os.environ.setdefault('RESULTADOS_DB', '')
+
+from app import app  # noqa: E402
+from bench_arranque import medir_arranque  # noqa: E402
+from generador_excel import NUM_PASOS, libro_sintetico  # noqa: E402
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def estadisticas(tiempos):
+    """Percentiles de latencia (ms) y peticiones por segundo"""
+    tiempos_ms = np.array(tiempos) * 1000
+    resultado = {f'p{p}_ms': round(float(np.percentile(tiempos_ms, p)), 3) for p in PERCENTILES}
+    resultado.update({
+        'media_ms': round(float(tiempos_ms.mean()), 3),
+        'min_ms': round(float(tiempos_ms.min()), 3),
+        'max_ms': round(float(tiempos_ms.max()), 3),
+        'peticiones_por_segundo': round(len(tiempos) / sum(tiempos), 3),
+        'iteraciones': len(tiempos),
+    })
+    return resultado
+
+
+def medir_endpoint(peticion, iteraciones, calentamiento=1):
+    """Tiempos de `peticion()` (que devuelve la respuesta) y pico de memoria de una ejecución aparte"""
+    for _ in range(calentamiento):
+        peticion()
+    tiempos = []
+    respuesta = None
+    for _ in range(iteraciones):
+        inicio = time.perf_counter()
+        respuesta = peticion()
+        tiempos.append(time.perf_counter() - inicio)
+        if respuesta.status_code != 200:
+            raise SystemExit(f'Respuesta {respuesta.status_code}: {respuesta.get_data(as_text=True)[:200]}')
+
+    # tracemalloc ralentiza la ejecución: el pico se mide en una petición que no cuenta para los tiempos
+    tracemalloc.start()
+    peticion()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    resultado = estadisticas(tiempos)
+    resultado['pico_memoria_mb'] = round(pico / 1024 / 1024, 3)
+    resultado['bytes_respuesta'] = len(respuesta.get_data())
+    return resultado, respuesta
+
+
+def ejecutar_escenario(cliente, ofs, piezas_por_of, repeticiones, iteraciones, lectura):
+    datos = libro_sintetico(ofs, piezas_por_of, repeticiones)
+    filas = ofs * piezas_por_of * repeticiones * NUM_PASOS
+    endpoints = {}
+
+    def procesar():
+        return cliente.post(f'/api/procesar-excel?cache=0&lectura={lectura}',
+                            data={'file': (BytesIO(datos), 'sintetico.xlsx')})
+
+    endpoints['procesar_excel'], respuesta = medir_endpoint(procesar, iteraciones)
+    endpoints['procesar_excel']['filas_por_segundo'] = round(
+        filas * endpoints['procesar_excel']['peticiones_por_segundo'], 1)
+    resultado = respuesta.get_json()
+    piezas = resultado['piezas']
+
+    comunes = {'referencia_excel': resultado['referencia_excel'], 'referencia_bmw': 'LA',
+               'dispersion_par': 5, 'dispersion_consumo': 5}
+    endpoints['generar_informe_masivo'], _ = medir_endpoint(
+        lambda: cliente.post('/api/generar-informe-masivo', json=dict(comunes, piezas=piezas)), iteraciones)
+
+    primera = next(iter(piezas.values()))
+    datos_informe = dict(comunes, referencia=primera['referencia'], cargas=primera['cargas'],
+                         ruido=primera['cargas']['100']['valor_columna_l'])
+    endpoints['generar_informe'], _ = medir_endpoint(
+        lambda: cliente.post('/api/generar-informe', json=datos_informe), iteraciones)
+
+    return {
+        'escenario': f'{ofs}x{piezas_por_of}x{repeticiones}',
+        'ofs': ofs,
+        'piezas_por_of': piezas_por_of,
+        'repeticiones': repeticiones,
+        'filas': filas,
+        'piezas': len(piezas),
+        'bytes_excel': len(datos),
+        'lectura': lectura,
+        'endpoints': endpoints,
+    }
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(actual, anterior):
+    """Imprimir la variación de la p50 respecto a una ejecución anterior"""
+    previos = {(e['escenario'], e['lectura']): e for e in anterior['escenarios']}
+    print(f"\nComparación con {anterior.get('commit') or '?'} ({anterior.get('fecha')}):")
+    if 'arranque' in anterior:
+        print(f"  {'arranque':>12} {'import app':<24} {anterior['arranque']['import_app_ms']:>10.1f} -> "
+              f"{actual['arranque']['import_app_ms']:>10.1f} ms")
+    for escenario in actual['escenarios']:
+        previo = previos.get((escenario['escenario'], escenario['lectura']))
+        if previo is None:
+            continue
+        for endpoint, medidas in escenario['endpoints'].items():
+            p50_previo = previo['endpoints'].get(endpoint, {}).get('p50_ms')
+            if p50_previo:
+                cambio = (medidas['p50_ms'] - p50_previo) / p50_previo * 100
+                print(f"  {escenario['escenario']:>12} {endpoint:<24} {p50_previo:>10.1f} -> "
+                      f"{medidas['p50_ms']:>10.1f} ms ({cambio:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escenarios', nargs='+', default=['2x20x1', '10x40x2'],
+                        help='OFs x piezas por OF x repeticiones del ensayo')
+    parser.add_argument('--iteraciones', type=int, default=10)
+    parser.add_argument('--lectura', choices=['completa', 'streaming'], default='completa')
+    parser.add_argument('--salida', default=None, help='JSON de resultados (por defecto, bench_endpoints_<fecha>.json)')
+    parser.add_argument('--comparar', default=None, help='JSON de una ejecución anterior')
+    args = parser.parse_args()
+
+    cliente = app.test_client()
+    resultados = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'cpus': os.cpu_count(),
+        'arranque': medir_arranque(repeticiones=3),
+        'escenarios': [],
+    }
+    print(f"import app: {resultados['arranque']['import_app_ms']:.1f} ms\n")
+
+    print(f"{'Escenario':>12} {'Endpoint':<24} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} {'pet/s':>8} {'pico MB':>8}")
+    for escenario in args.escenarios:
+        ofs, piezas_por_of, repeticiones = (int(valor) for valor in escenario.lower().split('x'))
+        resultado = ejecutar_escenario(cliente, ofs, piezas_por_of, repeticiones, args.iteraciones, args.lectura)
+        resultados['escenarios'].append(resultado)
+        for endpoint, medidas in resultado['endpoints'].items():
+            print(f"{resultado['escenario']:>12} {endpoint:<24} {medidas['p50_ms']:>10.1f} {medidas['p95_ms']:>10.1f} "
+                  f"{medidas['p99_ms']:>10.1f} {medidas['peticiones_por_segundo']:>8.2f} "
+                  f"{medidas['pico_memoria_mb']:>8.1f}")
+
+    # Memoria máxima del proceso (KB en Linux)
+    resultados['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    salida = args.salida or f"bench_endpoints_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(resultados, f, ensure_ascii=False, indent=2)
+    print(f'\nResultados guardados en {salida}')
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            comparar(resultados, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
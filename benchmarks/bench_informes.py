@@ -0,0 +1,95 @@
+"""Coste de preparación por informe: estilos construidos en cada llamada frente a plantillas precompiladas.
+
+Uso:
+    python benchmarks/bench_informes.py [--repeticiones 200] [--piezas 50]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from reportlab.lib import colors  # noqa: E402
+from reportlab.lib.enums import TA_CENTER  # noqa: E402
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet  # noqa: E402
+from reportlab.platypus import Table, TableStyle  # noqa: E402
+
+import informes_pdf  # noqa: E402
+
+
+def preparacion_por_llamada():
+    """Preparación que hacía cada informe antes: hoja de estilos, título y TableStyle nuevos"""
+    styles = getSampleStyleSheet()
+    ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18,
+                   textColor=colors.HexColor('#667eea'), spaceAfter=10, alignment=TA_CENTER)
+    for comandos in (informes_pdf.ESTILO_TABLA_INFO, informes_pdf.ESTILO_TABLA_RESUMEN,
+                     informes_pdf.ESTILO_TABLA_CARGAS):
+        # Misma lista de comandos que antes se escribía literalmente en cada endpoint
+        Table([['x', 'y']]).setStyle(TableStyle(list(comandos.getCommands())))
+
+
+def preparacion_precompilada():
+    """Preparación actual: se reutilizan las plantillas del módulo informes_pdf"""
+    for estilo in (informes_pdf.ESTILO_TABLA_INFO, informes_pdf.ESTILO_TABLA_RESUMEN,
+                   informes_pdf.ESTILO_TABLA_CARGAS):
+        Table([['x', 'y']]).setStyle(estilo)
+
+
+def piezas_sinteticas(num_piezas):
+    """Piezas con el formato de /api/procesar-excel"""
+    piezas = {}
+    for i in range(num_piezas):
+        of, pieza = 347935 + i // 20, i % 20 + 1
+        piezas[f'OF{of}_Pieza{pieza}'] = {
+            'referencia': f'Pieza {pieza} - OF {of}', 'of': of, 'pieza': pieza,
+            'cargas': {
+                '0': {'izquierda': 2.5, 'derecha': 2.6, 'consumo_izquierda': 3.5,
+                      'consumo_derecha': 3.6, 'valor_columna_l': 0},
+                '100': {'izquierda': 6.5 + i % 3, 'derecha': 6.6, 'consumo_izquierda': 26,
+                        'consumo_derecha': 25, 'valor_columna_l': 0.8},
+            }
+        }
+    return piezas
+
+
+def medir(funcion, repeticiones):
+    """Tiempos (s) de cada ejecución"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def resumen(nombre, tiempos):
+    print(f'{nombre:<40} media {statistics.mean(tiempos) * 1000:8.3f} ms   '
+          f'p95 {sorted(tiempos)[int(len(tiempos) * 0.95) - 1] * 1000:8.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeticiones', type=int, default=200)
+    parser.add_argument('--piezas', type=int, default=50)
+    args = parser.parse_args()
+
+    antes = medir(preparacion_por_llamada, args.repeticiones)
+    despues = medir(preparacion_precompilada, args.repeticiones)
+    resumen('Preparación por llamada (antes)', antes)
+    resumen('Plantillas precompiladas', despues)
+    print(f'Ahorro por informe: {(statistics.mean(antes) - statistics.mean(despues)) * 1000:.3f} ms\n')
+
+    piezas = piezas_sinteticas(args.piezas)
+    datos_masivo = {'referencia_excel': 'BENCH', 'piezas': piezas, 'referencia_bmw': 'LA', 'dispersion_par': 10}
+    datos_individual = dict(next(iter(piezas.values())), referencia_bmw='LA')
+    repeticiones_pdf = max(1, args.repeticiones // 10)
+    resumen('Informe individual completo', medir(lambda: informes_pdf.construir_informe(datos_individual),
+                                                 repeticiones_pdf))
+    resumen(f'Informe masivo completo ({args.piezas} piezas)',
+            medir(lambda: informes_pdf.construir_informe_masivo(datos_masivo), repeticiones_pdf))
+
+
+if __name__ == '__main__':
+    main()
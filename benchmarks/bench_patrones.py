@@ -0,0 +1,124 @@
+"""Búsqueda del patrón más parecido: índice vectorizado frente a comparar pieza a pieza en Python.
+
+Genera una biblioteca de patrones sintéticos y piezas cercanas a patrones conocidos, mide la
+construcción del índice, la búsqueda (con y sin la conversión del diccionario de la API) y comprueba
+que el patrón encontrado es el mismo que con la comparación directa.
+
+Uso:
+    python benchmarks/bench_patrones.py [--patrones 500] [--piezas 5000] [--repeticiones 5] [--ruido 0.05]
+"""
+import argparse
+import math
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np  # noqa: E402
+
+from indice_patrones import CARACTERISTICAS, IndicePatrones, patrones_cercanos  # noqa: E402
+from modelo_piezas import TablaPiezas  # noqa: E402
+
+
+def patrones_sinteticos(num_patrones, semilla=0):
+    """Patrones con el formato de patrones_carga.json"""
+    rng = np.random.default_rng(semilla)
+    patrones = {}
+    for i in range(num_patrones):
+        par_0, par_100 = rng.uniform(1, 10), rng.uniform(5, 500)
+        consumo_0, consumo_100 = rng.uniform(2, 15), rng.uniform(10, 40)
+        patrones[f'P{i:04d}'] = {
+            '0': {'izquierda': par_0, 'derecha': par_0 * rng.uniform(0.95, 1.05), 'consumo_izquierda': consumo_0,
+                  'consumo_derecha': consumo_0 * rng.uniform(0.95, 1.05), 'valor_columna_l': 0.8},
+            '100': {'izquierda': par_100, 'derecha': par_100 * rng.uniform(0.95, 1.05),
+                    'consumo_izquierda': consumo_100, 'consumo_derecha': consumo_100 * rng.uniform(0.95, 1.05),
+                    'valor_columna_l': rng.uniform(0.5, 3)},
+        }
+    return patrones
+
+
+def piezas_sinteticas(patrones, num_piezas, ruido, semilla=1):
+    """Piezas del formato de la API alrededor de patrones elegidos al azar; devuelve (piezas, patrón de cada pieza)"""
+    rng = np.random.default_rng(semilla)
+    ids = list(patrones)
+    piezas, origen = {}, []
+    for i in range(num_piezas):
+        patron_id = ids[rng.integers(len(ids))]
+        of, pieza = 347935 + i // 200, i % 200 + 1
+        piezas[f'OF{of}_Pieza{pieza}'] = {
+            'referencia': f'Pieza {pieza} - OF {of}', 'of': of, 'pieza': pieza,
+            'cargas': {percent: {campo: valor * (1 + rng.normal(0, ruido)) for campo, valor in cargas.items()}
+                       for percent, cargas in patrones[patron_id].items()},
+        }
+        origen.append(patron_id)
+    return piezas, origen
+
+
+def buscar_en_python(piezas, patrones):
+    """Comparación directa: para cada pieza, la distancia a cada patrón en un bucle de Python"""
+    resultado = []
+    for pieza_info in piezas.values():
+        mejor, mejor_distancia = None, math.inf
+        for patron_id, patron in patrones.items():
+            suma, comunes = 0.0, 0
+            for percent, campo in CARACTERISTICAS:
+                valor = abs(pieza_info['cargas'].get(percent, {}).get(campo, 0) or 0)
+                referencia = abs(patron.get(percent, {}).get(campo, 0) or 0)
+                if valor and referencia:
+                    suma += ((valor - referencia) / referencia) ** 2
+                    comunes += 1
+            if comunes and math.sqrt(suma / comunes) < mejor_distancia:
+                mejor, mejor_distancia = patron_id, math.sqrt(suma / comunes)
+        resultado.append(mejor)
+    return resultado
+
+
+def medir(funcion, repeticiones):
+    """Mediana (s) de las ejecuciones y resultado de la última"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos), resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--patrones', type=int, default=500)
+    parser.add_argument('--piezas', type=int, default=5000)
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--ruido', type=float, default=0.05, help='Desviación relativa de las piezas respecto a su patrón')
+    parser.add_argument('--sin-python', action='store_true', help='No medir la comparación en Python (lenta)')
+    args = parser.parse_args()
+
+    patrones = patrones_sinteticos(args.patrones)
+    piezas, origen = piezas_sinteticas(patrones, args.piezas, args.ruido)
+    tabla = TablaPiezas.desde_dict(piezas)
+
+    t_indice, indice = medir(lambda: IndicePatrones(patrones), args.repeticiones)
+    t_busqueda, (mejor, _, _, _) = medir(lambda: indice.buscar(tabla), args.repeticiones)
+    t_api, resultado = medir(lambda: patrones_cercanos(piezas, indice=indice), args.repeticiones)
+    encontrados = [indice.ids[posicion] for posicion in mejor.tolist()]
+    aciertos = sum(a == b for a, b in zip(encontrados, origen))
+
+    comparaciones = args.patrones * args.piezas
+    print(f'{args.patrones} patrones x {args.piezas} piezas ({comparaciones:,} distancias), ruido {args.ruido:.0%}')
+    print(f"{'Construir índice':<34} {t_indice * 1000:>10.2f} ms")
+    print(f"{'Búsqueda (TablaPiezas)':<34} {t_busqueda * 1000:>10.2f} ms  "
+          f'{comparaciones / t_busqueda / 1e6:>8.1f} M distancias/s')
+    print(f"{'patrones_cercanos (dict de la API)':<34} {t_api * 1000:>10.2f} ms  {args.piezas / t_api:>8.0f} piezas/s")
+    print(f'Patrón de origen recuperado: {aciertos}/{args.piezas}; '
+          f"patrón del lote: {resultado['resumen']['patron']}")
+
+    if not args.sin_python:
+        t_python, en_python = medir(lambda: buscar_en_python(piezas, patrones), 1)
+        coinciden = sum(a == b for a, b in zip(encontrados, en_python))
+        print(f"{'Comparación en Python':<34} {t_python * 1000:>10.2f} ms  ({t_python / t_busqueda:.0f}x)")
+        print(f'Coincide con la comparación en Python: {coinciden}/{args.piezas}')
+
+
+if __name__ == '__main__':
+    main()
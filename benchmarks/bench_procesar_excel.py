@@ -0,0 +1,112 @@
+"""Comparar el procesado fila a fila con el vectorizado sobre hojas sintéticas.
+
+También compara la memoria de las piezas en columnas (TablaPiezas) con la del diccionario JSON.
+
+Uso:
+    python benchmarks/bench_procesar_excel.py [--filas 1000 10000 100000] [--repeticiones 3]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask, json  # noqa: E402
+
+from procesador_excel import (columnas_desde_dataframe, procesar_hoja, procesar_hoja_iterativo,  # noqa: E402
+                              tabla_piezas)
+
+
+def hoja_sintetica(filas, semilla=0):
+    """Generar una hoja "Análisis de test" (header=None) con `filas` filas de datos"""
+    rng = np.random.default_rng(semilla)
+    # Cada pieza ejecuta los pasos 0-5 y a veces repite el ensayo completo
+    pasos = np.tile(np.arange(6), filas // 6 + 1)[:filas]
+    ensayo = np.arange(filas) // 6
+    pieza = (ensayo // 2) % 40 + 1
+    of = 347000 + (ensayo // 80)
+    inicio = datetime(2025, 10, 20, 8, 0)
+
+    datos = pd.DataFrame({
+        0: [inicio + timedelta(minutes=int(i)) for i in ensayo],
+        1: pieza,
+        2: ensayo % 2,
+        3: of.astype(str),
+        4: pasos,
+        5: rng.uniform(15, 480, filas).round(1),
+        6: rng.uniform(15, 480, filas).round(2),
+        7: rng.uniform(2, 30, filas).round(1),
+        8: rng.uniform(2, 30, filas).round(1),
+        9: rng.uniform(1, 25, filas).round(1),
+        10: rng.uniform(1, 25, filas).round(1),
+        11: rng.uniform(0, 1, filas).round(1),
+    })
+    cabecera = pd.DataFrame([
+        ['Evolución por NumPaso (Referencia e06091800)'] + [None] * 11,
+        [None] * 12,
+        ['Fecha', 'Pieza', 'Test', 'OF', 'NumPaso', 'CargaIZDA', 'CargaDRCH',
+         'ParIZDA', 'ParDRCH', 'AmpIZDA', 'AmpDRCH', 'Vibr'],
+    ])
+    # Mismos tipos que devuelve pd.read_excel para la hoja real (columnas object)
+    return pd.concat([cabecera, datos], ignore_index=True)
+
+
+def medir(funcion, df, repeticiones):
+    """Mejor tiempo de `repeticiones` ejecuciones y el resultado de la última"""
+    mejor = float('inf')
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion(df)
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor, resultado
+
+
+def memoria(funcion):
+    """Bytes que siguen reservados por el resultado de `funcion` (tracemalloc)"""
+    tracemalloc.start()
+    inicio = tracemalloc.get_traced_memory()[0]
+    resultado = funcion()
+    bytes_resultado = tracemalloc.get_traced_memory()[0] - inicio
+    tracemalloc.stop()
+    del resultado
+    return bytes_resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--filas', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeticiones', type=int, default=3)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    print(f"{'Filas':>8} {'Piezas':>7} {'Iterativo (s)':>14} {'Vectorizado (s)':>16} {'Mejora':>8} "
+          f"{'Dict (KB)':>10} {'Tabla (KB)':>11}")
+    for filas in args.filas:
+        df = hoja_sintetica(filas)
+        # El bucle original es lento: con muchas filas basta con una ejecución
+        rep_iterativo = 1 if filas >= 50000 else args.repeticiones
+        t_iterativo, piezas_iterativo = medir(procesar_hoja_iterativo, df, rep_iterativo)
+        t_vectorizado, piezas_vectorizado = medir(procesar_hoja, df, args.repeticiones)
+
+        with app.app_context():
+            if json.dumps(piezas_iterativo) != json.dumps(piezas_vectorizado):
+                raise SystemExit(f'Los resultados no coinciden con {filas} filas')
+
+        # Memoria de las piezas: diccionario JSON frente a la tabla en columnas
+        columnas = columnas_desde_dataframe(df)
+        tabla = tabla_piezas(columnas)
+        kb_dict = memoria(tabla.a_dict) / 1024
+        kb_tabla = memoria(lambda: tabla_piezas(columnas)) / 1024
+
+        print(f'{filas:>8} {len(piezas_vectorizado):>7} {t_iterativo:>14.4f} {t_vectorizado:>16.4f} '
+              f'{t_iterativo / t_vectorizado:>7.1f}x {kb_dict:>10.1f} {kb_tabla:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
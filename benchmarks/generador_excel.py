@@ -0,0 +1,81 @@
+"""Generar libros Excel sintéticos con el formato de la pestaña "Análisis de test".
+
+Mismo formato que los Excel del banco: título "Evolución por NumPaso (Referencia X)" en A1, encabezados en
+la fila 3 y una fila por paso (NumPaso 0-5) desde la fila 4, con Pieza (B), OF (D, como texto),
+NumPaso (E), pares (H-I), consumos (J-K) y vibración (L).
+
+Uso:
+    python benchmarks/generador_excel.py salida.xlsx [--ofs 5] [--piezas 40] [--repeticiones 2]
+"""
+import argparse
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+
+ENCABEZADOS = ['Fecha', 'Pieza', 'Test', 'OF', 'NumPaso', 'CargaIZDA', 'CargaDRCH',
+               'ParIZDA', 'ParDRCH', 'AmpIZDA', 'AmpDRCH', 'Vibr']
+NUM_PASOS = 6
+PRIMERA_OF = 347935
+
+
+def filas_sinteticas(ofs, piezas_por_of, repeticiones=1, semilla=0):
+    """Generar las filas de datos: cada pieza de cada OF ejecuta los pasos 0-5 `repeticiones` veces"""
+    rng = np.random.default_rng(semilla)
+    fecha = datetime(2025, 10, 20, 8, 0)
+    for indice_of in range(ofs):
+        of = str(PRIMERA_OF + indice_of)
+        for pieza in range(1, piezas_por_of + 1):
+            # Cada pieza tiene su propio nivel de par y consumo, con ruido entre repeticiones
+            par_base = rng.uniform(2, 10)
+            consumo_base = rng.uniform(2, 14)
+            for test in range(repeticiones):
+                fecha += timedelta(minutes=3)
+                for paso in range(NUM_PASOS):
+                    carga = 18 + paso * rng.uniform(80, 100)
+                    par = par_base * (1 + paso * 0.4)
+                    consumo = consumo_base * (1 + paso * 0.3)
+                    yield [
+                        fecha, pieza, test, of, paso,
+                        round(carga + rng.normal(0, 2), 1), round(carga + rng.normal(0, 2), 2),
+                        round(par + rng.normal(0, 0.2), 1), round(par + rng.normal(0, 0.2), 1),
+                        round(consumo + rng.normal(0, 0.3), 1), round(consumo + rng.normal(0, 0.3), 1),
+                        round(abs(rng.normal(0.4, 0.3)), 1) if paso == 5 else 0,
+                    ]
+
+
+def libro_sintetico(ofs=5, piezas_por_of=40, repeticiones=1, referencia='e06091800', semilla=0):
+    """Bytes de un .xlsx sintético con ofs × piezas_por_of × repeticiones × 6 filas de datos"""
+    libro = openpyxl.Workbook(write_only=True)
+    # Las otras pestañas del libro real no se procesan, pero se incluyen para que la lectura sea realista
+    libro.create_sheet('Análisis global').append(['Análisis global'])
+    libro.create_sheet('Análisis mecánico').append(['Análisis mecánico'])
+    hoja = libro.create_sheet('Análisis de test')
+    hoja.append([f'Evolución por NumPaso (Referencia {referencia})'])
+    hoja.append([])
+    hoja.append(ENCABEZADOS)
+    for fila in filas_sinteticas(ofs, piezas_por_of, repeticiones, semilla):
+        hoja.append(fila)
+    salida = BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('salida')
+    parser.add_argument('--ofs', type=int, default=5)
+    parser.add_argument('--piezas', type=int, default=40)
+    parser.add_argument('--repeticiones', type=int, default=1)
+    parser.add_argument('--referencia', default='e06091800')
+    args = parser.parse_args()
+
+    datos = libro_sintetico(args.ofs, args.piezas, args.repeticiones, args.referencia)
+    with open(args.salida, 'wb') as f:
+        f.write(datos)
+    print(f'{args.salida}: {args.ofs * args.piezas * args.repeticiones * NUM_PASOS} filas, {len(datos)} bytes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Caché de resultados de Excel procesados, direccionada por contenido (SHA-256 del archivo)"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+
+def clave_contenido(datos, version):
+    """Clave de caché: SHA-256 de los bytes subidos más la versión del procesador"""
+    return f'{hashlib.sha256(datos).hexdigest()}-v{version}'
+
+
+class CacheResultados:
+    """Caché LRU en memoria con límite de bytes y nivel opcional en disco.
+
+    Los valores son los bytes JSON ya serializados de la respuesta, de modo que un acierto
+    se devuelve sin volver a serializar.
+    """
+
+    def __init__(self, max_bytes, directorio=None):
+        self.max_bytes = max_bytes
+        self.directorio = directorio
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.aciertos_disco = 0
+        self.fallos = 0
+        self.desalojos = 0
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f'{clave}.json')
+
+    def obtener(self, clave):
+        """Devolver los bytes guardados para `clave` o None"""
+        with self._lock:
+            if clave in self._entradas:
+                self._entradas.move_to_end(clave)
+                self.aciertos += 1
+                return self._entradas[clave]
+
+        if self.directorio:
+            try:
+                with open(self._ruta(clave), 'rb') as f:
+                    valor = f.read()
+            except OSError:
+                valor = None
+            if valor is not None:
+                with self._lock:
+                    self.aciertos += 1
+                    self.aciertos_disco += 1
+                    self._guardar_memoria(clave, valor)
+                return valor
+
+        with self._lock:
+            self.fallos += 1
+        return None
+
+    def guardar(self, clave, valor):
+        """Guardar los bytes de un resultado en memoria (y en disco si está configurado)"""
+        with self._lock:
+            self._guardar_memoria(clave, valor)
+
+        if self.directorio:
+            # Escritura atómica para que otro proceso nunca lea un archivo a medias
+            ruta = self._ruta(clave)
+            temporal = f'{ruta}.{os.getpid()}.tmp'
+            try:
+                with open(temporal, 'wb') as f:
+                    f.write(valor)
+                os.replace(temporal, ruta)
+            except OSError as e:
+                print(f"Error al guardar en la caché de disco: {e}")
+
+    def _guardar_memoria(self, clave, valor):
+        if clave in self._entradas:
+            self._bytes -= len(self._entradas.pop(clave))
+        # Un resultado mayor que todo el presupuesto no se guarda en memoria
+        if len(valor) > self.max_bytes:
+            return
+        self._entradas[clave] = valor
+        self._bytes += len(valor)
+        while self._bytes > self.max_bytes:
+            _, desalojado = self._entradas.popitem(last=False)
+            self._bytes -= len(desalojado)
+            self.desalojos += 1
+
+    def invalidar(self, clave=None):
+        """Eliminar una entrada (o todas si no se indica clave). Devuelve cuántas se eliminaron"""
+        with self._lock:
+            if clave is None:
+                eliminadas = set(self._entradas)
+                self._entradas.clear()
+                self._bytes = 0
+            elif clave in self._entradas:
+                self._bytes -= len(self._entradas.pop(clave))
+                eliminadas = {clave}
+            else:
+                eliminadas = set()
+
+        if self.directorio:
+            if clave is None:
+                claves_disco = [n[:-len('.json')] for n in os.listdir(self.directorio) if n.endswith('.json')]
+            else:
+                claves_disco = [clave]
+            for clave_disco in claves_disco:
+                try:
+                    os.remove(self._ruta(clave_disco))
+                    eliminadas.add(clave_disco)
+                except OSError:
+                    pass
+        return len(eliminadas)
+
+    def estadisticas(self):
+        """Contadores de la caché"""
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'aciertos': self.aciertos,
+                'aciertos_disco': self.aciertos_disco,
+                'fallos': self.fallos,
+                'desalojos': self.desalojos,
+                'directorio': self.directorio,
+            }
@@ -0,0 +1,201 @@
+"""Valores manuales de la página principal (/api/data), separados por estación de ensayo.
+
+Cada estación tiene una instantánea inmutable (datos, JSON ya serializado, versión) que se sustituye
+entera en cada actualización: las lecturas no necesitan bloqueo y nunca ven un estado a medias.
+Los clientes que esperan un cambio (long-poll) se despiertan con una condición compartida; cada uno ocupa
+un hilo del servidor mientras espera, así que el número de esperas simultáneas está limitado.
+
+`AlmacenEstacionesCompartido` guarda las estaciones en la base de datos de estado (ESTADO_DB) para que
+varios procesos worker vean los mismos datos y se avisen de los cambios.
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from patrones import serializar_json
+
+PORCENTAJES = ('0', '100')
+CAMPOS = ('izquierda', 'derecha', 'consumo_izquierda', 'consumo_derecha')
+ESTACION_POR_DEFECTO = 'default'
+_PATRON_ESTACION = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class EsperasAgotadasError(RuntimeError):
+    """Se ha alcanzado el máximo de clientes esperando cambios a la vez"""
+
+
+class Instantanea:
+    """Estado de una estación en una versión; no se modifica después de crearse"""
+
+    __slots__ = ('datos', 'json_bytes', 'version', 'origen')
+
+    def __init__(self, datos, version, origen=None, json_bytes=None):
+        self.datos = datos
+        self.json_bytes = json_bytes or serializar_json(datos)
+        self.version = version
+        # Cliente que hizo el cambio, para que no vuelva a aplicarse sus propios datos
+        self.origen = origen
+
+
+class AlmacenEstaciones:
+    """Datos de cada estación con número de versión y aviso de cambios.
+
+    Con `max_estaciones` estaciones, una nueva sustituye a la actualizada hace más tiempo. Las versiones
+    salen de un contador común a todas las estaciones, así una estación olvidada y vuelta a crear no
+    repite versiones (ni ETag) con otros datos.
+    """
+
+    def __init__(self, max_estaciones=100, max_esperas=16):
+        self.max_estaciones = max_estaciones
+        self.max_esperas = max_esperas
+        self.esperando = 0
+        # Distingue los ETag de distintos arranques del servidor (las versiones empiezan otra vez en 0)
+        self.instancia = uuid.uuid4().hex[:8]
+        # Estaciones de la actualizada hace más tiempo a la más reciente
+        self._estaciones = OrderedDict()
+        self._ultima_version = 0
+        self._cambio = threading.Condition()
+        self._inicial = Instantanea({percent: {campo: 0 for campo in CAMPOS} for percent in PORCENTAJES}, 0)
+
+    @staticmethod
+    def validar_estacion(estacion):
+        if not _PATRON_ESTACION.match(estacion):
+            raise ValueError(f'Estación no válida: {estacion}')
+        return estacion
+
+    def __len__(self):
+        return len(self._estaciones)
+
+    def obtener(self, estacion):
+        """Instantánea actual de la estación (versión 0 si nunca se ha actualizado)"""
+        return self._estaciones.get(estacion, self._inicial)
+
+    def etag(self, estacion, instantanea):
+        return f'{self.instancia}-{estacion}-{instantanea.version}'
+
+    @staticmethod
+    def _valores(nuevos):
+        return {
+            percent: {campo: float(valores.get(campo, 0)) for campo in CAMPOS}
+            for percent, valores in nuevos.items() if percent in PORCENTAJES
+        }
+
+    def actualizar(self, estacion, nuevos, origen=None):
+        """Sustituir los porcentajes recibidos y devolver la nueva instantánea.
+
+        Si ningún valor cambia se devuelve la instantánea actual, sin nueva versión ni aviso a las esperas.
+        """
+        valores = self._valores(nuevos)
+        with self._cambio:
+            actual = self.obtener(estacion)
+            datos = {**actual.datos, **valores}
+            if datos == actual.datos:
+                return actual
+            if estacion not in self._estaciones:
+                while self._estaciones and len(self._estaciones) >= self.max_estaciones:
+                    self._estaciones.popitem(last=False)
+            self._ultima_version += 1
+            instantanea = Instantanea(datos, self._ultima_version, origen)
+            self._estaciones[estacion] = instantanea
+            self._estaciones.move_to_end(estacion)
+            self._cambio.notify_all()
+        return instantanea
+
+    def esperar_cambio(self, estacion, version, timeout):
+        """Esperar hasta `timeout` segundos a que la versión de la estación sea distinta de `version`.
+
+        Devuelve la nueva instantánea o None si no ha cambiado; EsperasAgotadasError si ya hay
+        `max_esperas` clientes esperando.
+        """
+        with self._cambio:
+            if self.esperando >= self.max_esperas:
+                raise EsperasAgotadasError(f'Demasiados clientes esperando cambios ({self.max_esperas})')
+            self.esperando += 1
+            try:
+                cambiado = self._cambio.wait_for(lambda: self.obtener(estacion).version != version, timeout)
+            finally:
+                self.esperando -= 1
+            return self.obtener(estacion) if cambiado else None
+
+
+class AlmacenEstacionesCompartido(AlmacenEstaciones):
+    """AlmacenEstaciones con las estaciones en la base de datos de estado, común a todos los workers.
+
+    Cada proceso despierta a sus esperas con un hilo que consulta la última versión cada `intervalo_s`
+    segundos (solo mientras hay alguien esperando); `max_esperas` es por proceso.
+    """
+
+    def __init__(self, base_datos, max_estaciones=100, max_esperas=16, intervalo_s=0.2):
+        super().__init__(max_estaciones, max_esperas)
+        self.base_datos = base_datos
+        self.intervalo_s = intervalo_s
+        # Proceso en el que corre el hilo que vigila los cambios (un fork no hereda el hilo)
+        self._pid_vigilante = None
+
+    def __len__(self):
+        return self.base_datos.leer('SELECT COUNT(*) FROM estaciones')[0][0]
+
+    def _instantanea(self, fila):
+        if fila is None:
+            return self._inicial
+        return Instantanea(json.loads(fila['json']), fila['version'], fila['origen'], bytes(fila['json']))
+
+    def obtener(self, estacion):
+        filas = self.base_datos.leer('SELECT json, version, origen FROM estaciones WHERE estacion = ?', (estacion,))
+        return self._instantanea(filas[0] if filas else None)
+
+    def etag(self, estacion, instantanea):
+        return f'{self.base_datos.instancia()}-{estacion}-{instantanea.version}'
+
+    def actualizar(self, estacion, nuevos, origen=None):
+        valores = self._valores(nuevos)
+        with self.base_datos.transaccion() as conexion:
+            fila = conexion.execute('SELECT json, version, origen FROM estaciones WHERE estacion = ?',
+                                    (estacion,)).fetchone()
+            actual = self._instantanea(fila)
+            datos = {**actual.datos, **valores}
+            if datos == actual.datos:
+                return actual
+            if fila is None:
+                sobrantes = conexion.execute('SELECT COUNT(*) FROM estaciones').fetchone()[0] - self.max_estaciones + 1
+                if sobrantes > 0:
+                    conexion.execute('DELETE FROM estaciones WHERE estacion IN '
+                                     '(SELECT estacion FROM estaciones ORDER BY version LIMIT ?)', (sobrantes,))
+            conexion.execute("UPDATE estado_meta SET valor = valor + 1 WHERE clave = 'ultima_version'")
+            version = conexion.execute("SELECT valor FROM estado_meta WHERE clave = 'ultima_version'").fetchone()[0]
+            instantanea = Instantanea(datos, version, origen)
+            conexion.execute('INSERT OR REPLACE INTO estaciones (estacion, json, version, origen) VALUES (?, ?, ?, ?)',
+                             (estacion, instantanea.json_bytes, version, origen))
+        with self._cambio:
+            self._cambio.notify_all()
+        return instantanea
+
+    def _version_actual(self):
+        return self.base_datos.leer("SELECT valor FROM estado_meta WHERE clave = 'ultima_version'")[0][0]
+
+    def _vigilar(self):
+        """Avisar a las esperas de este proceso cuando otro proceso cambia una estación"""
+        ultima = self._version_actual()
+        while True:
+            time.sleep(self.intervalo_s)
+            if not self.esperando:
+                continue
+            try:
+                version = self._version_actual()
+            except Exception:
+                continue
+            if version != ultima:
+                ultima = version
+                with self._cambio:
+                    self._cambio.notify_all()
+
+    def esperar_cambio(self, estacion, version, timeout):
+        with self._cambio:
+            if self._pid_vigilante != os.getpid():
+                self._pid_vigilante = os.getpid()
+                threading.Thread(target=self._vigilar, name='vigilar_estaciones', daemon=True).start()
+        return super().esperar_cambio(estacion, version, timeout)
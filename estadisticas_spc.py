@@ -0,0 +1,242 @@
+"""Estadísticas de proceso (SPC) de las piezas por OF y por referencia.
+
+Para el par y el consumo (izquierda y derecha) al 0% y al 100% se calcula media, desviación típica,
+mínimo, máximo y percentiles, Cp/Cpk frente a las bandas del patrón y la asimetría izquierda - derecha.
+Todos los grupos (cada OF y el total) se calculan a la vez con reducciones de NumPy sobre las piezas
+ordenadas por grupo.
+
+`AcumuladorSPC` guarda las piezas de cada referencia_excel según llegan los Excel (una pieza repetida
+sustituye a la anterior) y recalcula las estadísticas solo cuando han cambiado.
+"""
+import os
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from evaluacion_tolerancias import CAMPOS, limites_patron
+from modelo_piezas import PORCENTAJES, TablaPiezas
+
+PERCENTILES = (5, 50, 95)
+# Asimetría izquierda - derecha de cada magnitud: (nombre, campo izquierdo, campo derecho)
+ASIMETRIAS = (('par', 0, 1), ('consumo', 2, 3))
+# Con menos piezas la desviación típica (y por tanto Cp/Cpk) no tiene sentido
+MIN_PIEZAS_CAPACIDAD = 2
+# Desviación relativa a la media por debajo de la cual es solo error de redondeo (los valores son iguales)
+STD_RELATIVA_MINIMA = 1e-9
+DECIMALES = 4
+
+
+def _matriz_spc(tabla):
+    """Array (n, porcentajes, 6): |cargas| de los cuatro campos y asimetría de par y consumo.
+
+    Un porcentaje sin datos (ausente o con los cuatro valores a 0, como lo devuelve la API) es NaN.
+    """
+    cargas = np.abs(tabla.valores()[:, :, :len(CAMPOS)])
+    cargas[(cargas == 0).all(axis=2)] = np.nan
+    asimetria = np.stack([cargas[:, :, izq] - cargas[:, :, drch] for _, izq, drch in ASIMETRIAS], axis=2)
+    return np.concatenate([cargas, asimetria], axis=2)
+
+
+def _estadisticas_grupos(valores, grupos, num_grupos, percentiles):
+    """Estadísticas de `valores` (n, ...) por grupo (índices 0..num_grupos-1), ignorando NaN.
+
+    Devuelve un diccionario de arrays (num_grupos, ...); los percentiles tienen forma (num_grupos, p, ...).
+    """
+    orden = np.argsort(grupos, kind='stable')
+    valores = valores[orden]
+    tamanos = np.bincount(grupos, minlength=num_grupos)
+    inicios = np.concatenate([[0], np.cumsum(tamanos)[:-1]])
+    # reduceat no admite grupos vacíos; aquí no los hay porque los grupos salen de np.unique
+    con_datos = ~np.isnan(valores)
+    n = np.add.reduceat(con_datos, inicios, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media = np.add.reduceat(np.where(con_datos, valores, 0.0), inicios, axis=0) / n
+        # Segunda pasada con las desviaciones respecto a la media del grupo (más estable que sum(x²))
+        desviaciones = np.where(con_datos, valores - np.repeat(media, tamanos, axis=0), 0.0)
+        m2 = np.add.reduceat(desviaciones ** 2, inicios, axis=0)
+        std = np.where(n >= MIN_PIEZAS_CAPACIDAD, np.sqrt(m2 / (n - 1)), np.nan)
+    std[std < STD_RELATIVA_MINIMA * np.abs(media)] = 0.0
+    minimo = np.fmin.reduceat(valores, inicios, axis=0)
+    maximo = np.fmax.reduceat(valores, inicios, axis=0)
+
+    with warnings.catch_warnings():
+        # Un grupo sin ningún valor en un campo da NaN (y un aviso que no interesa)
+        warnings.simplefilter('ignore', RuntimeWarning)
+        cuantiles = np.stack([np.nanpercentile(valores[inicio:inicio + tamano], percentiles, axis=0)
+                              for inicio, tamano in zip(inicios, tamanos)])
+    return {'n': n, 'media': media, 'std': std, 'min': minimo, 'max': maximo, 'percentiles': cuantiles,
+            'piezas': tamanos}
+
+
+def _capacidad(estadisticas, patron, dispersion_par, dispersion_consumo):
+    """Arrays (grupos, porcentajes, campos) de Cp y Cpk frente a las bandas del patrón (NaN sin banda)"""
+    _, evaluado, inferior, superior = limites_patron(patron, dispersion_par, dispersion_consumo)
+    media = estadisticas['media'][:, :, :len(CAMPOS)]
+    std = estadisticas['std'][:, :, :len(CAMPOS)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cp = (superior - inferior) / (6 * std)
+        cpk = np.minimum(superior - media, media - inferior) / (3 * std)
+    valido = evaluado & (std > 0)
+    return np.where(valido, cp, np.nan), np.where(valido, cpk, np.nan), inferior, superior, evaluado
+
+
+def _numero(valor):
+    return None if np.isnan(valor) else round(float(valor), DECIMALES)
+
+
+def _resumen_grupo(estadisticas, g, percentiles, capacidad):
+    """Diccionario JSON del grupo `g`"""
+    def metricas(j, k):
+        resultado = {
+            'n': int(estadisticas['n'][g, j, k]),
+            'media': _numero(estadisticas['media'][g, j, k]),
+            'std': _numero(estadisticas['std'][g, j, k]),
+            'min': _numero(estadisticas['min'][g, j, k]),
+            'max': _numero(estadisticas['max'][g, j, k]),
+        }
+        for p, percentil in enumerate(percentiles):
+            resultado[f'p{percentil:g}'] = _numero(estadisticas['percentiles'][g, p, j, k])
+        return resultado
+
+    cargas = {}
+    asimetria = {}
+    for j, percent in enumerate(PORCENTAJES):
+        cargas[percent] = {}
+        for k, campo in enumerate(CAMPOS):
+            cargas[percent][campo] = metricas(j, k)
+            if capacidad is not None:
+                cp, cpk, _, _, evaluado = capacidad
+                if evaluado[j, k]:
+                    cargas[percent][campo]['cp'] = _numero(cp[g, j, k])
+                    cargas[percent][campo]['cpk'] = _numero(cpk[g, j, k])
+        asimetria[percent] = {}
+        for a, (magnitud, izq, drch) in enumerate(ASIMETRIAS):
+            k = len(CAMPOS) + a
+            asimetria[percent][magnitud] = metricas(j, k)
+            # Asimetría relativa: diferencia media respecto a la media de los dos lados (%)
+            media_lados = (estadisticas['media'][g, j, izq] + estadisticas['media'][g, j, drch]) / 2
+            with np.errstate(divide='ignore', invalid='ignore'):
+                relativa = estadisticas['media'][g, j, k] / media_lados * 100 if media_lados > 0 else np.nan
+            asimetria[percent][magnitud]['relativa'] = _numero(relativa)
+    return {'piezas': int(estadisticas['piezas'][g]), 'cargas': cargas, 'asimetria': asimetria}
+
+
+def calcular_estadisticas(tabla, patron=None, dispersion_par=0, dispersion_consumo=0, percentiles=PERCENTILES):
+    """Estadísticas de una TablaPiezas: {'total': {...}, 'por_of': {of: {...}}, 'limites': {...}}.
+
+    Cp y Cpk solo se calculan para los valores con banda (patrón y dispersión mayor que 0).
+    """
+    percentiles = tuple(percentiles)
+    if not len(tabla):
+        return {'total': None, 'por_of': {}, 'limites': {}, 'percentiles': list(percentiles)}
+    valores = _matriz_spc(tabla)
+    ofs, grupos_of = np.unique(tabla.of, return_inverse=True)
+    por_of = _estadisticas_grupos(valores, grupos_of, len(ofs), percentiles)
+    total = _estadisticas_grupos(valores, np.zeros(len(tabla), dtype=np.int64), 1, percentiles)
+
+    capacidad_of = capacidad_total = None
+    limites = {}
+    if patron and (dispersion_par > 0 or dispersion_consumo > 0):
+        capacidad_of = _capacidad(por_of, patron, dispersion_par, dispersion_consumo)
+        capacidad_total = _capacidad(total, patron, dispersion_par, dispersion_consumo)
+        _, _, inferior, superior, evaluado = capacidad_total
+        limites = {
+            percent: {campo: {'inferior': float(inferior[j, k]), 'superior': float(superior[j, k])}
+                      for k, campo in enumerate(CAMPOS) if evaluado[j, k]}
+            for j, percent in enumerate(PORCENTAJES)
+        }
+
+    return {
+        'total': _resumen_grupo(total, 0, percentiles, capacidad_total),
+        'por_of': {str(of): _resumen_grupo(por_of, g, percentiles, capacidad_of) for g, of in enumerate(ofs.tolist())},
+        'limites': limites,
+        'percentiles': list(percentiles),
+    }
+
+
+def combinar_tablas(anterior, nueva):
+    """Tabla con las piezas de las dos; si una pieza (OF, pieza) está en ambas se queda la de `nueva`"""
+    if anterior is None or not len(anterior):
+        return nueva
+    of = np.concatenate([anterior.of, nueva.of])
+    pieza = np.concatenate([anterior.pieza, nueva.pieza])
+    # np.unique se queda con la primera aparición: se busca sobre las piezas en orden inverso
+    claves = np.stack([of, pieza], axis=1)[::-1]
+    _, primeras = np.unique(claves, axis=0, return_index=True)
+    indices = len(of) - 1 - primeras
+    return TablaPiezas(of[indices], pieza[indices],
+                       np.concatenate([anterior.cargas, nueva.cargas])[indices],
+                       np.concatenate([anterior.presentes, nueva.presentes])[indices])
+
+
+class AcumuladorSPC:
+    """Piezas recibidas por referencia_excel (LRU) y sus últimas estadísticas calculadas"""
+
+    def __init__(self, max_referencias=50):
+        self.max_referencias = max_referencias
+        self._tablas = OrderedDict()
+        # referencia -> (parámetros, versión de la tabla, estadísticas) del último cálculo
+        self._calculadas = {}
+        self._versiones = {}
+        self._lock = threading.Lock()
+
+    def anadir(self, referencia_excel, tabla):
+        """Incorporar las piezas de un Excel a su referencia"""
+        if not referencia_excel or not len(tabla):
+            return
+        with self._lock:
+            self._tablas[referencia_excel] = combinar_tablas(self._tablas.get(referencia_excel), tabla)
+            self._tablas.move_to_end(referencia_excel)
+            self._versiones[referencia_excel] = self._versiones.get(referencia_excel, 0) + 1
+            while len(self._tablas) > self.max_referencias:
+                antigua, _ = self._tablas.popitem(last=False)
+                self._olvidar(antigua)
+
+    def _olvidar(self, referencia_excel):
+        self._versiones.pop(referencia_excel, None)
+        self._calculadas.pop(referencia_excel, None)
+
+    def eliminar(self, referencia_excel=None):
+        """Olvidar las piezas de una referencia (o de todas); devuelve cuántas referencias se eliminan"""
+        with self._lock:
+            if referencia_excel is None:
+                eliminadas = len(self._tablas)
+                self._tablas.clear()
+                self._versiones.clear()
+                self._calculadas.clear()
+                return eliminadas
+            if self._tablas.pop(referencia_excel, None) is None:
+                return 0
+            self._olvidar(referencia_excel)
+            return 1
+
+    def referencias(self):
+        """{referencia_excel: {'piezas', 'ofs', 'version'}}"""
+        with self._lock:
+            return {referencia: {'piezas': len(tabla), 'ofs': int(np.unique(tabla.of).size),
+                                 'version': self._versiones[referencia]}
+                    for referencia, tabla in self._tablas.items()}
+
+    def estadisticas(self, referencia_excel, patron=None, dispersion_par=0, dispersion_consumo=0,
+                     percentiles=PERCENTILES):
+        """Estadísticas de las piezas acumuladas de la referencia (None si no hay ninguna)"""
+        parametros = (repr(patron), dispersion_par, dispersion_consumo, tuple(percentiles))
+        with self._lock:
+            tabla = self._tablas.get(referencia_excel)
+            if tabla is None:
+                return None
+            version = self._versiones[referencia_excel]
+            calculada = self._calculadas.get(referencia_excel)
+        if calculada is not None and calculada[:2] == (parametros, version):
+            return calculada[2]
+        resultado = calcular_estadisticas(tabla, patron, dispersion_par, dispersion_consumo, percentiles)
+        resultado['version'] = version
+        with self._lock:
+            if referencia_excel in self._tablas:
+                self._calculadas[referencia_excel] = (parametros, version, resultado)
+        return resultado
+
+
+acumulador_spc = AcumuladorSPC(int(os.environ.get('SPC_MAX_REFERENCIAS', 50)))
@@ -0,0 +1,101 @@
+"""Base de datos SQLite con el estado que comparten los procesos worker (ESTADO_DB).
+
+Con varios workers (servidor.py) cada proceso tiene su propia memoria: las estaciones de /api/data y los
+trabajos en segundo plano se guardan aquí para que cualquier worker responda lo mismo.
+"""
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+
+ESQUEMA = '''
+CREATE TABLE IF NOT EXISTS estado_meta (
+    clave TEXT PRIMARY KEY,
+    valor
+);
+CREATE TABLE IF NOT EXISTS estaciones (
+    estacion TEXT PRIMARY KEY,
+    json BLOB NOT NULL,
+    version INTEGER NOT NULL,
+    origen TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_estaciones_version ON estaciones(version);
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    estado TEXT NOT NULL,
+    progreso REAL NOT NULL,
+    creado REAL NOT NULL,
+    iniciado REAL,
+    terminado REAL,
+    error TEXT,
+    nombre_archivo TEXT,
+    bytes INTEGER,
+    ruta TEXT,
+    pid INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_trabajos_estado ON trabajos(estado, creado);
+'''
+
+
+class BaseDatosEstado:
+    """Archivo SQLite del estado compartido; se crea en el primer uso, no al crear el objeto"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._preparada = False
+        self._instancia = None
+        self._lock = threading.Lock()
+
+    def _preparar(self):
+        with self._lock:
+            if self._preparada:
+                return
+            conexion = sqlite3.connect(self.ruta, timeout=30)
+            try:
+                conexion.execute('PRAGMA journal_mode=WAL')
+                conexion.executescript(ESQUEMA)
+                with conexion:
+                    # Identifica la base de datos en los ETag: es la misma para todos los workers
+                    conexion.execute("INSERT OR IGNORE INTO estado_meta VALUES ('instancia', ?)", (uuid.uuid4().hex[:8],))
+                    conexion.execute("INSERT OR IGNORE INTO estado_meta VALUES ('ultima_version', 0)")
+                self._instancia = conexion.execute(
+                    "SELECT valor FROM estado_meta WHERE clave = 'instancia'").fetchone()[0]
+            finally:
+                conexion.close()
+            self._preparada = True
+
+    def conectar(self):
+        if not self._preparada:
+            self._preparar()
+        # Una conexión por operación y sin transacciones implícitas (se abren con `transaccion`)
+        conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+        conexion.row_factory = sqlite3.Row
+        return conexion
+
+    @contextmanager
+    def transaccion(self):
+        """Conexión con una transacción de escritura: lo leído dentro no cambia hasta terminar"""
+        conexion = self.conectar()
+        try:
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                yield conexion
+            except BaseException:
+                conexion.execute('ROLLBACK')
+                raise
+            conexion.execute('COMMIT')
+        finally:
+            conexion.close()
+
+    def leer(self, sql, parametros=()):
+        conexion = self.conectar()
+        try:
+            return conexion.execute(sql, parametros).fetchall()
+        finally:
+            conexion.close()
+
+    def instancia(self):
+        if not self._preparada:
+            self._preparar()
+        return self._instancia
@@ -0,0 +1,123 @@
+"""Evaluación de las piezas frente a un patrón de carga y sus bandas de dispersión.
+
+Las bandas son las mismas que dibujan las gráficas: el valor absoluto del patrón multiplicado
+por (1 ± dispersión/100). Todas las piezas se evalúan a la vez como arrays de NumPy.
+"""
+import numpy as np
+
+from modelo_piezas import PORCENTAJES, TablaPiezas
+
+# Campos evaluados (los cuatro primeros de la tabla de piezas; la columna L no tiene banda)
+CAMPOS = ['izquierda', 'derecha', 'consumo_izquierda', 'consumo_derecha']
+# Magnitud de cada campo (qué dispersión se le aplica)
+MAGNITUDES = ['par', 'par', 'consumo', 'consumo']
+
+OK = 'OK'
+NOK = 'NOK'
+SIN_DATOS = 'SIN DATOS'
+
+# Margen para que los valores justo en el límite de la banda no fallen por redondeo
+EPSILON = 1e-9
+
+
+def _matriz_cargas(piezas):
+    """Array (n, porcentajes, campos) con el valor absoluto de cada carga; NaN si falta el porcentaje"""
+    return np.abs(TablaPiezas.desde_dict(piezas).valores()[:, :, :len(CAMPOS)])
+
+
+def limites_patron(patron, dispersion_par=0, dispersion_consumo=0):
+    """Bandas del patrón como arrays (porcentajes, campos): (referencia, evaluado, inferior, superior).
+
+    `evaluado` es False donde no hay banda (dispersión 0 o el patrón no tiene ese valor).
+    """
+    referencia = _matriz_cargas({'patron': {'cargas': patron}})[0]
+    dispersiones = np.array([dispersion_par if m == 'par' else dispersion_consumo for m in MAGNITUDES],
+                            dtype=float) / 100
+    # Sin dispersión o sin valor en el patrón no hay banda con la que comparar
+    evaluado = (dispersiones > 0) & ~np.isnan(referencia)
+    return referencia, evaluado, referencia * (1 - dispersiones), referencia * (1 + dispersiones)
+
+
+def evaluar_valores(valores, patron, dispersion_par=0, dispersion_consumo=0):
+    """Evaluar un array (n, porcentajes, campos) de valores absolutos frente a `patron`.
+
+    Devuelve un diccionario de arrays: los límites del patrón (porcentajes, campos), `desviacion`,
+    `con_datos`, `dentro` y `fuera` (n, porcentajes, campos) y `nok`, `sin_datos` y `resultados` por pieza.
+    """
+    referencia, evaluado, inferior, superior = limites_patron(patron, dispersion_par, dispersion_consumo)
+    # Un porcentaje con los cuatro valores a 0 es un porcentaje que falta en el Excel (la API lo rellena con
+    # ceros): cuenta como sin datos, igual que en estadisticas_spc e indice_patrones
+    valores = np.where((valores == 0).all(axis=2, keepdims=True), np.nan, valores)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        desviacion = np.where(referencia > 0, (valores - referencia) / referencia * 100, np.nan)
+    con_datos = ~np.isnan(valores)
+    dentro = (valores >= inferior - EPSILON) & (valores <= superior + EPSILON)
+
+    # Una pieza es NOK si algún valor evaluado está fuera; SIN DATOS si falta algún valor evaluado
+    fuera = evaluado & con_datos & ~dentro
+    falta = evaluado & ~con_datos
+    nok = fuera.any(axis=(1, 2))
+    sin_datos = ~nok & falta.any(axis=(1, 2))
+    return {
+        'referencia': referencia, 'evaluado': evaluado, 'inferior': inferior, 'superior': superior,
+        'desviacion': desviacion, 'con_datos': con_datos, 'dentro': dentro, 'fuera': fuera,
+        'nok': nok, 'sin_datos': sin_datos, 'resultados': np.where(nok, NOK, np.where(sin_datos, SIN_DATOS, OK)),
+    }
+
+
+def evaluar_piezas(piezas, patron, dispersion_par=0, dispersion_consumo=0, detalle=True):
+    """Evaluar todas las piezas de /api/procesar-excel frente a `patron`.
+
+    Una magnitud (par o consumo) solo se evalúa si su dispersión es mayor que 0. Devuelve
+    {'resumen': {...}, 'piezas': {pieza_id: {...}}} con la desviación (%) de cada valor
+    respecto al patrón y si está dentro de la banda (`detalle=False` devuelve solo el resultado).
+    """
+    ids = list(piezas)
+    valores = _matriz_cargas(piezas)
+    evaluacion = evaluar_valores(valores, patron, dispersion_par, dispersion_consumo)
+    referencia, evaluado = evaluacion['referencia'], evaluacion['evaluado']
+    inferior, superior = evaluacion['inferior'], evaluacion['superior']
+    desviacion, con_datos = evaluacion['desviacion'], evaluacion['con_datos']
+    dentro, fuera = evaluacion['dentro'], evaluacion['fuera']
+    nok, sin_datos, resultados = evaluacion['nok'], evaluacion['sin_datos'], evaluacion['resultados']
+
+    piezas_evaluadas = {}
+    for i, pieza_id in enumerate(ids):
+        piezas_evaluadas[pieza_id] = {
+            'resultado': str(resultados[i]),
+            'fallos': [f'{PORCENTAJES[j]}% {CAMPOS[k]}' for j, k in zip(*np.nonzero(fuera[i]))]
+        }
+        if not detalle:
+            continue
+        piezas_evaluadas[pieza_id]['detalle'] = {
+            percent: {
+                campo: {
+                    'valor': None if np.isnan(valores[i, j, k]) else float(valores[i, j, k]),
+                    'desviacion': None if np.isnan(desviacion[i, j, k]) else round(float(desviacion[i, j, k]), 3),
+                    'ok': bool(dentro[i, j, k]) if evaluado[j, k] and con_datos[i, j, k] else None
+                }
+                for k, campo in enumerate(CAMPOS)
+            }
+            for j, percent in enumerate(PORCENTAJES)
+        }
+
+    return {
+        'resumen': {
+            'total': len(ids),
+            'ok': int((resultados == OK).sum()),
+            'nok': int(nok.sum()),
+            'sin_datos': int(sin_datos.sum()),
+            'dispersion_par': dispersion_par,
+            'dispersion_consumo': dispersion_consumo,
+            'limites': {
+                percent: {
+                    campo: {'patron': float(referencia[j, k]), 'inferior': float(inferior[j, k]),
+                            'superior': float(superior[j, k])}
+                    for k, campo in enumerate(CAMPOS) if evaluado[j, k]
+                }
+                for j, percent in enumerate(PORCENTAJES)
+            }
+        },
+        'piezas': piezas_evaluadas
+    }
@@ -0,0 +1,141 @@
+"""Exportación de las piezas como tabla larga (una fila por pieza, porcentaje y campo) en CSV, Parquet o Excel.
+
+La tabla se construye directamente desde la TablaPiezas de cada Excel con NumPy, sin pasar por el
+diccionario JSON de /api/procesar-excel, y se escribe por bloques (un bloque por Excel). Con un patrón y
+alguna dispersión se añaden los límites de la banda, si cada valor está dentro y el resultado de la pieza.
+
+Parquet necesita pyarrow, que es opcional: sin él solo están disponibles CSV y Excel.
+"""
+import csv
+import io
+
+import numpy as np
+
+from evaluacion_tolerancias import CAMPOS as CAMPOS_EVALUADOS
+from evaluacion_tolerancias import evaluar_valores
+from modelo_piezas import CAMPOS, PORCENTAJES
+
+FORMATOS_EXPORTACION = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+COLUMNAS_EXPORTACION = ['archivo', 'referencia_excel', 'of', 'pieza', 'porcentaje', 'campo', 'valor']
+COLUMNAS_EVALUACION = ['patron', 'limite_inferior', 'limite_superior', 'dentro', 'resultado_pieza']
+# Máximo de filas de datos en una hoja de Excel (1.048.576 menos la cabecera)
+MAX_FILAS_XLSX = 1_048_575
+HOJA_EXPORTACION = 'Resultados'
+
+
+class FormatoNoDisponibleError(RuntimeError):
+    """El formato pedido necesita una dependencia opcional que no está instalada"""
+
+
+def parquet_disponible():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def tabla_larga(tabla, referencia_excel=None, archivo=None, patron=None, dispersion_par=0, dispersion_consumo=0):
+    """Columnas (nombre -> array) de la tabla larga de una TablaPiezas.
+
+    Hay una fila por pieza, porcentaje presente y campo, ordenadas como la tabla. El valor es el de la
+    API (celdas vacías a 0). Las columnas de evaluación solo se añaden con patrón y alguna dispersión.
+    """
+    n = len(tabla)
+    i, j, k = (indices.ravel() for indices in np.indices((n, len(PORCENTAJES), len(CAMPOS))))
+    presentes = tabla.presentes[i, j]
+    i, j, k = i[presentes], j[presentes], k[presentes]
+    filas = len(i)
+
+    columnas = {
+        'archivo': np.full(filas, archivo, dtype=object),
+        'referencia_excel': np.full(filas, referencia_excel, dtype=object),
+        'of': tabla.of[i],
+        'pieza': tabla.pieza[i],
+        'porcentaje': np.array([int(percent) for percent in PORCENTAJES], dtype=np.int64)[j],
+        'campo': np.array(CAMPOS, dtype=object)[k],
+        'valor': tabla.valores()[i, j, k],
+    }
+    if patron and (dispersion_par > 0 or dispersion_consumo > 0):
+        valores = np.abs(tabla.valores()[:, :, :len(CAMPOS_EVALUADOS)])
+        evaluacion = evaluar_valores(valores, patron, dispersion_par, dispersion_consumo)
+        # La columna L no tiene banda: sus filas quedan sin límites
+        con_banda = k < len(CAMPOS_EVALUADOS)
+        kb = np.minimum(k, len(CAMPOS_EVALUADOS) - 1)
+        evaluado = con_banda & evaluacion['evaluado'][j, kb]
+        columnas['patron'] = np.where(con_banda, evaluacion['referencia'][j, kb], np.nan)
+        columnas['limite_inferior'] = np.where(evaluado, evaluacion['inferior'][j, kb], np.nan)
+        columnas['limite_superior'] = np.where(evaluado, evaluacion['superior'][j, kb], np.nan)
+        dentro = np.full(filas, None, dtype=object)
+        valorado = evaluado & evaluacion['con_datos'][i, j, kb]
+        dentro[valorado] = evaluacion['dentro'][i, j, kb][valorado]
+        columnas['dentro'] = dentro
+        columnas['resultado_pieza'] = evaluacion['resultados'].astype(object)[i]
+    return columnas
+
+
+def _lista(columna):
+    """Valores de una columna para csv/openpyxl: NaN como None"""
+    if columna.dtype.kind == 'f':
+        return np.where(np.isnan(columna), None, columna).tolist()
+    return columna.tolist()
+
+
+def _filas(columnas):
+    return zip(*(_lista(columna) for columna in columnas.values()))
+
+
+def escribir_csv(bloques, columnas):
+    """Generar el CSV por bloques (bytes UTF-8): la cabecera y luego las filas de cada bloque"""
+    salida = io.StringIO()
+    escritor = csv.writer(salida, lineterminator='\n')
+    escritor.writerow(columnas)
+    for bloque in bloques:
+        escritor.writerows(_filas(bloque))
+        yield salida.getvalue().encode('utf-8')
+        salida.seek(0)
+        salida.truncate()
+    if salida.tell():
+        yield salida.getvalue().encode('utf-8')
+
+
+def escribir_parquet(bloques, columnas, destino):
+    """Escribir un Parquet en `destino` con un grupo de filas por bloque"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise FormatoNoDisponibleError('La exportación a Parquet necesita pyarrow (pip install pyarrow)')
+
+    tipos = {'archivo': pa.string(), 'referencia_excel': pa.string(), 'of': pa.int64(), 'pieza': pa.int64(),
+             'porcentaje': pa.int64(), 'campo': pa.string(), 'valor': pa.float64(), 'patron': pa.float64(),
+             'limite_inferior': pa.float64(), 'limite_superior': pa.float64(), 'dentro': pa.bool_(),
+             'resultado_pieza': pa.string()}
+    esquema = pa.schema([(nombre, tipos[nombre]) for nombre in columnas])
+    with pq.ParquetWriter(destino, esquema) as escritor:
+        for bloque in bloques:
+            escritor.write_table(pa.table({
+                nombre: pa.array(bloque[nombre], type=tipos[nombre], from_pandas=True) for nombre in columnas
+            }, schema=esquema))
+
+
+def escribir_xlsx(bloques, columnas, destino):
+    """Escribir un .xlsx de una hoja en `destino` (openpyxl en modo solo escritura)"""
+    import openpyxl
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet(HOJA_EXPORTACION)
+    hoja.append(columnas)
+    filas = 0
+    for bloque in bloques:
+        filas += len(bloque['valor'])
+        if filas > MAX_FILAS_XLSX:
+            raise ValueError(f'La exportación supera el máximo de filas de una hoja de Excel ({MAX_FILAS_XLSX}); '
+                             f'use CSV o Parquet')
+        for fila in _filas(bloque):
+            hoja.append(fila)
+    libro.save(destino)
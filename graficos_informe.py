@@ -0,0 +1,164 @@
+"""Gráficos vectoriales (reportlab.graphics) para los informes PDF.
+
+Reproducen las gráficas simétricas de index.html y carga_masiva.html: izquierda en el lado
+negativo del eje, derecha en el positivo, con el patrón y sus límites de dispersión.
+"""
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics.charts.lineplots import LinePlot
+from reportlab.graphics.shapes import Drawing, Group, String
+from reportlab.graphics.widgets.markers import makeMarker
+from reportlab.lib import colors
+from reportlab.lib.units import mm
+
+PORCENTAJES = ['0', '100']
+
+# Misma paleta que carga_masiva.html
+COLORES_PIEZAS = [
+    colors.Color(102 / 255, 126 / 255, 234 / 255),  # Azul
+    colors.Color(255 / 255, 99 / 255, 132 / 255),   # Rosa
+    colors.Color(54 / 255, 162 / 255, 235 / 255),   # Azul claro
+    colors.Color(255 / 255, 206 / 255, 86 / 255),   # Amarillo
+    colors.Color(75 / 255, 192 / 255, 192 / 255),   # Turquesa
+    colors.Color(153 / 255, 102 / 255, 255 / 255),  # Púrpura
+    colors.Color(255 / 255, 159 / 255, 64 / 255),   # Naranja
+    colors.Color(199 / 255, 199 / 255, 199 / 255),  # Gris
+    colors.Color(83 / 255, 102 / 255, 255 / 255),   # Azul índigo
+    colors.Color(255 / 255, 99 / 255, 255 / 255),   # Magenta
+    colors.Color(99 / 255, 255 / 255, 132 / 255),   # Verde
+    colors.Color(255 / 255, 132 / 255, 99 / 255),   # Salmón
+]
+COLOR_PATRON = colors.Color(255 / 255, 99 / 255, 132 / 255)
+
+# Campos de cada carga según el tipo de gráfico
+CAMPOS = {
+    'pares': ('izquierda', 'derecha'),
+    'consumos': ('consumo_izquierda', 'consumo_derecha'),
+}
+TITULOS_EJE_Y = {'pares': 'Par (Nm)', 'consumos': 'Consumo (A)'}
+
+# Número máximo de piezas que se muestran en la leyenda
+MAX_LEYENDA = 24
+
+
+def _formato_eje_y(tipo):
+    """Etiquetas del eje Y en valor absoluto, como en la gráfica del navegador"""
+    def formato(valor):
+        valor = abs(valor)
+        if tipo == 'consumos':
+            return f'{valor:.2f}'
+        if abs(valor - round(valor)) < 0.0001:
+            return f'{round(valor)}'
+        return f'{valor:.1f}'
+    return formato
+
+
+def _puntos(cargas, campo, signo):
+    """Puntos (x, y) de una serie; los porcentajes sin datos se omiten"""
+    puntos = []
+    for x, percent in enumerate(PORCENTAJES):
+        if percent in cargas:
+            puntos.append((x, signo * abs(cargas[percent].get(campo, 0) or 0)))
+    return puntos
+
+
+def grafico_simetrico(piezas, tipo='pares', patron=None, dispersion=0, ancho=170 * mm, alto=120 * mm):
+    """Crear el gráfico simétrico de par o consumo.
+
+    `piezas` es una lista de (etiqueta, cargas) con el formato de /api/procesar-excel y
+    `patron` las cargas del patrón de patrones_carga.json (o None).
+    """
+    campo_izda, campo_drch = CAMPOS[tipo]
+    alto_leyenda = 0
+    if len(piezas) > 1 or patron:
+        filas_leyenda = (min(len(piezas), MAX_LEYENDA) + (1 if patron else 0) + 2) // 3
+        alto_leyenda = filas_leyenda * 10 + 6
+
+    dibujo = Drawing(ancho, alto)
+    grafico = LinePlot()
+    grafico.x = 18 * mm
+    grafico.y = 10 * mm + alto_leyenda
+    grafico.width = ancho - grafico.x - 5 * mm
+    grafico.height = alto - grafico.y - 5 * mm
+
+    datos, estilos = [], []
+    for indice, (_, cargas) in enumerate(piezas):
+        color = COLORES_PIEZAS[indice % len(COLORES_PIEZAS)]
+        for campo, signo in ((campo_izda, -1), (campo_drch, 1)):
+            datos.append(_puntos(cargas, campo, signo))
+            estilos.append({'strokeColor': color, 'strokeWidth': 1.5, 'marker': True})
+
+    if patron:
+        for campo, signo in ((campo_izda, -1), (campo_drch, 1)):
+            datos.append(_puntos(patron, campo, signo))
+            estilos.append({'strokeColor': COLOR_PATRON, 'strokeWidth': 2.5, 'marker': True})
+        # Límites de dispersión alrededor del patrón
+        if dispersion > 0:
+            for factor in (1 + dispersion / 100, 1 - dispersion / 100):
+                for campo, signo in ((campo_izda, -1), (campo_drch, 1)):
+                    datos.append([(x, y * factor) for x, y in _puntos(patron, campo, signo)])
+                    estilos.append({'strokeColor': COLOR_PATRON, 'strokeWidth': 1.2,
+                                    'strokeDashArray': [3, 3], 'marker': False})
+
+    # Las series sin puntos rompen LinePlot: se sustituyen por un punto invisible en el origen
+    datos = [serie if serie else [(0, 0)] for serie in datos]
+    valor_maximo = max([abs(y) for serie in datos for _, y in serie] + [0]) or 1
+    grafico.data = datos
+    for indice, estilo in enumerate(estilos):
+        linea = grafico.lines[indice]
+        linea.strokeColor = estilo['strokeColor']
+        linea.strokeWidth = estilo['strokeWidth']
+        if 'strokeDashArray' in estilo:
+            linea.strokeDashArray = estilo['strokeDashArray']
+        if estilo['marker']:
+            linea.symbol = makeMarker('FilledCircle', size=3.5, fillColor=estilo['strokeColor'],
+                                      strokeColor=colors.white, strokeWidth=0.5)
+
+    etiquetas_x = ['0%', '100%*'] if tipo == 'consumos' else ['0%', '100%']
+    grafico.xValueAxis.valueMin = 0
+    grafico.xValueAxis.valueMax = 1
+    grafico.xValueAxis.valueSteps = [0, 1]
+    grafico.xValueAxis.labelTextFormat = lambda v: etiquetas_x[int(round(v))]
+    grafico.xValueAxis.visibleGrid = True
+    grafico.xValueAxis.gridStrokeColor = colors.Color(0, 0, 0, 0.1)
+    grafico.xValueAxis.labels.fontName = 'Helvetica'
+    grafico.xValueAxis.labels.fontSize = 8
+
+    grafico.yValueAxis.valueMin = -valor_maximo * 1.1
+    grafico.yValueAxis.valueMax = valor_maximo * 1.1
+    grafico.yValueAxis.labelTextFormat = _formato_eje_y(tipo)
+    grafico.yValueAxis.visibleGrid = True
+    grafico.yValueAxis.gridStrokeColor = colors.Color(0, 0, 0, 0.1)
+    grafico.yValueAxis.labels.fontName = 'Helvetica'
+    grafico.yValueAxis.labels.fontSize = 8
+    dibujo.add(grafico)
+
+    # Título del eje Y girado 90 grados
+    titulo_y = Group(String(0, 0, TITULOS_EJE_Y[tipo], fontName='Helvetica-Bold', fontSize=9, textAnchor='middle'))
+    titulo_y.transform = (0, 1, -1, 0, 5 * mm, grafico.y + grafico.height / 2)
+    dibujo.add(titulo_y)
+    dibujo.add(String(grafico.x + grafico.width / 2, grafico.y - 8 * mm, 'Porcentaje',
+                      fontName='Helvetica-Bold', fontSize=9, textAnchor='middle'))
+
+    if alto_leyenda:
+        leyenda = Legend()
+        leyenda.x = grafico.x
+        leyenda.y = alto_leyenda
+        leyenda.fontName = 'Helvetica'
+        leyenda.fontSize = 7
+        leyenda.dx = 8
+        leyenda.dy = 6
+        leyenda.deltay = 10
+        leyenda.columnMaximum = (alto_leyenda - 6) // 10
+        leyenda.deltax = (ancho - grafico.x) / 3
+        leyenda.dxTextSpace = 4
+        leyenda.alignment = 'right'
+        items = [(COLORES_PIEZAS[i % len(COLORES_PIEZAS)], etiqueta)
+                 for i, (etiqueta, _) in enumerate(piezas[:MAX_LEYENDA])]
+        if len(piezas) > MAX_LEYENDA:
+            items[-1] = (colors.white, f'... y {len(piezas) - MAX_LEYENDA + 1} piezas más')
+        if patron:
+            items.append((COLOR_PATRON, 'Patrón'))
+        leyenda.colorNamePairs = items
+        dibujo.add(leyenda)
+
+    return dibujo
@@ -0,0 +1,109 @@
+"""Preparación de las imágenes de gráficos que envía el navegador antes de incrustarlas en el PDF.
+
+En pantallas HiDPI el canvas llega a varios MB por imagen. Aquí se valida la imagen, se reduce al
+tamaño que ocupa en el PDF (170 x 120 mm) a DPI_GRAFICOS y se recomprime como PNG de paleta. El
+resultado se guarda por hash del contenido, así que la misma imagen en varios informes se procesa una vez.
+"""
+import base64
+import binascii
+import hashlib
+import os
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+from cache_resultados import CacheResultados
+from metricas import metricas
+
+DPI_GRAFICOS = int(os.environ.get('DPI_GRAFICOS', 150))
+# Límites de la imagen recibida (bytes decodificados y píxeles) para rechazar imágenes anómalas
+MAX_BYTES_IMAGEN = int(os.environ.get('MAX_BYTES_IMAGEN', 20 * 1024 * 1024))
+MAX_PIXELES_IMAGEN = 50_000_000
+FORMATOS_ADMITIDOS = ('PNG', 'JPEG', 'WEBP')
+MM_POR_PULGADA = 25.4
+
+cache_imagenes = CacheResultados(max_bytes=int(os.environ.get('CACHE_IMAGENES_MAX_BYTES', 32 * 1024 * 1024)))
+
+
+class ImagenInvalidaError(ValueError):
+    """La imagen recibida no es una imagen válida o supera los límites"""
+
+
+def decodificar_base64(imagen):
+    """Bytes de una imagen en base64, con o sin prefijo data:"""
+    imagen_data = imagen.split(',')[1] if ',' in imagen else imagen
+    try:
+        datos = base64.b64decode(imagen_data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImagenInvalidaError('La imagen no está en base64')
+    if len(datos) > MAX_BYTES_IMAGEN:
+        raise ImagenInvalidaError(f'La imagen supera el máximo de {MAX_BYTES_IMAGEN} bytes')
+    return datos
+
+
+def tamano_objetivo(ancho_mm, alto_mm, dpi):
+    """Píxeles (ancho, alto) que ocupa una imagen de ancho_mm x alto_mm a `dpi`"""
+    return round(ancho_mm / MM_POR_PULGADA * dpi), round(alto_mm / MM_POR_PULGADA * dpi)
+
+
+def reducir_imagen(datos, ancho_mm, alto_mm, dpi):
+    """PNG de paleta con la imagen reducida a lo que cabe en ancho_mm x alto_mm a `dpi` (sin ampliarla).
+
+    Devuelve los bytes originales si la imagen ya es un PNG de ese tamaño y la recompresión no la reduce.
+    """
+    try:
+        imagen = Image.open(BytesIO(datos))
+        if imagen.format not in FORMATOS_ADMITIDOS:
+            raise ImagenInvalidaError(f'Formato de imagen no admitido: {imagen.format}')
+        if imagen.width * imagen.height > MAX_PIXELES_IMAGEN:
+            raise ImagenInvalidaError(f'La imagen tiene demasiados píxeles ({imagen.width}x{imagen.height})')
+        imagen.load()
+        formato = imagen.format
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise ImagenInvalidaError(f'No se pudo leer la imagen: {e}')
+
+    # El canvas del navegador es transparente: se aplana sobre blanco, que es el fondo de la página
+    if imagen.mode in ('RGBA', 'LA') or (imagen.mode == 'P' and 'transparency' in imagen.info):
+        imagen = imagen.convert('RGBA')
+        fondo = Image.new('RGB', imagen.size, 'white')
+        fondo.paste(imagen, mask=imagen.getchannel('A'))
+        imagen = fondo
+    else:
+        imagen = imagen.convert('RGB')
+
+    # Mismo encaje que en el PDF: la imagen se estira a 170 x 120 mm, así que cada eje se reduce por separado
+    ancho_px, alto_px = tamano_objetivo(ancho_mm, alto_mm, dpi)
+    reducida = imagen.width > ancho_px or imagen.height > alto_px
+    if reducida:
+        imagen = imagen.resize((min(imagen.width, ancho_px), min(imagen.height, alto_px)), Image.LANCZOS)
+
+    # Los gráficos son colores planos y bordes suavizados: 256 colores bastan y comprimen mucho mejor
+    salida = BytesIO()
+    imagen.quantize(colors=256, method=Image.Quantize.FASTOCTREE).save(salida, format='PNG', compress_level=9)
+    procesada = salida.getvalue()
+    if not reducida and formato == 'PNG' and len(procesada) >= len(datos):
+        return datos
+    return procesada
+
+
+def preparar_imagen(imagen, ancho_mm, alto_mm, dpi=None):
+    """Bytes de la imagen en base64 lista para el PDF; lanza ImagenInvalidaError si no es válida"""
+    dpi = dpi or DPI_GRAFICOS
+    datos = decodificar_base64(imagen)
+    clave = f'{hashlib.sha256(datos).hexdigest()}-{ancho_mm:g}x{alto_mm:g}mm-{dpi}dpi'
+
+    procesada = cache_imagenes.obtener(clave)
+    if procesada is None:
+        try:
+            procesada = reducir_imagen(datos, ancho_mm, alto_mm, dpi)
+        except ImagenInvalidaError:
+            metricas.incrementar('cargas_imagenes_total', resultado='invalida')
+            raise
+        cache_imagenes.guardar(clave, procesada)
+        metricas.incrementar('cargas_imagenes_total', resultado='procesada')
+    else:
+        metricas.incrementar('cargas_imagenes_total', resultado='cache')
+
+    metricas.incrementar('cargas_imagenes_bytes_recibidos_total', len(datos))
+    metricas.incrementar('cargas_imagenes_bytes_ahorrados_total', len(datos) - len(procesada))
+    return procesada
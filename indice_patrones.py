@@ -0,0 +1,212 @@
+"""Índice de los patrones de carga para encontrar el patrón más parecido a cada pieza.
+
+Cada patrón y cada pieza se representan con el mismo vector de características (valores absolutos):
+par y consumo izquierda / derecha al 0% y al 100% y la columna L al 100%. La distancia entre una pieza y
+un patrón es la media cuadrática de la desviación relativa respecto al patrón en las características que
+tienen los dos (0.08 = un 8% de desviación media, en la misma escala que las dispersiones).
+
+Las distancias de todas las piezas a todos los patrones se calculan con productos de matrices, por
+bloques de piezas. El índice se reconstruye cuando cambia patrones_carga.json (ETag del registro).
+"""
+import threading
+
+import numpy as np
+
+from modelo_piezas import CAMPOS, PORCENTAJES, TablaPiezas
+from patrones import registro_patrones
+
+# (porcentaje, campo) de cada característica
+CARACTERISTICAS = tuple((percent, campo) for percent in PORCENTAJES for campo in CAMPOS[:4]) + \
+    (('100', 'valor_columna_l'),)
+# Piezas por bloque: cada bloque usa matrices (piezas x patrones)
+BLOQUE_PIEZAS = 2048
+_INDICES = tuple((PORCENTAJES.index(percent), CAMPOS.index(campo)) for percent, campo in CARACTERISTICAS)
+
+
+def caracteristicas_tabla(tabla):
+    """Array (n, características) de las piezas; NaN donde no hay valor.
+
+    Un porcentaje con los cuatro valores a 0 (ausente en la API) y una columna L a 0 cuentan como sin valor.
+    """
+    valores = np.abs(tabla.valores())
+    valores[(valores[:, :, :4] == 0).all(axis=2)] = np.nan
+    filas, columnas = zip(*_INDICES)
+    resultado = valores[:, list(filas), list(columnas)]
+    resultado[resultado == 0] = np.nan
+    return resultado
+
+
+def caracteristicas_patron(patron):
+    """Vector de características de un patrón de patrones_carga.json (NaN donde no tiene valor)"""
+    vector = np.full(len(CARACTERISTICAS), np.nan)
+    for f, (percent, campo) in enumerate(CARACTERISTICAS):
+        valor = (patron.get(percent) or {}).get(campo)
+        if isinstance(valor, (int, float)) and valor != 0:
+            vector[f] = abs(valor)
+    return vector
+
+
+class IndicePatrones:
+    """Matrices de los patrones preparadas para calcular distancias; no se modifica después de crearse"""
+
+    def __init__(self, patrones, etag=None):
+        self.ids = list(patrones)
+        self.etag = etag
+        vectores = np.array([caracteristicas_patron(patrones[patron_id]) for patron_id in self.ids],
+                            dtype=float).reshape(len(self.ids), len(CARACTERISTICAS))
+        valido = ~np.isnan(vectores)
+        # Peso de cada característica: 1 / p², así la diferencia se mide relativa al patrón
+        self._pesos = np.where(valido, 1 / np.where(valido, vectores, 1) ** 2, 0.0)
+        # w·p = 1 / p
+        self._ponderados = np.where(valido, 1 / np.where(valido, vectores, 1), 0.0)
+        self._validos = valido.astype(float)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def cuadrados(self, caracteristicas, columnas=None):
+        """Array (n, patrones) de distancias al cuadrado; inf si no comparten ninguna característica.
+
+        sum(w·(x - p)²) = x²·w - 2·x·(w·p) + sum(w·p²), con x = 0 donde falta el valor de la pieza. Como
+        w = 1 / p², el último término es el número de características comunes.
+        """
+        pesos, ponderados, validos = self._pesos, self._ponderados, self._validos
+        if columnas is not None:
+            pesos, ponderados, validos = pesos[columnas], ponderados[columnas], validos[columnas]
+        mascara = ~np.isnan(caracteristicas)
+        x = np.where(mascara, caracteristicas, 0.0)
+        comunes = mascara.astype(float) @ validos.T
+        suma = (x * x) @ pesos.T
+        suma -= 2 * (x @ ponderados.T)
+        suma += comunes
+        np.maximum(suma, 0, out=suma)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            suma /= comunes
+        suma[comunes == 0] = np.inf
+        return suma
+
+    def distancias(self, caracteristicas):
+        """Array (n, patrones) de distancias; NaN si la pieza y el patrón no comparten ninguna característica"""
+        distancias = np.sqrt(self.cuadrados(caracteristicas))
+        distancias[np.isinf(distancias)] = np.nan
+        return distancias
+
+    def buscar(self, tabla, candidatos=None):
+        """Mejor patrón de cada pieza de una TablaPiezas.
+
+        Devuelve (mejor, distancia, segundo, distancia_segundo) como arrays de longitud n: índices de
+        patrón (-1 si no hay ninguno comparable) y distancias (NaN si no hay).
+        """
+        columnas = np.arange(len(self.ids)) if candidatos is None else np.asarray(candidatos, dtype=np.int64)
+        caracteristicas = caracteristicas_tabla(tabla)
+        n = len(caracteristicas)
+        mejor = np.full(n, -1, dtype=np.int64)
+        segundo = np.full(n, -1, dtype=np.int64)
+        distancia = np.full(n, np.nan)
+        distancia_segundo = np.full(n, np.nan)
+        if not len(columnas):
+            return mejor, distancia, segundo, distancia_segundo
+
+        for inicio in range(0, n, BLOQUE_PIEZAS):
+            fin = min(inicio + BLOQUE_PIEZAS, n)
+            bloque = self.cuadrados(caracteristicas[inicio:fin], columnas)
+            filas = np.arange(len(bloque))
+            # Los dos menores de cada fila con dos argmin (más rápido que argpartition) y la raíz solo de esos
+            for posiciones, valores in ((mejor, distancia), (segundo, distancia_segundo)):
+                menor = np.argmin(bloque, axis=1)
+                cuadrado = bloque[filas, menor]
+                hay = np.isfinite(cuadrado)
+                posiciones[inicio:fin] = np.where(hay, columnas[menor], -1)
+                valores[inicio:fin] = np.where(hay, np.sqrt(cuadrado), np.nan)
+                if bloque.shape[1] == 1:
+                    break
+                bloque[filas, menor] = np.inf
+        return mejor, distancia, segundo, distancia_segundo
+
+
+def confianza(distancia, distancia_segundo):
+    """Margen respecto al segundo patrón: 1 - d1 / d2 (1 = sin duda, 0 = empate; 1 si no hay segundo)"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margen = np.where(distancia_segundo > 0, 1 - distancia / distancia_segundo, 0.0)
+    margen = np.where(np.isnan(distancia_segundo), 1.0, margen)
+    return np.where(np.isnan(distancia), np.nan, np.clip(margen, 0.0, 1.0))
+
+
+class RegistroIndice:
+    """Índice de los patrones del registro, reconstruido cuando cambia el archivo"""
+
+    def __init__(self, registro):
+        self.registro = registro
+        self._indice = None
+        self._lock = threading.Lock()
+        self.reconstrucciones = 0
+
+    def obtener(self):
+        patrones, etag = self.registro.instantanea()
+        indice = self._indice
+        if indice is not None and indice.etag == etag:
+            return indice
+        with self._lock:
+            if self._indice is None or self._indice.etag != etag:
+                self._indice = IndicePatrones(patrones, etag)
+                self.reconstrucciones += 1
+            return self._indice
+
+
+registro_indice = RegistroIndice(registro_patrones)
+
+
+def patrones_cercanos(piezas, candidatos=None, detalle=True, indice=None):
+    """Patrón más parecido a cada pieza del diccionario de la API y resumen del lote.
+
+    `candidatos` limita la búsqueda a esos ids de patrón (KeyError si alguno no existe). El patrón del
+    lote es el más parecido a más piezas (a igualdad, el de menor distancia mediana); `detalle=False`
+    devuelve solo el resumen.
+    """
+    indice = indice or registro_indice.obtener()
+    posiciones = None
+    if candidatos is not None:
+        faltan = [patron_id for patron_id in candidatos if patron_id not in indice.ids]
+        if faltan:
+            raise KeyError(f"Patrones no encontrados: {', '.join(faltan)}")
+        posiciones = [indice.ids.index(patron_id) for patron_id in candidatos]
+
+    mejor, distancia, segundo, distancia_segundo = indice.buscar(TablaPiezas.desde_dict(piezas), posiciones)
+    confianzas = confianza(distancia, distancia_segundo)
+
+    def numero(valor):
+        return None if np.isnan(valor) else round(float(valor), 4)
+
+    votos = np.bincount(mejor[mejor >= 0], minlength=len(indice))
+    por_patron = {}
+    for posicion in np.flatnonzero(votos).tolist():
+        del_patron = mejor == posicion
+        por_patron[indice.ids[posicion]] = {
+            'piezas': int(votos[posicion]),
+            'distancia_mediana': numero(np.median(distancia[del_patron])),
+            'confianza_media': numero(confianzas[del_patron].mean()),
+        }
+    mejor_lote = min(por_patron, key=lambda patron_id: (-por_patron[patron_id]['piezas'],
+                                                        por_patron[patron_id]['distancia_mediana']),
+                     default=None)
+    resultado = {
+        'resumen': {
+            'patron': mejor_lote,
+            'piezas': len(piezas),
+            'sin_patron': int((mejor < 0).sum()),
+            'patrones': dict(sorted(por_patron.items(), key=lambda item: -item[1]['piezas'])),
+            'patrones_indice': len(indice),
+        }
+    }
+    if detalle:
+        resultado['piezas'] = {
+            pieza_id: {
+                'patron': indice.ids[mejor[i]] if mejor[i] >= 0 else None,
+                'distancia': numero(distancia[i]),
+                'confianza': numero(confianzas[i]),
+                'segundo': indice.ids[segundo[i]] if segundo[i] >= 0 else None,
+                'distancia_segundo': numero(distancia_segundo[i]),
+            }
+            for i, pieza_id in enumerate(piezas)
+        }
+    return resultado
@@ -0,0 +1,137 @@
+"""Generación en lote de informes individuales (uno por pieza) en un pool de procesos"""
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import BrokenExecutor, as_completed
+
+from informes_pdf import construir_informe
+from metricas import anotar, metricas
+from pool_procesos import cerrar_pool, descartar_pool, elegir_pool
+
+# Número de procesos por defecto para generar informes en paralelo
+WORKERS_INFORMES = int(os.environ.get('INFORMES_WORKERS', 0)) or os.cpu_count() or 1
+
+
+def datos_informe_pieza(pieza_info, comunes):
+    """Datos de /api/generar-informe para una pieza de /api/procesar-excel"""
+    cargas = pieza_info.get('cargas', {})
+    datos = dict(comunes)
+    datos['referencia'] = pieza_info.get('referencia', 'Sin referencia')
+    datos['cargas'] = cargas
+    # El ruido del informe individual es el valor de la columna L del 100%
+    datos['ruido'] = cargas.get('100', {}).get('valor_columna_l', 0)
+    return datos
+
+
+def _generar_informe(clave, datos):
+    """Generar un informe en un proceso del pool y medir su tiempo"""
+    inicio = time.perf_counter()
+    buffer, nombre_archivo = construir_informe(datos)
+    return clave, nombre_archivo, buffer.getvalue(), time.perf_counter() - inicio
+
+
+class _SalidaZip:
+    """Destino no posicionable para zipfile que acumula los bytes escritos hasta vaciarlos"""
+
+    def __init__(self):
+        self._trozos = []
+
+    def write(self, datos):
+        self._trozos.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._trozos)
+        self._trozos.clear()
+        return datos
+
+
+def validar_piezas(piezas):
+    """Comprobar que las piezas tienen el formato de /api/procesar-excel (ValueError si no)"""
+    if not isinstance(piezas, dict):
+        raise ValueError('piezas debe ser un objeto {id: pieza}')
+    for clave, pieza_info in piezas.items():
+        cargas = pieza_info.get('cargas', {}) if isinstance(pieza_info, dict) else None
+        if not isinstance(cargas, dict) or not all(isinstance(valores, dict) for valores in cargas.values()):
+            raise ValueError(f'La pieza {clave} no tiene el formato de /api/procesar-excel')
+
+
+def generar_zip_informes(piezas, comunes, workers=None):
+    """Enviar los informes al pool y devolver un generador con los bytes del ZIP a medida que se producen.
+
+    Las piezas se validan (ValueError) y se envían al pool, y se espera al primer informe, antes de
+    devolver el generador: los datos no válidos y un pool roto se lanzan aquí, antes de empezar la
+    respuesta. Los informes se añaden al ZIP en el orden en que terminan; al final se incluye
+    metadatos.json con el tiempo de cada informe.
+    """
+    validar_piezas(piezas)
+    pool, workers, propio = elegir_pool('informes', workers, WORKERS_INFORMES)
+    inicio = time.perf_counter()
+    futuros = {}
+    try:
+        futuros = {
+            pool.submit(_generar_informe, clave, datos_informe_pieza(pieza_info, comunes)): clave
+            for clave, pieza_info in piezas.items()
+        }
+        primero = next(as_completed(futuros))
+        if isinstance(primero.exception(), BrokenExecutor):
+            raise primero.exception()
+    except BaseException as e:
+        _cancelar(futuros, pool, propio)
+        if isinstance(e, BrokenExecutor) and not propio:
+            # Un proceso del pool compartido ha muerto: la próxima petición crea otro
+            descartar_pool('informes', pool)
+        raise
+    return _escribir_zip(futuros, pool, propio, workers, inicio)
+
+
+def _cancelar(futuros, pool, propio):
+    # Si el cliente corta la descarga (o falla el envío) no se generan los informes pendientes
+    for futuro in futuros:
+        futuro.cancel()
+    cerrar_pool(pool, propio)
+
+
+def _escribir_zip(futuros, pool, propio, workers, inicio):
+    salida = _SalidaZip()
+    informes, errores = [], []
+    try:
+        with zipfile.ZipFile(salida, 'w', compression=zipfile.ZIP_STORED) as zip_informes:
+            for futuro in as_completed(futuros):
+                try:
+                    clave, nombre_archivo, pdf, segundos = futuro.result()
+                except Exception as e:
+                    errores.append({'pieza': futuros[futuro], 'error': str(e)})
+                    continue
+                zip_informes.writestr(nombre_archivo, pdf)
+                metricas.observar('cargas_informe_lote_segundos', segundos)
+                informes.append({
+                    'pieza': clave,
+                    'archivo': nombre_archivo,
+                    'bytes': len(pdf),
+                    'segundos': round(segundos, 4)
+                })
+                yield salida.vaciar()
+
+            segundos_total = time.perf_counter() - inicio
+            metadatos = {
+                'workers': workers,
+                'num_informes': len(informes),
+                'segundos_total': round(segundos_total, 4),
+                'informes': informes,
+                'errores': errores
+            }
+            zip_informes.writestr('metadatos.json', json.dumps(metadatos, ensure_ascii=False, indent=2))
+        yield salida.vaciar()
+
+        # Resumen del lote: las cabeceras ya se han enviado, así que va a las métricas y al registro de la petición
+        metricas.incrementar('cargas_informes_lote_total', len(informes), estado='ok')
+        metricas.incrementar('cargas_informes_lote_total', len(errores), estado='error')
+        metricas.observar('cargas_lote_informes_segundos', segundos_total, workers=workers)
+        anotar(informes=len(informes), errores_informes=len(errores), segundos_informes=round(segundos_total, 4))
+    finally:
+        _cancelar(futuros, pool, propio)
@@ -0,0 +1,542 @@
+"""Construcción de los informes PDF (individual y masivo) con ReportLab"""
+import os
+import tempfile
+from datetime import datetime
+from io import BytesIO
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Flowable, Image, PageBreak, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from estadisticas_spc import calcular_estadisticas
+from evaluacion_tolerancias import NOK, evaluar_piezas
+from graficos_informe import grafico_simetrico
+from imagenes_informe import ImagenInvalidaError, preparar_imagen
+from metricas import tramo
+from modelo_piezas import TablaPiezas
+from patrones import cargar_patrones
+
+# Plantillas de estilo: se construyen una sola vez al importar el módulo y se reutilizan en cada informe
+ESTILOS = getSampleStyleSheet()
+ESTILO_SUBTITULO = ESTILOS['Heading2']
+ESTILO_TITULO_MASIVO = ParagraphStyle(
+    'CustomTitle',
+    parent=ESTILOS['Heading1'],
+    fontSize=18,
+    textColor=colors.HexColor('#667eea'),
+    spaceAfter=10,
+    alignment=TA_CENTER
+)
+ESTILO_TITULO = ParagraphStyle(
+    'CustomTitle',
+    parent=ESTILOS['Heading1'],
+    fontSize=16,
+    textColor=colors.HexColor('#667eea'),
+    spaceAfter=10,
+    alignment=TA_CENTER
+)
+
+# Tabla de información general
+ESTILO_TABLA_INFO = TableStyle([
+    ('BACKGROUND', (0, 0), (0, -1), colors.grey),
+    ('TEXTCOLOR', (0, 0), (0, -1), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ('TOPPADDING', (0, 0), (-1, -1), 4),
+    ('BACKGROUND', (1, 0), (1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+ANCHOS_TABLA_INFO = [60*mm, 130*mm]
+
+# Tabla resumen del informe masivo
+ESTILO_TABLA_RESUMEN = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 9),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
+])
+CABECERA_TABLA_RESUMEN = ['Pieza', '0% Par (Nm)', '0% Consumo (A)', '100% Par (Nm)', '100% Consumo (A)', 'Ruido']
+ANCHOS_TABLA_RESUMEN = [45*mm, 25*mm, 25*mm, 25*mm, 25*mm, 25*mm]
+# Con patrón y dispersión se añade la columna de tolerancia
+CABECERA_TABLA_RESUMEN_TOLERANCIA = CABECERA_TABLA_RESUMEN + ['Tolerancia']
+ANCHOS_TABLA_RESUMEN_TOLERANCIA = [34*mm, 24*mm, 27*mm, 26*mm, 30*mm, 16*mm, 23*mm]
+COLOR_NOK = colors.HexColor('#dc3545')
+COLOR_SUBTOTAL = colors.HexColor('#d9dcf7')
+
+# Informe masivo grande: a partir de este número de piezas la tabla resumen se divide en tablas de
+# FILAS_POR_TABLA filas (una por página) y el PDF se escribe en un archivo temporal en lugar de en memoria.
+# Una sola tabla de miles de filas obliga a ReportLab a dividirla página a página copiando el resto cada vez.
+UMBRAL_INFORME_PAGINADO = int(os.environ.get('INFORME_PAGINADO_UMBRAL', 1000))
+FILAS_POR_TABLA = 45
+
+# Página de resumen estadístico del informe masivo (una tabla por magnitud, filas por OF y porcentaje)
+CABECERA_TABLA_ESTADISTICAS = ['Grupo', '%', 'N', 'Media I / D', 'Desv. I / D', 'Mín - Máx', 'Cpk I / D', 'Asim. I-D']
+ANCHOS_TABLA_ESTADISTICAS = [26*mm, 12*mm, 12*mm, 30*mm, 28*mm, 28*mm, 24*mm, 20*mm]
+# (título, campo izquierdo, campo derecho, clave de asimetría, decimales)
+MAGNITUDES_ESTADISTICAS = [
+    ('Par (Nm)', 'izquierda', 'derecha', 'par', 1),
+    ('Consumo (A)', 'consumo_izquierda', 'consumo_derecha', 'consumo', 2),
+]
+
+# Tabla de cargas del informe individual
+ESTILO_TABLA_CARGAS = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
+])
+CABECERA_TABLA_CARGAS = ['Porcentaje', 'Par Izquierda (Nm)', 'Par Derecha (Nm)', 'Consumo Izquierda (A)', 'Consumo Derecha (A)', 'Ruido']
+ANCHOS_TABLA_CARGAS = [30*mm, 30*mm, 30*mm, 30*mm, 30*mm, 30*mm]
+
+# Tamaño de los gráficos en el PDF
+ANCHO_GRAFICO = 170*mm
+ALTO_GRAFICO = 120*mm
+
+
+def _seguimiento_progreso(progreso):
+    """Adaptar el callback de progreso de ReportLab a una fracción entre 0 y 1"""
+    total = {'flowables': 0}
+
+    def callback(tipo, valor):
+        if tipo == 'SIZE_EST':
+            total['flowables'] = valor
+        elif tipo == 'PROGRESS' and total['flowables']:
+            progreso(min(valor / total['flowables'], 1.0))
+        elif tipo == 'FINISHED':
+            progreso(1.0)
+    return callback
+
+
+def nuevo_documento(destino, progreso=None):
+    """Documento A4 con los márgenes reducidos de los informes"""
+    doc = SimpleDocTemplate(
+        destino,
+        pagesize=A4,
+        leftMargin=15*mm,
+        rightMargin=15*mm,
+        topMargin=10*mm,
+        bottomMargin=15*mm
+    )
+    if progreso:
+        doc.setProgressCallBack(_seguimiento_progreso(progreso))
+    return doc
+
+
+def tabla_info(info_data):
+    """Tabla de información general (etiqueta / valor)"""
+    info_table = Table(info_data, colWidths=ANCHOS_TABLA_INFO)
+    info_table.setStyle(ESTILO_TABLA_INFO)
+    return info_table
+
+
+def imagen_base64(imagen):
+    """Imagen de un PNG en base64 (con o sin prefijo data:), reducida y recomprimida al tamaño de los gráficos"""
+    datos = preparar_imagen(imagen, ANCHO_GRAFICO / mm, ALTO_GRAFICO / mm)
+    img = Image(BytesIO(datos), width=ANCHO_GRAFICO, height=ALTO_GRAFICO)
+    img.hAlign = 'CENTER'
+    return img
+
+
+def anadir_grafico(elements, titulo, imagen, series, tipo, patron, dispersion):
+    """Añadir un gráfico: la imagen enviada por el navegador o, si no hay o no es válida, el gráfico vectorial del servidor"""
+    grafico = None
+    if imagen:
+        try:
+            with tramo('imagen_base64'):
+                grafico = imagen_base64(imagen)
+        except ImagenInvalidaError as e:
+            print(f"Imagen de {titulo} no válida, se usa el gráfico del servidor: {e}")
+    if grafico is None:
+        with tramo('grafico_servidor'):
+            grafico = grafico_simetrico(series, tipo, patron, dispersion, ANCHO_GRAFICO, ALTO_GRAFICO)
+
+    elements.append(Paragraph(titulo, ESTILO_SUBTITULO))
+    elements.append(Spacer(1, 12))
+    elements.append(grafico)
+
+
+def _par_valores(izquierda, derecha, decimales):
+    """'izq / drch' con '-' en los valores que faltan"""
+    return ' / '.join('-' if valor is None else f'{valor:.{decimales}f}' for valor in (izquierda, derecha))
+
+
+def anadir_resumen_estadistico(elements, estadisticas):
+    """Página con media, desviación, rango, Cpk y asimetría por OF y del total (ver estadisticas_spc)"""
+    grupos = [(f'OF {of}', resumen) for of, resumen in estadisticas['por_of'].items()]
+    grupos.append(('Total', estadisticas['total']))
+    elements.append(Paragraph('Resumen estadístico', ESTILO_SUBTITULO))
+    elements.append(Spacer(1, 6))
+
+    for titulo, izquierda, derecha, asimetria, decimales in MAGNITUDES_ESTADISTICAS:
+        filas = [CABECERA_TABLA_ESTADISTICAS]
+        for nombre, resumen in grupos:
+            for percent in ('0', '100'):
+                izq = resumen['cargas'][percent][izquierda]
+                drch = resumen['cargas'][percent][derecha]
+                extremos = [v for v in (izq['min'], drch['min'], izq['max'], drch['max']) if v is not None]
+                asim = resumen['asimetria'][percent][asimetria]
+                filas.append([
+                    nombre,
+                    f'{percent}%',
+                    str(max(izq['n'], drch['n'])),
+                    _par_valores(izq['media'], drch['media'], decimales),
+                    _par_valores(izq['std'], drch['std'], decimales),
+                    f'{min(extremos):.{decimales}f} - {max(extremos):.{decimales}f}' if extremos else '-',
+                    _par_valores(izq.get('cpk'), drch.get('cpk'), 2) if 'cpk' in izq or 'cpk' in drch else '-',
+                    '-' if asim['media'] is None else f"{asim['media']:+.{decimales}f}",
+                ])
+        tabla = Table(filas, colWidths=ANCHOS_TABLA_ESTADISTICAS, repeatRows=1)
+        tabla.setStyle(ESTILO_TABLA_RESUMEN)
+        # La fila del total (las dos últimas) en negrita
+        tabla.setStyle(TableStyle([('FONTNAME', (0, -2), (-1, -1), 'Helvetica-Bold')]))
+        elements.append(Paragraph(titulo, ESTILOS['Heading3']))
+        elements.append(tabla)
+        elements.append(Spacer(1, 10))
+
+
+def valores_resumen(cargas):
+    """Media de |izquierda| y |derecha| del par y del consumo al 0% y al 100% (None si falta) y columna L"""
+    valores = []
+    for percent in ['0', '100']:
+        if percent in cargas:
+            izda = cargas[percent].get('izquierda', 0)
+            drch = cargas[percent].get('derecha', 0)
+            consumo_izda = cargas[percent].get('consumo_izquierda', 0)
+            consumo_drch = cargas[percent].get('consumo_derecha', 0)
+            valores.append((abs(izda) + abs(drch)) / 2)
+            valores.append((abs(consumo_izda) + abs(consumo_drch)) / 2)
+        else:
+            valores.extend([None, None])
+    # Valor de columna L solo para el 100%
+    valores.append(cargas.get('100', {}).get('valor_columna_l', 0))
+    return valores
+
+
+def _formatear_resumen(valores):
+    par_0, consumo_0, par_100, consumo_100, valor_columna_l = valores
+    return ['-' if par_0 is None else f'{par_0:.1f}', '-' if consumo_0 is None else f'{consumo_0:.2f}',
+            '-' if par_100 is None else f'{par_100:.1f}', '-' if consumo_100 is None else f'{consumo_100:.2f}',
+            f'{valor_columna_l:.2f}' if valor_columna_l and valor_columna_l > 0 else '-']
+
+
+def _subtotal(of, valores_of, num_nok, evaluacion):
+    """Fila de subtotal de una OF: media de cada columna (la columna L solo de las piezas con ruido)"""
+    def media(valores):
+        return sum(valores) / len(valores) if valores else None
+
+    columnas = list(zip(*valores_of))
+    medias = [media([v for v in columna if v is not None]) for columna in columnas[:4]]
+    medias.append(media([v for v in columnas[4] if v and v > 0]))
+    fila = [f'OF {of} ({len(valores_of)})'] + _formatear_resumen(medias)
+    if evaluacion:
+        fila.append(f'{num_nok} {NOK}' if num_nok else 'OK')
+    return fila, ('subtotal_nok' if num_nok else 'subtotal')
+
+
+def filas_resumen(piezas_ordenadas, evaluacion=None, agrupar_por_of=False):
+    """Filas de la tabla resumen como (fila, tipo); tipo es None, 'nok', 'subtotal' o 'subtotal_nok'.
+
+    Con `agrupar_por_of` se añade tras cada OF una fila con la media de sus piezas y sus NOK.
+    """
+    filas = []
+    of_actual = None
+    valores_of = []
+    nok_of = 0
+    for pieza_id, pieza_info in piezas_ordenadas:
+        of = pieza_info.get('of', 0)
+        if agrupar_por_of and valores_of and of != of_actual:
+            filas.append(_subtotal(of_actual, valores_of, nok_of, evaluacion))
+            valores_of, nok_of = [], 0
+        of_actual = of
+
+        valores = valores_resumen(pieza_info.get('cargas', {}))
+        fila = [pieza_info.get('referencia', pieza_id)] + _formatear_resumen(valores)
+        tipo = None
+        if evaluacion:
+            resultado = evaluacion['piezas'][pieza_id]['resultado']
+            fila.append(resultado)
+            if resultado == NOK:
+                tipo = 'nok'
+                nok_of += 1
+        if agrupar_por_of:
+            valores_of.append(valores)
+        filas.append((fila, tipo))
+    if agrupar_por_of and valores_of:
+        filas.append(_subtotal(of_actual, valores_of, nok_of, evaluacion))
+    return filas
+
+
+class TablaDiferida(Flowable):
+    """Tabla que se construye al maquetarla y se libera al dibujarla.
+
+    Una Table guarda un estilo por celda; con cientos de tablas en el informe, crearlas todas antes de
+    doc.build ocuparía memoria proporcional al número de piezas.
+    """
+
+    def __init__(self, crear):
+        super().__init__()
+        self._crear = crear
+        self._tabla = None
+        self.hAlign = 'CENTER'
+
+    def _obtener(self):
+        if self._tabla is None:
+            self._tabla = self._crear()
+        return self._tabla
+
+    def wrap(self, availWidth, availHeight):
+        return self._obtener().wrap(availWidth, availHeight)
+
+    def split(self, availWidth, availHeight):
+        partes = self._obtener().split(availWidth, availHeight)
+        self._tabla = None
+        return partes
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        self._obtener().drawOn(canvas, x, y, _sW)
+        self._tabla = None
+
+
+def tablas_resumen(filas, cabecera, anchos, filas_por_tabla):
+    """Tablas de como mucho `filas_por_tabla` filas con la cabecera repetida (una sola si caben todas).
+
+    Si hay más de una, se devuelven como TablaDiferida.
+    """
+    bloques = [filas[inicio:inicio + filas_por_tabla]
+               for inicio in range(0, max(len(filas), 1), max(filas_por_tabla, 1))]
+    if len(bloques) == 1:
+        return [_tabla_resumen(bloques[0], cabecera, anchos)]
+    return [TablaDiferida(lambda bloque=bloque: _tabla_resumen(bloque, cabecera, anchos)) for bloque in bloques]
+
+
+def _tabla_resumen(bloque, cabecera, anchos):
+    tabla = Table([cabecera] + [fila for fila, _ in bloque], colWidths=anchos, repeatRows=1)
+    tabla.setStyle(ESTILO_TABLA_RESUMEN)
+    estilos = []
+    for i, (_, tipo) in enumerate(bloque, start=1):
+        if tipo in ('subtotal', 'subtotal_nok'):
+            estilos += [('BACKGROUND', (0, i), (-1, i), COLOR_SUBTOTAL),
+                        ('FONTNAME', (0, i), (-1, i), 'Helvetica-Bold')]
+        if tipo in ('nok', 'subtotal_nok'):
+            estilos += [('TEXTCOLOR', (-1, i), (-1, i), COLOR_NOK),
+                        ('FONTNAME', (-1, i), (-1, i), 'Helvetica-Bold')]
+    if estilos:
+        tabla.setStyle(TableStyle(estilos))
+    return tabla
+
+
+def construir_informe_masivo(data, progreso=None):
+    """Generar el PDF de carga masiva con múltiples piezas. Devuelve (buffer, nombre_archivo)
+
+    `progreso`, si se indica, recibe la fracción construida del documento (0 a 1). En modo paginado
+    (`paginado`, por defecto con UMBRAL_INFORME_PAGINADO piezas o más) `buffer` es un archivo temporal
+    en lugar de un BytesIO. `agrupar_por_of` añade una fila de subtotal tras cada OF.
+    """
+    referencia_excel = data.get('referencia_excel', None)
+    piezas = data.get('piezas', {})
+    referencia_bmw = data.get('referencia_bmw', None)
+    dispersion_par = data.get('dispersion_par', 0)
+    dispersion_consumo = data.get('dispersion_consumo', 0)
+    # Mantener compatibilidad con versiones anteriores
+    if dispersion_par == 0 and dispersion_consumo == 0:
+        dispersion_par = data.get('dispersion', 0)
+    imagen_grafico_pares = data.get('imagen_grafico_pares', None)
+    imagen_grafico_consumos = data.get('imagen_grafico_consumos', None)
+    # Modo paginado para informes grandes (por defecto a partir de UMBRAL_INFORME_PAGINADO piezas)
+    paginado = data.get('paginado')
+    if paginado is None:
+        paginado = len(piezas) >= UMBRAL_INFORME_PAGINADO
+    agrupar_por_of = bool(data.get('agrupar_por_of', False))
+
+    # Crear el PDF en memoria o, en modo paginado, en un archivo temporal que se borra al cerrarlo
+    buffer = tempfile.TemporaryFile() if paginado else BytesIO()
+    doc = nuevo_documento(buffer, progreso)
+    elements = []
+
+    # Título
+    titulo = "Informe de Par Masivo"
+    if referencia_excel:
+        titulo += f" - {referencia_excel}"
+    elements.append(Paragraph(titulo, ESTILO_TITULO_MASIVO))
+    elements.append(Spacer(1, 6))
+
+    # Información general
+    info_data = [
+        ['Fecha:', datetime.now().strftime('%d/%m/%Y %H:%M:%S')],
+        ['Número de piezas:', str(len(piezas))]
+    ]
+
+    if referencia_excel:
+        info_data.append(['Referencia Excel:', referencia_excel])
+    if referencia_bmw:
+        info_data.append(['Referencia BMW:', referencia_bmw])
+    if dispersion_par > 0:
+        info_data.append(['Dispersión Par:', f'{dispersion_par}%'])
+    if dispersion_consumo > 0:
+        info_data.append(['Dispersión Consumo:', f'{dispersion_consumo}%'])
+
+    # Evaluación de tolerancias frente al patrón (si hay patrón y alguna dispersión)
+    patron = cargar_patrones().get(referencia_bmw) if referencia_bmw else None
+    evaluacion = None
+    if patron and (dispersion_par > 0 or dispersion_consumo > 0):
+        with tramo('evaluacion_tolerancias'):
+            evaluacion = evaluar_piezas(piezas, patron, dispersion_par, dispersion_consumo, detalle=False)
+        resumen_evaluacion = evaluacion['resumen']
+        texto_tolerancia = f"{resumen_evaluacion['ok']} OK / {resumen_evaluacion['nok']} NOK"
+        if resumen_evaluacion['sin_datos']:
+            texto_tolerancia += f" / {resumen_evaluacion['sin_datos']} sin datos"
+        info_data.append(['Tolerancia:', texto_tolerancia])
+
+    elements.append(tabla_info(info_data))
+    elements.append(Spacer(1, 10))
+
+    # Tabla resumen de todas las piezas (solo 0% y 100%)
+    cabecera = CABECERA_TABLA_RESUMEN_TOLERANCIA if evaluacion else CABECERA_TABLA_RESUMEN
+    anchos = ANCHOS_TABLA_RESUMEN_TOLERANCIA if evaluacion else ANCHOS_TABLA_RESUMEN
+
+    with tramo('tabla_resumen'):
+        # Ordenar piezas por OF y número de pieza
+        piezas_ordenadas = sorted(piezas.items(), key=lambda x: (
+            x[1].get('of', 0),
+            x[1].get('pieza', 0)
+        ))
+        filas = filas_resumen(piezas_ordenadas, evaluacion, agrupar_por_of)
+        for tabla in tablas_resumen(filas, cabecera, anchos, FILAS_POR_TABLA if paginado else len(filas)):
+            elements.append(tabla)
+        del filas
+    elements.append(Spacer(1, 10))
+
+    # Datos para los gráficos generados en el servidor (mismo orden que la tabla resumen)
+    series_grafico = [(pieza_info.get('referencia', pieza_id), pieza_info.get('cargas', {}))
+                      for pieza_id, pieza_info in piezas_ordenadas]
+
+    # Gráficos de par y de consumo (en páginas separadas)
+    anadir_grafico(elements, 'Gráfico de Par (Nm)', imagen_grafico_pares,
+                   series_grafico, 'pares', patron, dispersion_par)
+    elements.append(PageBreak())
+    anadir_grafico(elements, 'Gráfico de Consumo (A)', imagen_grafico_consumos,
+                   series_grafico, 'consumos', patron, dispersion_consumo)
+
+    # Página opcional con las estadísticas por OF y del total
+    if data.get('resumen_estadistico'):
+        with tramo('estadisticas_spc'):
+            estadisticas = calcular_estadisticas(TablaPiezas.desde_dict(piezas), patron,
+                                                 dispersion_par, dispersion_consumo)
+        elements.append(PageBreak())
+        anadir_resumen_estadistico(elements, estadisticas)
+
+    # Construir PDF
+    with tramo('doc_build'):
+        doc.build(elements)
+    buffer.seek(0)
+
+    # Nombre del archivo
+    nombre_archivo = f"Informe_Masivo_{referencia_excel.replace(' ', '_') if referencia_excel else datetime.now().strftime('%Y%m%d')}.pdf"
+
+    return buffer, nombre_archivo
+
+
+def construir_informe(data, progreso=None):
+    """Generar el PDF de una pieza. Devuelve (buffer, nombre_archivo)
+
+    `progreso`, si se indica, recibe la fracción construida del documento (0 a 1).
+    """
+    referencia = data.get('referencia', 'Sin referencia')
+    cargas = data.get('cargas', {})
+    referencia_bmw = data.get('referencia_bmw', None)
+    dispersion_par = data.get('dispersion_par', 0)
+    dispersion_consumo = data.get('dispersion_consumo', 0)
+    # Mantener compatibilidad con versiones anteriores
+    if dispersion_par == 0 and dispersion_consumo == 0:
+        dispersion_par = data.get('dispersion', 0)
+    ruido = data.get('ruido', 0)
+    imagen_grafico_pares = data.get('imagen_grafico_pares', None)
+    imagen_grafico_consumos = data.get('imagen_grafico_consumos', None)
+    # Mantener compatibilidad con versiones anteriores
+    if not imagen_grafico_pares and not imagen_grafico_consumos:
+        imagen_grafico_pares = data.get('imagen_grafico', None)
+
+    # Crear el PDF en memoria
+    buffer = BytesIO()
+    doc = nuevo_documento(buffer, progreso)
+    elements = []
+
+    # Título
+    elements.append(Paragraph(f"Informe de Par - {referencia}", ESTILO_TITULO))
+    elements.append(Spacer(1, 6))
+
+    # Información general
+    info_data = [
+        ['Referencia:', referencia],
+        ['Fecha:', datetime.now().strftime('%d/%m/%Y %H:%M:%S')]
+    ]
+
+    if referencia_bmw:
+        info_data.append(['Referencia BMW:', referencia_bmw])
+    if dispersion_par > 0:
+        info_data.append(['Dispersión Par:', f'{dispersion_par}%'])
+    if dispersion_consumo > 0:
+        info_data.append(['Dispersión Consumo:', f'{dispersion_consumo}%'])
+
+    elements.append(tabla_info(info_data))
+    elements.append(Spacer(1, 10))
+
+    # Tabla de cargas (solo 0% y 100%)
+    carga_data = [CABECERA_TABLA_CARGAS]
+
+    for percent in ['0', '100']:
+        if percent in cargas:
+            # Para el 100%, mostrar el valor del ruido del box; para el 0%, mostrar '-'
+            valor_ruido = ruido if percent == '100' else 0
+            carga_data.append([
+                f'{percent}%',
+                f"{cargas[percent].get('izquierda', 0):.1f}",
+                f"{cargas[percent].get('derecha', 0):.1f}",
+                f"{cargas[percent].get('consumo_izquierda', 0):.2f}",
+                f"{cargas[percent].get('consumo_derecha', 0):.2f}",
+                f"{valor_ruido:.2f}" if valor_ruido > 0 else '-'
+            ])
+
+    carga_table = Table(carga_data, colWidths=ANCHOS_TABLA_CARGAS)
+    carga_table.setStyle(ESTILO_TABLA_CARGAS)
+    elements.append(Paragraph('Datos de Par y Consumo', ESTILO_SUBTITULO))
+    elements.append(Spacer(1, 6))
+    elements.append(carga_table)
+    elements.append(Spacer(1, 10))
+
+    # Datos para los gráficos generados en el servidor
+    series_grafico = [(referencia, cargas)]
+    patron = cargar_patrones().get(referencia_bmw) if referencia_bmw else None
+
+    # Gráficos de par y de consumo (en páginas separadas)
+    anadir_grafico(elements, 'Gráfico de Par (Nm)', imagen_grafico_pares,
+                   series_grafico, 'pares', patron, dispersion_par)
+    elements.append(PageBreak())
+    anadir_grafico(elements, 'Gráfico de Consumo (A)', imagen_grafico_consumos,
+                   series_grafico, 'consumos', patron, dispersion_consumo)
+
+    # Construir PDF
+    with tramo('doc_build'):
+        doc.build(elements)
+    buffer.seek(0)
+
+    # Nombre del archivo
+    nombre_archivo = f"Informe_{referencia.replace(' ', '_')}.pdf"
+
+    return buffer, nombre_archivo
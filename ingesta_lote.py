@@ -0,0 +1,141 @@
+"""Ingesta en lote de varios Excel (o de un ZIP con Excel) procesados en un pool de procesos"""
+import os
+import time
+import zipfile
+from concurrent.futures import BrokenExecutor, as_completed
+from io import BytesIO
+
+from cache_resultados import clave_contenido
+from pool_procesos import cerrar_pool, descartar_pool, elegir_pool
+from procesador_excel import VERSION_PROCESADOR, procesar_libro
+
+# Número de procesos por defecto para procesar los Excel en paralelo
+WORKERS_INGESTA = int(os.environ.get('INGESTA_WORKERS', 0)) or os.cpu_count() or 1
+
+EXTENSIONES_EXCEL = ('.xlsx', '.xlsm')
+
+# Clave de las piezas de un Excel cuyo título no tiene referencia
+SIN_REFERENCIA = 'Sin referencia'
+
+
+def expandir_archivos(archivos):
+    """Sustituir cada ZIP por los Excel que contiene.
+
+    `archivos` es una lista de (nombre, bytes). Devuelve (excel, errores), donde `excel` es una lista
+    de (nombre, bytes) y `errores` los archivos que no se pueden procesar.
+    """
+    excel, errores = [], []
+    for nombre, datos in archivos:
+        if nombre.lower().endswith('.zip'):
+            try:
+                with zipfile.ZipFile(BytesIO(datos)) as zip_excel:
+                    for entrada in zip_excel.infolist():
+                        nombre_entrada = entrada.filename
+                        base = os.path.basename(nombre_entrada)
+                        # Se ignoran directorios, metadatos de macOS y archivos de bloqueo de Excel (~$)
+                        if (entrada.is_dir() or nombre_entrada.startswith('__MACOSX/') or base.startswith('~$')
+                                or not base.lower().endswith(EXTENSIONES_EXCEL)):
+                            continue
+                        excel.append((f'{nombre}/{nombre_entrada}', zip_excel.read(entrada)))
+            except zipfile.BadZipFile:
+                errores.append({'archivo': nombre, 'estado': 'error', 'error': 'ZIP no válido'})
+        elif nombre.lower().endswith(EXTENSIONES_EXCEL):
+            excel.append((nombre, datos))
+        else:
+            errores.append({'archivo': nombre, 'estado': 'error', 'error': 'Tipo de archivo no soportado'})
+    return excel, errores
+
+
+def _procesar_archivo(indice, nombre, datos, modo_lectura):
+    """Procesar un Excel en un proceso del pool; los errores se devuelven en lugar de lanzarse"""
+    inicio = time.perf_counter()
+    try:
+        referencia_excel, tabla = procesar_libro(BytesIO(datos), modo_lectura)
+    except Exception as e:
+        return indice, {'archivo': nombre, 'estado': 'error', 'error': str(e),
+                        'segundos': round(time.perf_counter() - inicio, 4)}
+    return indice, {
+        'archivo': nombre,
+        'estado': 'ok',
+        'clave': clave_contenido(datos, VERSION_PROCESADOR),
+        'referencia_excel': referencia_excel,
+        # La tabla en columnas ocupa mucho menos que el diccionario al devolverla al proceso principal
+        'tabla': tabla,
+        'segundos': round(time.perf_counter() - inicio, 4)
+    }
+
+
+def procesar_archivos(excel, modo_lectura=None, workers=None, umbral_streaming=2 * 1024 * 1024):
+    """Procesar los Excel en el pool y devolver (infos en el orden recibido, workers).
+
+    Cada info correcta lleva la TablaPiezas en 'tabla'; las erróneas, el mensaje en 'error'.
+    """
+    pool, workers, propio = elegir_pool('ingesta', workers, WORKERS_INGESTA)
+
+    por_indice = {}
+    try:
+        futuros = [
+            pool.submit(_procesar_archivo, indice, nombre, datos,
+                        modo_lectura or ('streaming' if len(datos) > umbral_streaming else 'completa'))
+            for indice, (nombre, datos) in enumerate(excel)
+        ]
+        for futuro in as_completed(futuros):
+            indice, info = futuro.result()
+            por_indice[indice] = info
+    except BrokenExecutor:
+        if not propio:
+            # Un proceso del pool compartido ha muerto: la próxima petición crea otro
+            descartar_pool('ingesta', pool)
+        raise
+    finally:
+        cerrar_pool(pool, propio)
+    return [por_indice[indice] for indice in range(len(excel))], workers
+
+
+def procesar_lote(archivos, modo_lectura=None, workers=None, umbral_streaming=2 * 1024 * 1024):
+    """Procesar en paralelo varios Excel y combinar sus piezas por referencia, OF y pieza.
+
+    `archivos` es una lista de (nombre, bytes) con Excel o ZIP. Sin `modo_lectura`, los Excel mayores de
+    `umbral_streaming` bytes se leen en streaming. Si una misma pieza aparece en varios
+    archivos se queda la del último en el orden recibido, igual que las filas repetidas dentro de un Excel.
+    Devuelve (resultado, procesados), donde `procesados` son los archivos correctos con sus piezas.
+    """
+    inicio = time.perf_counter()
+    excel, errores = expandir_archivos(archivos)
+    infos, workers = procesar_archivos(excel, modo_lectura, workers, umbral_streaming)
+
+    # Combinar en el orden recibido (no en el de finalización) para que el resultado sea reproducible
+    referencias = {}
+    archivos_info = list(errores)
+    procesados = []
+    reemplazadas = 0
+    for info in infos:
+        if info['estado'] != 'ok':
+            archivos_info.append(info)
+            continue
+        info['piezas'] = info.pop('tabla').a_dict()
+        procesados.append(info)
+        piezas_referencia = referencias.setdefault(info['referencia_excel'] or SIN_REFERENCIA, {})
+        for clave_pieza, pieza_info in info['piezas'].items():
+            if clave_pieza in piezas_referencia:
+                reemplazadas += 1
+            piezas_referencia[clave_pieza] = dict(pieza_info, archivo=info['archivo'])
+        archivos_info.append({clave: valor for clave, valor in info.items() if clave != 'piezas'}
+                             | {'num_piezas': len(info['piezas'])})
+
+    segundos = time.perf_counter() - inicio
+    resultado = {
+        'referencias': {
+            referencia: {clave: piezas[clave] for clave in sorted(piezas)}
+            for referencia, piezas in referencias.items()
+        },
+        'archivos': archivos_info,
+        'num_archivos': len(excel) + len(errores),
+        'num_errores': len(archivos_info) - len(procesados),
+        'num_piezas': sum(len(piezas) for piezas in referencias.values()),
+        'piezas_reemplazadas': reemplazadas,
+        'workers': workers,
+        'segundos': round(segundos, 4),
+        'archivos_por_segundo': round(len(excel) / segundos, 2) if segundos > 0 else None
+    }
+    return resultado, procesados
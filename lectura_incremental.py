@@ -0,0 +1,260 @@
+"""Lectura incremental de libros a los que el banco de pruebas solo añade filas.
+
+Durante un turno se vuelve a subir el mismo Excel con filas nuevas al final. Por cada referencia_excel
+se guarda la última fila de datos leída, la huella (SHA-1) de los bytes XML de la hoja hasta esa fila y
+las filas que pueden aparecer en el resultado (`compactar_columnas`). Si en la nueva subida el XML hasta
+esa fila es idéntico, solo se interpretan las filas siguientes y se combinan con las guardadas; si no,
+se lee el libro completo.
+
+El XML del prefijo se descomprime y se compara byte a byte, pero no se interpreta: es la parte cara
+de la lectura con openpyxl.
+
+Para llegar al XML de la hoja se usan atributos privados de openpyxl (probados con la versión fijada en
+requirements.txt). Si otra versión no los tiene o cambia el constructor de ReadOnlyWorksheet, se lee
+siempre el libro completo.
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+
+try:
+    from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+except ImportError:
+    ReadOnlyWorksheet = None
+
+from procesador_excel import (COL_VALOR_L, COLUMNAS_HOJA, FILA_INICIO_DATOS, HOJA_ANALISIS, FormatoExcelError,
+                              compactar_columnas, extraer_referencia, leer_libro, normalizar_fila)
+
+TAMANO_BLOQUE = 1024 * 1024
+_INICIO_SHEETDATA = re.compile(rb'<sheetData\s*(/?)>')
+_INICIO_FILA = b'<row'
+_FIN_SHEETDATA = b'</sheetData>'
+
+
+class EstadoLibro:
+    """Lo necesario para continuar la lectura de un libro de una referencia"""
+
+    __slots__ = ('referencia', 'ultima_fila', 'huella', 'num_columnas', 'cadenas', 'columnas')
+
+    def __init__(self, referencia, ultima_fila, huella, num_columnas, cadenas, columnas):
+        self.referencia = referencia
+        # Número de fila de Excel (1 = título) de la última fila de datos leída
+        self.ultima_fila = ultima_fila
+        self.huella = huella
+        self.num_columnas = num_columnas
+        # Huella de las cadenas compartidas que podían usar esas filas (número, SHA-1)
+        self.cadenas = cadenas
+        self.columnas = columnas
+
+
+class RegistroIncremental:
+    """Estado de los últimos libros leídos, uno por referencia_excel (LRU)"""
+
+    def __init__(self, max_libros=32):
+        self.max_libros = max_libros
+        self._estados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obtener(self, referencia):
+        with self._lock:
+            estado = self._estados.get(referencia)
+            if estado is not None:
+                self._estados.move_to_end(referencia)
+            return estado
+
+    def guardar(self, estado):
+        with self._lock:
+            self._estados[estado.referencia] = estado
+            self._estados.move_to_end(estado.referencia)
+            while len(self._estados) > self.max_libros:
+                self._estados.popitem(last=False)
+
+    def __len__(self):
+        return len(self._estados)
+
+
+registro_incremental = RegistroIncremental(int(os.environ.get('INCREMENTAL_MAX_LIBROS', 32)))
+
+
+if ReadOnlyWorksheet is not None and hasattr(ReadOnlyWorksheet, '_get_source'):
+    class _HojaParcial(ReadOnlyWorksheet):
+        """Hoja de solo lectura cuyo XML es la cabecera de la hoja original más las filas añadidas"""
+
+        def __init__(self, libro, titulo, xml, cadenas):
+            self._xml = xml
+            super().__init__(libro, titulo, None, cadenas)
+
+        def _get_source(self):
+            return BytesIO(self._xml)
+else:
+    _HojaParcial = None
+
+
+def _internos(libro, hoja):
+    """(archivo zip, ruta del XML de la hoja, cadenas compartidas) o None si openpyxl no los expone"""
+    if _HojaParcial is None:
+        return None
+    archivo = getattr(libro, '_archive', None)
+    ruta = getattr(hoja, '_worksheet_path', None)
+    cadenas = getattr(hoja, '_shared_strings', None)
+    if archivo is None or ruta is None or cadenas is None:
+        return None
+    return archivo, ruta, cadenas
+
+
+def _huella_cadenas(cadenas, num_cadenas):
+    return hashlib.sha1(repr(list(cadenas[:num_cadenas])).encode('utf-8')).digest()
+
+
+def _dividir_xml(flujo, ultima_fila):
+    """Separar el XML de la hoja en (cabecera hasta <sheetData>, huella de las filas hasta `ultima_fila`, resto).
+
+    El resto son los bytes desde el elemento siguiente a esa fila hasta </sheetData>. Devuelve None si la
+    hoja no tiene esa fila.
+    """
+    marca = f'<row r="{ultima_fila}"'.encode()
+    buffer = b''
+    cabecera = None
+    huella = hashlib.sha1()
+    fase = 'cabecera'
+    resto = []
+    while True:
+        bloque = flujo.read(TAMANO_BLOQUE)
+        buffer += bloque
+        if fase == 'cabecera':
+            coincidencia = _INICIO_SHEETDATA.search(buffer)
+            if coincidencia is None:
+                if not bloque:
+                    return None
+                continue
+            if coincidencia.group(1):
+                return None
+            cabecera, buffer = buffer[:coincidencia.end()], buffer[coincidencia.end():]
+            fase = 'prefijo'
+
+        if fase == 'prefijo':
+            posicion = buffer.find(marca)
+            if posicion < 0:
+                if not bloque:
+                    return None
+                # Se guardan los últimos bytes por si la marca queda partida entre dos bloques
+                corte = max(len(buffer) - len(marca), 0)
+                huella.update(buffer[:corte])
+                buffer = buffer[corte:]
+                continue
+            fase = 'fila'
+            huella.update(buffer[:posicion + len(marca)])
+            buffer = buffer[posicion + len(marca):]
+
+        if fase == 'fila':
+            # La fila termina donde empieza el elemento <row> siguiente o </sheetData>
+            fin = [p for p in (buffer.find(_INICIO_FILA), buffer.find(_FIN_SHEETDATA)) if p >= 0]
+            if not fin:
+                if not bloque:
+                    return None
+                corte = max(len(buffer) - len(_FIN_SHEETDATA), 0)
+                huella.update(buffer[:corte])
+                buffer = buffer[corte:]
+                continue
+            huella.update(buffer[:min(fin)])
+            buffer = buffer[min(fin):]
+            fase = 'resto'
+
+        if fase == 'resto':
+            posicion = buffer.find(_FIN_SHEETDATA)
+            if posicion >= 0:
+                resto.append(buffer[:posicion])
+                return cabecera, huella.digest(), b''.join(resto)
+            if not bloque:
+                return None
+            corte = max(len(buffer) - len(_FIN_SHEETDATA), 0)
+            resto.append(buffer[:corte])
+            buffer = buffer[corte:]
+
+
+def _leer_filas_nuevas(libro, hoja, cadenas, cabecera, resto, desde_fila):
+    """Columnas de las filas de datos desde `desde_fila` hasta la primera en blanco (None si openpyxl no lo permite)"""
+    xml = cabecera + resto + b'</sheetData></worksheet>'
+    try:
+        parcial = _HojaParcial(libro, hoja.title, xml, cadenas)
+    except (TypeError, AttributeError):
+        return None
+    valores = {nombre: [] for nombre in COLUMNAS_HOJA}
+    for fila in parcial.iter_rows(min_row=desde_fila, max_col=COL_VALOR_L + 1, values_only=True):
+        fila = normalizar_fila(list(fila))
+        if fila is None:
+            break
+        for nombre, indice in COLUMNAS_HOJA.items():
+            valores[nombre].append(fila[indice])
+    return {nombre: np.array(lista, dtype=object) for nombre, lista in valores.items()}
+
+
+def _concatenar(guardadas, nuevas):
+    return {nombre: (np.concatenate([guardadas[nombre], nuevas[nombre]]) if guardadas[nombre] is not None else None)
+            for nombre in COLUMNAS_HOJA}
+
+
+def leer_libro_incremental(datos, registro=None):
+    """Leer la pestaña "Análisis de test" reutilizando la lectura anterior del mismo libro si solo tiene filas nuevas.
+
+    Devuelve (referencia_excel, columnas, info), donde `columnas` son las filas guardadas más las
+    nuevas e `info` indica el modo ('incremental' o 'completa') y las filas reutilizadas y leídas.
+    """
+    registro = registro or registro_incremental
+    libro = openpyxl.load_workbook(BytesIO(datos), read_only=True, data_only=True)
+    try:
+        try:
+            hoja = libro[HOJA_ANALISIS]
+        except KeyError:
+            raise FormatoExcelError('No se encontró la pestaña "Análisis de test"')
+        titulo = next(hoja.iter_rows(max_row=1, max_col=1, values_only=True), (None,))
+        referencia_excel = extraer_referencia(titulo[0] if titulo else None)
+        internos = _internos(libro, hoja)
+        estado = registro.obtener(referencia_excel) if referencia_excel and internos else None
+
+        if (estado is not None and estado.num_columnas == hoja.max_column
+                and _huella_cadenas(internos[2], estado.cadenas[0]) == estado.cadenas[1]):
+            with internos[0].open(internos[1]) as flujo:
+                partes = _dividir_xml(flujo, estado.ultima_fila)
+            nuevas = None
+            if partes is not None and partes[1] == estado.huella:
+                cabecera, _, resto = partes
+                nuevas = _leer_filas_nuevas(libro, hoja, internos[2], cabecera, resto, estado.ultima_fila + 1)
+            if nuevas is not None:
+                columnas = _concatenar(estado.columnas, nuevas)
+                _guardar_estado(registro, internos, hoja, referencia_excel,
+                                estado.ultima_fila + len(nuevas['pieza']), columnas)
+                return referencia_excel, columnas, {
+                    'modo': 'incremental',
+                    'filas_reutilizadas': estado.ultima_fila - FILA_INICIO_DATOS,
+                    'filas_leidas': len(nuevas['pieza']),
+                }
+
+        # Primera lectura de la referencia, el libro no coincide u openpyxl sin esos internos: lectura completa
+        referencia_excel, columnas = leer_libro(BytesIO(datos), 'streaming')
+        filas = len(columnas['pieza']) if columnas is not None else 0
+        if referencia_excel and internos:
+            _guardar_estado(registro, internos, hoja, referencia_excel, FILA_INICIO_DATOS + filas, columnas)
+        return referencia_excel, columnas, {'modo': 'completa', 'filas_reutilizadas': 0, 'filas_leidas': filas}
+    finally:
+        libro.close()
+
+
+def _guardar_estado(registro, internos, hoja, referencia_excel, ultima_fila, columnas):
+    """Guardar la huella del XML hasta `ultima_fila` y las filas compactadas"""
+    if ultima_fila <= FILA_INICIO_DATOS:
+        return
+    archivo, ruta, cadenas = internos
+    with archivo.open(ruta) as flujo:
+        partes = _dividir_xml(flujo, ultima_fila)
+    if partes is None:
+        return
+    registro.guardar(EstadoLibro(referencia_excel, ultima_fila, partes[1], hoja.max_column,
+                                 (len(cadenas), _huella_cadenas(cadenas, len(cadenas))),
+                                 compactar_columnas(columnas)))
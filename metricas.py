@@ -0,0 +1,192 @@
+"""Métricas de la aplicación en formato de texto de Prometheus y tramos de tiempo por petición.
+
+`tramo('fase')` mide una fase (lectura del Excel, agregación, construcción del PDF...) y la acumula
+en el histograma `cargas_fase_segundos` y en los datos de la petición en curso, si la hay.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BUCKETS_BYTES = tuple(1024 * 4 ** i for i in range(10))  # 1 KB .. 256 MB
+BUCKETS_CANTIDAD = (1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000, 500000)
+
+# nombre: (tipo, ayuda, buckets)
+DEFINICIONES = {
+    'cargas_peticiones_total': ('counter', 'Peticiones atendidas', None),
+    'cargas_peticion_segundos': ('histogram', 'Duración de las peticiones', BUCKETS_SEGUNDOS),
+    'cargas_peticion_bytes': ('histogram', 'Tamaño del cuerpo de las peticiones', BUCKETS_BYTES),
+    'cargas_fase_segundos': ('histogram', 'Duración de cada fase del procesado', BUCKETS_SEGUNDOS),
+    'cargas_filas_procesadas': ('histogram', 'Filas de la pestaña "Análisis de test" por Excel', BUCKETS_CANTIDAD),
+    'cargas_piezas_procesadas': ('histogram', 'Piezas obtenidas por Excel o por informe', BUCKETS_CANTIDAD),
+    'cargas_pdf_bytes': ('histogram', 'Tamaño de los PDF generados', BUCKETS_BYTES),
+    'cargas_imagenes_total': ('counter', 'Imágenes de gráficos recibidas (procesada, cache, invalida)', None),
+    'cargas_imagenes_bytes_recibidos_total': ('counter', 'Bytes de las imágenes de gráficos recibidas', None),
+    'cargas_imagenes_bytes_ahorrados_total': ('counter', 'Bytes ahorrados al reducir las imágenes de gráficos', None),
+    'cargas_informes_lote_total': ('counter', 'Informes de /api/generar-informes-lote (ok, error)', None),
+    'cargas_informe_lote_segundos': ('histogram', 'Tiempo de cada informe de /api/generar-informes-lote',
+                                     BUCKETS_SEGUNDOS),
+    'cargas_lote_informes_segundos': ('histogram', 'Duración total de cada ZIP de /api/generar-informes-lote',
+                                      BUCKETS_SEGUNDOS),
+    'cargas_filas_exportadas_total': ('counter', 'Filas exportadas por /api/exportar (csv, parquet, xlsx)', None),
+}
+
+# Petición en curso: {'endpoint': ..., 'tramos': {fase: segundos}, 'datos': {...}}
+_peticion_actual = ContextVar('peticion_actual', default=None)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formato_etiquetas(etiquetas):
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas) + '}'
+
+
+def _formato_valor(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Metricas:
+    """Registro de contadores e histogramas con etiquetas, seguro entre hilos"""
+
+    def __init__(self, definiciones=DEFINICIONES):
+        self.definiciones = definiciones
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        buckets = self.definiciones[nombre][2]
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._valores.get(clave)
+            if histograma is None:
+                histograma = self._valores[clave] = {'buckets': [0] * len(buckets), 'suma': 0.0, 'cuenta': 0}
+            for i, limite in enumerate(buckets):
+                if valor <= limite:
+                    histograma['buckets'][i] += 1
+            histograma['suma'] += valor
+            histograma['cuenta'] += 1
+
+    def reiniciar(self):
+        with self._lock:
+            self._valores.clear()
+
+    def exportar(self, medidores=None):
+        """Texto de Prometheus; `medidores` añade gauges calculados al exportar ({nombre: (ayuda, valor)})"""
+        with self._lock:
+            valores = {clave: (dict(valor, buckets=list(valor['buckets'])) if isinstance(valor, dict) else valor)
+                       for clave, valor in self._valores.items()}
+        lineas = []
+        for nombre, (tipo, ayuda, buckets) in self.definiciones.items():
+            series = sorted((etiquetas, valor) for (n, etiquetas), valor in valores.items() if n == nombre)
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} {tipo}')
+            for etiquetas, valor in series:
+                if tipo != 'histogram':
+                    lineas.append(f'{nombre}{_formato_etiquetas(etiquetas)} {_formato_valor(valor)}')
+                    continue
+                for limite, cuenta in zip(buckets, valor['buckets']):
+                    lineas.append(f'{nombre}_bucket{_formato_etiquetas(etiquetas + (("le", limite),))} {cuenta}')
+                lineas.append(f'{nombre}_bucket{_formato_etiquetas(etiquetas + (("le", "+Inf"),))} {valor["cuenta"]}')
+                lineas.append(f'{nombre}_sum{_formato_etiquetas(etiquetas)} {_formato_valor(valor["suma"])}')
+                lineas.append(f'{nombre}_count{_formato_etiquetas(etiquetas)} {valor["cuenta"]}')
+        for nombre, (ayuda, valor) in (medidores or {}).items():
+            lineas.append(f'# HELP {nombre} {ayuda}')
+            lineas.append(f'# TYPE {nombre} gauge')
+            lineas.append(f'{nombre} {_formato_valor(valor)}')
+        return '\n'.join(lineas) + '\n'
+
+
+metricas = Metricas()
+
+
+def iniciar_peticion(endpoint):
+    """Empezar a acumular los tramos de una petición; devuelve el token para terminarla"""
+    return _peticion_actual.set({'endpoint': endpoint, 'tramos': {}, 'datos': {}})
+
+
+def terminar_peticion(token):
+    """Dejar de acumular y devolver los datos de la petición"""
+    peticion = _peticion_actual.get()
+    _peticion_actual.reset(token)
+    return peticion
+
+
+def peticion_actual():
+    return _peticion_actual.get()
+
+
+def con_peticion(iterable):
+    """Iterar una respuesta en streaming con los datos de la petición que la creó.
+
+    El cuerpo de una respuesta en streaming se genera después de terminar la petición; así sus
+    tramos se siguen asignando al endpoint correcto.
+    """
+    peticion = _peticion_actual.get()
+    iterador = iter(iterable)
+    while True:
+        token = _peticion_actual.set(peticion)
+        try:
+            elemento = next(iterador)
+        except StopIteration:
+            return
+        finally:
+            _peticion_actual.reset(token)
+        yield elemento
+
+
+def anotar(**datos):
+    """Añadir datos (filas, piezas, bytes del PDF...) al registro de la petición en curso"""
+    peticion = _peticion_actual.get()
+    if peticion is not None:
+        peticion['datos'].update(datos)
+
+
+@contextmanager
+def tramo(fase):
+    """Medir una fase del procesado"""
+    peticion = _peticion_actual.get()
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        segundos = time.perf_counter() - inicio
+        endpoint = peticion['endpoint'] if peticion is not None else 'sin_peticion'
+        metricas.observar('cargas_fase_segundos', segundos, endpoint=endpoint, fase=fase)
+        if peticion is not None:
+            peticion['tramos'][fase] = round(peticion['tramos'].get(fase, 0) + segundos, 6)
+
+
+def funciones_principales(perfil, limite=25):
+    """Funciones con más tiempo acumulado de un cProfile.Profile ya detenido"""
+    estadisticas = pstats.Stats(perfil, stream=io.StringIO())
+    filas = []
+    for (archivo, linea, funcion), (_, llamadas, propio, acumulado, _) in estadisticas.stats.items():
+        filas.append({
+            'funcion': funcion,
+            'archivo': archivo,
+            'linea': linea,
+            'llamadas': llamadas,
+            'tiempo_propio': round(propio, 6),
+            'tiempo_acumulado': round(acumulado, 6)
+        })
+    filas.sort(key=lambda fila: fila['tiempo_acumulado'], reverse=True)
+    return filas[:limite]
+
+
+def nuevo_perfil():
+    perfil = cProfile.Profile()
+    perfil.enable()
+    return perfil
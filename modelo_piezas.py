@@ -0,0 +1,114 @@
+"""Representación en columnas de las piezas y sus cargas.
+
+Internamente las piezas se guardan como arrays de NumPy indexados por posición: OF y pieza como
+enteros y las cargas en un único array (pieza, porcentaje, campo). El diccionario JSON de
+/api/procesar-excel solo se construye en el límite de la API (`a_dict`, `iterar`).
+"""
+import numpy as np
+
+PORCENTAJES = ('0', '100')
+CAMPOS = ('izquierda', 'derecha', 'consumo_izquierda', 'consumo_derecha', 'valor_columna_l')
+# Los dos primeros campos son pares: una celda vacía se devuelve como 0.0 en lugar de 0
+NUM_CAMPOS_PAR = 2
+# Piezas que `iterar` pasa a listas de Python de cada vez (la tabla entera nunca se convierte)
+BLOQUE_ITERACION = 1024
+
+
+def clave_pieza(of, pieza):
+    """Clave de una pieza en el JSON de la API"""
+    return f'OF{of}_Pieza{pieza}'
+
+
+def _carga_vacia():
+    return {campo: 0 for campo in CAMPOS}
+
+
+class TablaPiezas:
+    """Piezas en columnas (struct-of-arrays).
+
+    - `of`, `pieza`: arrays int64 de longitud n
+    - `cargas`: array float64 (n, porcentajes, campos); NaN = celda vacía
+    - `presentes`: array bool (n, porcentajes); False si la pieza no tiene ese porcentaje
+    """
+
+    __slots__ = ('of', 'pieza', 'cargas', 'presentes')
+
+    def __init__(self, of, pieza, cargas, presentes):
+        self.of = np.asarray(of, dtype=np.int64)
+        self.pieza = np.asarray(pieza, dtype=np.int64)
+        self.cargas = np.asarray(cargas, dtype=np.float64)
+        self.presentes = np.asarray(presentes, dtype=bool)
+
+    @classmethod
+    def vacia(cls):
+        return cls(np.empty(0), np.empty(0), np.empty((0, len(PORCENTAJES), len(CAMPOS))),
+                   np.empty((0, len(PORCENTAJES))))
+
+    @classmethod
+    def desde_dict(cls, piezas):
+        """Tabla a partir del diccionario de piezas de la API (en el orden del diccionario)"""
+        n = len(piezas)
+        of = np.zeros(n, dtype=np.int64)
+        pieza = np.zeros(n, dtype=np.int64)
+        cargas = np.full((n, len(PORCENTAJES), len(CAMPOS)), np.nan)
+        presentes = np.zeros((n, len(PORCENTAJES)), dtype=bool)
+        for i, pieza_info in enumerate(piezas.values()):
+            of[i] = pieza_info.get('of', 0) or 0
+            pieza[i] = pieza_info.get('pieza', 0) or 0
+            cargas_pieza = pieza_info.get('cargas', {})
+            for j, percent in enumerate(PORCENTAJES):
+                carga = cargas_pieza.get(percent)
+                if carga is not None:
+                    presentes[i, j] = True
+                    cargas[i, j] = [carga.get(campo, 0) or 0 for campo in CAMPOS]
+        return cls(of, pieza, cargas, presentes)
+
+    def __len__(self):
+        return len(self.of)
+
+    @property
+    def nbytes(self):
+        return self.of.nbytes + self.pieza.nbytes + self.cargas.nbytes + self.presentes.nbytes
+
+    def claves(self):
+        return [clave_pieza(of, pieza) for of, pieza in zip(self.of.tolist(), self.pieza.tolist())]
+
+    def valores(self):
+        """Cargas tal como las ve la API: celdas vacías a 0 y NaN solo en los porcentajes que faltan"""
+        valores = np.where(np.isnan(self.cargas), 0.0, self.cargas)
+        valores[~self.presentes] = np.nan
+        return valores
+
+    def orden_claves(self):
+        """Posiciones de las piezas ordenadas por su clave de la API ('OF{of}_Pieza{pieza}' como texto)"""
+        claves = self.claves()
+        return sorted(range(len(claves)), key=claves.__getitem__)
+
+    def iterar(self, indices=None):
+        """Generar (clave, pieza) con el formato JSON de la API, en el orden de la tabla o de `indices`"""
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices, dtype=np.int64)
+        for inicio in range(0, len(indices), BLOQUE_ITERACION):
+            bloque = indices[inicio:inicio + BLOQUE_ITERACION]
+            cargas = self.cargas[bloque].tolist()
+            presentes = self.presentes[bloque].tolist()
+            for i, (of, pieza) in enumerate(zip(self.of[bloque].tolist(), self.pieza[bloque].tolist())):
+                cargas_pieza = {}
+                for j, percent in enumerate(PORCENTAJES):
+                    if not presentes[i][j]:
+                        cargas_pieza[percent] = _carga_vacia()
+                        continue
+                    # Celdas vacías: 0.0 en los pares y 0 en consumos y columna L, como el JSON original
+                    cargas_pieza[percent] = {
+                        campo: (valor if valor == valor else (0.0 if k < NUM_CAMPOS_PAR else 0))
+                        for k, (campo, valor) in enumerate(zip(CAMPOS, cargas[i][j]))
+                    }
+                yield clave_pieza(of, pieza), {
+                    'referencia': f'Pieza {pieza} - OF {of}',
+                    'of': of,
+                    'pieza': pieza,
+                    'cargas': cargas_pieza
+                }
+
+    def a_dict(self):
+        """Diccionario de piezas de la API, ordenado por clave 'OF{of}_Pieza{pieza}'"""
+        return dict(self.iterar(self.orden_claves()))
@@ -0,0 +1,88 @@
+"""Patrones de carga de referencia (patrones_carga.json)"""
+import hashlib
+import json
+import os
+import threading
+
+RUTA_PATRONES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'patrones_carga.json')
+
+
+def serializar_json(valor):
+    """JSON compacto con claves ordenadas, igual que jsonify"""
+    return (json.dumps(valor, sort_keys=True, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class CargaPatrones:
+    """Patrones de una lectura del archivo, su JSON y su ETag; no se modifica después de crearse"""
+
+    __slots__ = ('patrones', 'json_bytes', 'json_por_patron', 'etag')
+
+    def __init__(self, patrones, json_bytes, json_por_patron, etag):
+        self.patrones = patrones
+        self.json_bytes = json_bytes
+        self.json_por_patron = json_por_patron
+        self.etag = etag
+
+
+class RegistroPatrones:
+    """Patrones cargados en memoria una sola vez y recargados solo si cambia el archivo.
+
+    Además del diccionario guarda el JSON ya serializado (de todos y de cada patrón) y un ETag
+    derivado del contenido del archivo, para que los endpoints respondan sin volver a serializar.
+    Cada recarga publica una CargaPatrones nueva de una vez: una petición nunca mezcla el cuerpo de
+    una lectura con el ETag de otra.
+    """
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._firma = None
+        self._lock = threading.Lock()
+        self._carga = CargaPatrones({}, b'', {}, None)
+        self.recargas = 0
+
+    def _actualizar(self):
+        """Recargar el archivo si su mtime o su tamaño han cambiado; devuelve la carga vigente"""
+        estado = os.stat(self.ruta)
+        firma = (estado.st_mtime_ns, estado.st_size)
+        if firma == self._firma:
+            return self._carga
+        with self._lock:
+            if firma == self._firma:
+                return self._carga
+            with open(self.ruta, 'rb') as f:
+                contenido = f.read()
+            patrones = json.loads(contenido.decode('utf-8'))
+            self._carga = CargaPatrones(
+                patrones, serializar_json(patrones),
+                {patron_id: serializar_json(patron) for patron_id, patron in patrones.items()},
+                hashlib.sha1(contenido).hexdigest())
+            self._firma = firma
+            self.recargas += 1
+            return self._carga
+
+    def todos(self):
+        """Diccionario de todos los patrones"""
+        return self._actualizar().patrones
+
+    def instantanea(self):
+        """(diccionario de todos los patrones, etag) de la misma carga del archivo"""
+        carga = self._actualizar()
+        return carga.patrones, carga.etag
+
+    def todos_json(self):
+        """(bytes JSON de todos los patrones, etag)"""
+        carga = self._actualizar()
+        return carga.json_bytes, carga.etag
+
+    def patron_json(self, patron_id):
+        """(bytes JSON del patrón o None si no existe, etag)"""
+        carga = self._actualizar()
+        return carga.json_por_patron.get(patron_id), f'{carga.etag}-{patron_id}'
+
+
+registro_patrones = RegistroPatrones(RUTA_PATRONES)
+
+
+def cargar_patrones():
+    """Patrones de carga de patrones_carga.json (desde memoria; se recargan si cambia el archivo)"""
+    return registro_patrones.todos()
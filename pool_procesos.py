@@ -0,0 +1,65 @@
+"""Pools de procesos para los trabajos en paralelo (informes en lote e ingesta de varios Excel).
+
+Los procesos se crean con `forkserver` (o `spawn` donde no existe), nunca con `fork`: el servidor es
+multihilo y un fork copiaría en los hijos los locks que otro hilo tenga cogidos en ese momento
+(métricas, cola de trabajos) sin los hilos que los liberan.
+"""
+import multiprocessing
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+METODO_INICIO = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+# ProcessPoolExecutor no admite más de 61 procesos en Windows
+MAX_WORKERS = 61 if sys.platform == 'win32' else None
+
+_pools = {}
+_lock = threading.Lock()
+
+
+def limitar_workers(workers, workers_defecto):
+    """Procesos que se usan cuando la petición pide `workers`: nunca más que el valor por defecto del pool"""
+    workers = min(workers or workers_defecto, workers_defecto)
+    return min(workers, MAX_WORKERS) if MAX_WORKERS else workers
+
+
+def crear_pool(workers):
+    """Pool de procesos nuevo con el método de inicio seguro"""
+    return ProcessPoolExecutor(max_workers=min(workers, MAX_WORKERS) if MAX_WORKERS else workers,
+                               mp_context=multiprocessing.get_context(METODO_INICIO))
+
+
+def obtener_pool(nombre, workers):
+    """Pool de procesos compartido `nombre` (se crea en el primer uso)"""
+    with _lock:
+        pool = _pools.get(nombre)
+        if pool is None:
+            pool = _pools[nombre] = crear_pool(workers)
+        return pool
+
+
+def descartar_pool(nombre, pool):
+    """Olvidar un pool compartido roto (un proceso murió) para que el siguiente uso cree otro"""
+    with _lock:
+        if _pools.get(nombre) is pool:
+            del _pools[nombre]
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def elegir_pool(nombre, workers, workers_defecto):
+    """(pool, workers, propio): con `workers` un pool propio que hay que cerrar; si no, el compartido.
+
+    `workers` viene de la petición: se limita a `workers_defecto` (INFORMES_WORKERS, INGESTA_WORKERS o
+    el número de CPUs) para que una petición no pueda arrancar cientos de procesos.
+    """
+    if workers:
+        workers = limitar_workers(workers, workers_defecto)
+        return crear_pool(workers), workers, True
+    workers_defecto = limitar_workers(None, workers_defecto)
+    return obtener_pool(nombre, workers_defecto), workers_defecto, False
+
+
+def cerrar_pool(pool, propio):
+    """Cerrar un pool de elegir_pool si es propio, sin esperar ni ejecutar lo pendiente"""
+    if propio:
+        pool.shutdown(wait=False, cancel_futures=True)
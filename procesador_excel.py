@@ -0,0 +1,454 @@
+"""Procesamiento de la pestaña "Análisis de test" de los Excel del banco de pruebas"""
+import re
+
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from modelo_piezas import CAMPOS, NUM_CAMPOS_PAR, PORCENTAJES, TablaPiezas
+
+HOJA_ANALISIS = 'Análisis de test'
+
+# Versión del resultado generado; cambiarla invalida las entradas de la caché de resultados
+VERSION_PROCESADOR = '2'
+
+# Los encabezados están en la fila 2 (índice 2) y los datos empiezan en la fila 3 (índice 3)
+FILA_INICIO_DATOS = 3
+
+# Índices de columna: B (Pieza), D (OF), E (NumPaso), H-I (Par Nm), J-K (Consumo A) y L
+COL_PIEZA = 1
+COL_OF = 3
+COL_NUM_PASO = 4
+COL_PAR_IZDA = 7
+COL_PAR_DRCH = 8
+COL_CONSUMO_IZDA = 9
+COL_CONSUMO_DRCH = 10
+COL_VALOR_L = 11
+
+# Si todas estas columnas están vacías la fila marca el final de los datos
+COLUMNAS_FIN_DATOS = [COL_PIEZA, COL_OF, COL_NUM_PASO, COL_PAR_IZDA, COL_PAR_DRCH,
+                      COL_CONSUMO_IZDA, COL_CONSUMO_DRCH]
+
+# Columnas que se extraen de la hoja, por nombre
+COLUMNAS_HOJA = {
+    'pieza': COL_PIEZA,
+    'of': COL_OF,
+    'num_paso': COL_NUM_PASO,
+    'par_izquierda': COL_PAR_IZDA,
+    'par_derecha': COL_PAR_DRCH,
+    'consumo_izquierda': COL_CONSUMO_IZDA,
+    'consumo_derecha': COL_CONSUMO_DRCH,
+    'valor_columna_l': COL_VALOR_L,
+}
+
+# Textos que pd.read_excel interpreta como celda vacía (valores NA por defecto de pandas)
+TEXTOS_VACIOS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+# Modos de lectura del libro: openpyxl en solo lectura o pd.read_excel de la hoja completa
+MODOS_LECTURA = ('streaming', 'completa')
+
+# Mapeo de NumPaso a porcentaje: solo pasos 0 y 4 (0% y 100%)
+PASO_A_PORCENTAJE = {0: '0', 4: '100'}
+# El paso 5 aporta los consumos y la columna L del 100%
+PASO_CONSUMO = 5
+
+
+class FormatoExcelError(ValueError):
+    """El libro no tiene la pestaña "Análisis de test" o no tiene el formato esperado"""
+
+
+def extraer_referencia(titulo):
+    """Buscar la referencia en el título de la hoja ("... Referencia X ...")"""
+    if titulo is None or pd.isna(titulo):
+        return None
+    match = re.search(r'Referencia\s+([a-zA-Z0-9]+)', str(titulo))
+    return match.group(1) if match else None
+
+
+def carga_vacia():
+    """Valores por defecto de un porcentaje sin datos"""
+    return {'izquierda': 0, 'derecha': 0, 'consumo_izquierda': 0, 'consumo_derecha': 0, 'valor_columna_l': 0}
+
+
+def nueva_pieza(of, pieza):
+    """Estructura JSON de una pieza sin cargas"""
+    return {
+        'referencia': f'Pieza {pieza} - OF {of}',
+        'of': of,
+        'pieza': pieza,
+        'cargas': {
+            '0': carga_vacia(),
+            '100': carga_vacia()
+        }
+    }
+
+
+def columnas_desde_dataframe(df):
+    """Extraer las columnas usadas de la hoja leída con header=None, hasta la primera fila en blanco"""
+    # Sin las columnas J y K no hay datos que procesar
+    if df.shape[1] <= COL_CONSUMO_DRCH:
+        return None
+
+    bloque = df.iloc[FILA_INICIO_DATOS:]
+    vacias = bloque.iloc[:, COLUMNAS_FIN_DATOS].isna().all(axis=1).to_numpy()
+    if vacias.any():
+        bloque = bloque.iloc[:int(vacias.argmax())]
+
+    columnas = {}
+    for nombre, indice in COLUMNAS_HOJA.items():
+        if indice < df.shape[1]:
+            columnas[nombre] = bloque.iloc[:, indice].to_numpy()
+        else:
+            columnas[nombre] = None
+    return columnas
+
+
+def normalizar_fila(fila):
+    """Fila leída con openpyxl hasta la columna L, con los textos vacíos como None; None si está en blanco"""
+    fila = [None if isinstance(v, str) and v in TEXTOS_VACIOS else v for v in fila]
+    fila += [None] * (COL_VALOR_L + 1 - len(fila))
+    if all(fila[indice] is None for indice in COLUMNAS_FIN_DATOS):
+        return None
+    return fila
+
+
+def leer_hoja_streaming(fichero):
+    """Leer la hoja "Análisis de test" con openpyxl en modo solo lectura, fila a fila.
+
+    Solo se extraen las columnas usadas y la lectura se detiene en la primera fila en blanco,
+    así que la memoria no depende de las filas sobrantes ni del resto de pestañas.
+    Devuelve (referencia_excel, columnas, filas_leidas); lanza KeyError si no existe la pestaña.
+    """
+    wb = openpyxl.load_workbook(fichero, read_only=True, data_only=True)
+    try:
+        ws = wb[HOJA_ANALISIS]
+        num_columnas = ws.max_column or (COL_VALOR_L + 1)
+        valores = {nombre: [] for nombre in COLUMNAS_HOJA}
+        referencia_excel = None
+        filas_leidas = 0
+
+        for num_fila, fila in enumerate(ws.iter_rows(max_col=COL_VALOR_L + 1, values_only=True)):
+            filas_leidas = num_fila + 1
+            if num_fila == 0:
+                referencia_excel = extraer_referencia(fila[0] if fila else None)
+            if num_fila < FILA_INICIO_DATOS:
+                continue
+            # Sin las columnas J y K no hay datos que procesar
+            if num_columnas <= COL_CONSUMO_DRCH:
+                break
+
+            fila = normalizar_fila(fila)
+            if fila is None:
+                break
+            for nombre, indice in COLUMNAS_HOJA.items():
+                valores[nombre].append(fila[indice])
+    finally:
+        wb.close()
+
+    if num_columnas <= COL_CONSUMO_DRCH or filas_leidas <= FILA_INICIO_DATOS:
+        return referencia_excel, None, filas_leidas
+
+    columnas = {nombre: np.array(lista, dtype=object) for nombre, lista in valores.items()}
+    if num_columnas <= COL_VALOR_L:
+        columnas['valor_columna_l'] = None
+    return referencia_excel, columnas, filas_leidas
+
+
+def _convertir(valores, conversor):
+    """Convertir una columna a float64 (NaN = vacío) y marcar los valores no convertibles.
+
+    En columnas de tipo objeto el conversor (int o float) se aplica una sola vez por valor único.
+    """
+    valores = np.asarray(valores)
+    n = len(valores)
+    if valores.dtype.kind in 'biuf':
+        numeros = valores.astype(np.float64)
+        if conversor is int:
+            numeros = np.trunc(numeros)
+        return numeros, np.zeros(n, dtype=bool)
+
+    numeros = np.full(n, np.nan)
+    invalidos = np.zeros(n, dtype=bool)
+    llenos = ~pd.isna(valores)
+    codigos, unicos = pd.factorize(valores[llenos])
+    convertidos = np.full(len(unicos), np.nan)
+    malos = np.zeros(len(unicos), dtype=bool)
+    for i, valor in enumerate(unicos):
+        try:
+            convertidos[i] = conversor(valor)
+        except (TypeError, ValueError, OverflowError):
+            malos[i] = True
+    numeros[llenos] = convertidos[codigos]
+    invalidos[llenos] = malos[codigos]
+    # factorize trata 0, 0.0 y -0.0 como el mismo valor: los ceros se convierten uno a uno para
+    # conservar el signo de cada celda
+    ceros = np.flatnonzero(numeros == 0)
+    if len(ceros):
+        numeros[ceros] = [conversor(valor) for valor in valores[ceros]]
+    return numeros, invalidos
+
+
+def _redondear_array(valores, decimales):
+    """Redondear como el Excel, valor a valor con round(); las celdas vacías siguen siendo NaN"""
+    return np.array([valor if valor != valor else round(valor, decimales) for valor in valores.tolist()],
+                    dtype=float)
+
+
+def _filas_utiles(columnas):
+    """Convertir las columnas y marcar las filas que aportan cargas (pasos 0 y 4) y las del paso 5.
+
+    Devuelve (valores convertidos por nombre, máscara de cargas, máscara del paso 5 o None sin columna L).
+    """
+    pieza, _ = _convertir(columnas['pieza'], int)
+    of, _ = _convertir(columnas['of'], int)
+    num_paso, _ = _convertir(columnas['num_paso'], int)
+    consumo_izda, consumo_izda_inv = _convertir(columnas['consumo_izquierda'], float)
+    consumo_drch, consumo_drch_inv = _convertir(columnas['consumo_derecha'], float)
+    par_izda, par_izda_inv = _convertir(columnas['par_izquierda'], float)
+    par_drch, par_drch_inv = _convertir(columnas['par_derecha'], float)
+
+    # Filas con Pieza, OF y NumPaso válidos y consumos convertibles
+    validas = (~np.isnan(pieza) & ~np.isnan(of) & ~np.isnan(num_paso)
+               & ~consumo_izda_inv & ~consumo_drch_inv)
+
+    # Pasos 0 y 4: par y consumo de cada porcentaje
+    mascara_cargas = (validas & np.isin(num_paso, list(PASO_A_PORCENTAJE))
+                      & ~par_izda_inv & ~par_drch_inv)
+    valores = {'of': of, 'pieza': pieza, 'num_paso': num_paso, 'par_izquierda': par_izda, 'par_derecha': par_drch,
+               'consumo_izquierda': consumo_izda, 'consumo_derecha': consumo_drch}
+
+    # Paso 5: consumos y columna L para el 100% (requiere que exista la columna L)
+    mascara_paso5 = None
+    if columnas['valor_columna_l'] is not None:
+        valores['valor_columna_l'], valor_l_inv = _convertir(columnas['valor_columna_l'], float)
+        mascara_paso5 = validas & (num_paso == PASO_CONSUMO) & ~valor_l_inv
+    return valores, mascara_cargas, mascara_paso5
+
+
+def compactar_columnas(columnas):
+    """Quedarse solo con las filas que pueden aparecer en el resultado (la última de cada OF, Pieza y NumPaso).
+
+    tabla_piezas(compactadas + filas nuevas) da lo mismo que tabla_piezas(todas las filas + filas nuevas).
+    """
+    if columnas is None or len(columnas['pieza']) == 0:
+        return columnas
+    valores, mascara_cargas, mascara_paso5 = _filas_utiles(columnas)
+    claves = pd.DataFrame({'of': valores['of'], 'pieza': valores['pieza'], 'num_paso': valores['num_paso']})
+    conservar = claves[mascara_cargas].drop_duplicates(keep='last').index.to_numpy()
+    if mascara_paso5 is not None:
+        # union1d devuelve los índices ordenados: las filas conservan su orden original
+        ultimas_paso5 = claves[mascara_paso5].drop_duplicates(['of', 'pieza'], keep='last').index.to_numpy()
+        conservar = np.union1d(conservar, ultimas_paso5)
+    return {nombre: (valores_columna[conservar] if valores_columna is not None else None)
+            for nombre, valores_columna in columnas.items()}
+
+
+def tabla_piezas(columnas):
+    """Agrupar por OF, Pieza y NumPaso (la última fila gana) y combinar el paso 5 en el 100%.
+
+    Devuelve una TablaPiezas en orden numérico de OF y pieza, sin crear un diccionario por pieza.
+    """
+    if columnas is None or len(columnas['pieza']) == 0:
+        return TablaPiezas.vacia()
+
+    valores, mascara_cargas, mascara_paso5 = _filas_utiles(columnas)
+    of, pieza, num_paso = valores['of'], valores['pieza'], valores['num_paso']
+    consumo_izda, consumo_drch = valores['consumo_izquierda'], valores['consumo_derecha']
+    par_izda, par_drch = valores['par_izquierda'], valores['par_derecha']
+    cargas = pd.DataFrame({
+        'of': of[mascara_cargas],
+        'pieza': pieza[mascara_cargas],
+        'num_paso': num_paso[mascara_cargas],
+        'par_izquierda': par_izda[mascara_cargas],
+        'par_derecha': par_drch[mascara_cargas],
+        'consumo_izquierda': consumo_izda[mascara_cargas],
+        'consumo_derecha': consumo_drch[mascara_cargas],
+    })
+    # Si hay múltiples filas con el mismo OF, Pieza y NumPaso se toma la última (no se promedia)
+    ultimas = cargas.drop_duplicates(['of', 'pieza', 'num_paso'], keep='last')
+    if ultimas.empty:
+        return TablaPiezas.vacia()
+
+    # Paso 5: consumos y columna L para el 100% (requiere que exista la columna L)
+    if mascara_paso5 is not None:
+        valor_l = valores['valor_columna_l']
+        paso5 = pd.DataFrame({
+            'of': of[mascara_paso5],
+            'pieza': pieza[mascara_paso5],
+            'consumo_izquierda_p5': consumo_izda[mascara_paso5],
+            'consumo_derecha_p5': consumo_drch[mascara_paso5],
+            'valor_columna_l': valor_l[mascara_paso5],
+        }).drop_duplicates(['of', 'pieza'], keep='last')
+        ultimas = ultimas.merge(paso5, on=['of', 'pieza'], how='left', sort=False, indicator=True)
+
+    if 'valor_columna_l' in ultimas:
+        # Para el 100% se usan los consumos del paso 5 si existen; si no, los del paso 4
+        usar_paso5 = (ultimas['num_paso'].to_numpy() == 4) & (ultimas['_merge'].to_numpy() == 'both')
+        consumo_izda_final = np.where(usar_paso5, ultimas['consumo_izquierda_p5'], ultimas['consumo_izquierda'])
+        consumo_drch_final = np.where(usar_paso5, ultimas['consumo_derecha_p5'], ultimas['consumo_derecha'])
+        valor_l_final = np.where(usar_paso5, ultimas['valor_columna_l'], np.nan)
+    else:
+        consumo_izda_final = ultimas['consumo_izquierda'].to_numpy()
+        consumo_drch_final = ultimas['consumo_derecha'].to_numpy()
+        valor_l_final = np.full(len(ultimas), np.nan)
+
+    # Ordenar por OF y pieza; cada grupo de filas con el mismo OF y pieza es una pieza de la tabla
+    of_final = ultimas['of'].to_numpy()
+    pieza_final = ultimas['pieza'].to_numpy()
+    orden = np.lexsort((pieza_final, of_final))
+    of_final, pieza_final = of_final[orden], pieza_final[orden]
+    nueva = np.ones(len(orden), dtype=bool)
+    nueva[1:] = (of_final[1:] != of_final[:-1]) | (pieza_final[1:] != pieza_final[:-1])
+    fila_tabla = np.cumsum(nueva) - 1
+    # Paso 0 -> porcentaje '0' (índice 0); paso 4 -> '100' (índice 1)
+    indice_porcentaje = (ultimas['num_paso'].to_numpy()[orden] == 4).astype(np.intp)
+
+    num_piezas = int(nueva.sum())
+    cargas_tabla = np.full((num_piezas, len(PORCENTAJES), len(CAMPOS)), np.nan)
+    presentes = np.zeros((num_piezas, len(PORCENTAJES)), dtype=bool)
+    presentes[fila_tabla, indice_porcentaje] = True
+    # Par redondeado a 1 decimal (sin -0.0); consumos y columna L a 2 decimales
+    valores_campos = (
+        (ultimas['par_izquierda'].to_numpy(), 1), (ultimas['par_derecha'].to_numpy(), 1),
+        (consumo_izda_final, 2), (consumo_drch_final, 2), (valor_l_final, 2),
+    )
+    for k, (valores, decimales) in enumerate(valores_campos):
+        redondeados = _redondear_array(np.asarray(valores, dtype=float)[orden], decimales)
+        cargas_tabla[fila_tabla, indice_porcentaje, k] = redondeados + 0.0 if k < NUM_CAMPOS_PAR else redondeados
+
+    return TablaPiezas(of_final[nueva], pieza_final[nueva], cargas_tabla, presentes)
+
+
+def iterar_piezas(columnas):
+    """Generar (clave 'OF{of}_Pieza{pieza}', pieza) de una en una, en orden numérico de OF y pieza"""
+    return tabla_piezas(columnas).iterar()
+
+
+def agregar_columnas(columnas):
+    """Diccionario de todas las piezas (ver tabla_piezas) ordenado por clave 'OF{of}_Pieza{pieza}'"""
+    return tabla_piezas(columnas).a_dict()
+
+
+def procesar_hoja(df):
+    """Procesar la hoja "Análisis de test" (leída con header=None) de forma vectorizada"""
+    return agregar_columnas(columnas_desde_dataframe(df))
+
+
+def procesar_hoja_iterativo(df):
+    """Implementación original fila a fila; se conserva como referencia para los benchmarks"""
+    datos_acumulados = {}
+    consumos_paso5 = {}
+
+    for idx in range(FILA_INICIO_DATOS, len(df)):
+        row = df.iloc[idx]
+
+        try:
+            if (pd.isna(row.iloc[1]) and pd.isna(row.iloc[3]) and pd.isna(row.iloc[4]) and
+                    pd.isna(row.iloc[7]) and pd.isna(row.iloc[8]) and
+                    pd.isna(row.iloc[9]) and pd.isna(row.iloc[10])):
+                break
+        except IndexError:
+            break
+
+        try:
+            if pd.isna(row.iloc[1]):
+                continue
+        except IndexError:
+            continue
+
+        try:
+            pieza = int(row.iloc[1])
+            of = int(row.iloc[3]) if pd.notna(row.iloc[3]) else None
+            num_paso = int(row.iloc[4]) if pd.notna(row.iloc[4]) else None
+
+            if of is None or num_paso is None:
+                continue
+
+            consumo_izda = round(float(row.iloc[9]), 2) if pd.notna(row.iloc[9]) else 0
+            consumo_drch = round(float(row.iloc[10]), 2) if pd.notna(row.iloc[10]) else 0
+
+            if num_paso == PASO_CONSUMO:
+                valor_columna_l = round(float(row.iloc[11]), 2) if pd.notna(row.iloc[11]) and len(row) > 11 else 0
+                consumos_paso5[(of, pieza)] = {
+                    'consumo_izquierda': consumo_izda,
+                    'consumo_derecha': consumo_drch,
+                    'valor_columna_l': valor_columna_l
+                }
+                continue
+
+            if num_paso not in PASO_A_PORCENTAJE:
+                continue
+
+            par_izda = round(float(row.iloc[7]), 1) if pd.notna(row.iloc[7]) else 0
+            par_drch = round(float(row.iloc[8]), 1) if pd.notna(row.iloc[8]) else 0
+
+            datos_acumulados[(of, pieza, PASO_A_PORCENTAJE[num_paso])] = {
+                'izquierda': [par_izda],
+                'derecha': [par_drch],
+                'consumo_izquierda': consumo_izda,
+                'consumo_derecha': consumo_drch
+            }
+        except (ValueError, IndexError):
+            continue
+
+    datos_por_pieza = {}
+    for (of, pieza, percent), valores in datos_acumulados.items():
+        clave_pieza = f'OF{of}_Pieza{pieza}'
+        if clave_pieza not in datos_por_pieza:
+            datos_por_pieza[clave_pieza] = nueva_pieza(of, pieza)
+
+        carga = datos_por_pieza[clave_pieza]['cargas'][percent]
+        carga['izquierda'] = round(sum(valores['izquierda']) / len(valores['izquierda']), 1)
+        carga['derecha'] = round(sum(valores['derecha']) / len(valores['derecha']), 1)
+
+        if percent == '100' and (of, pieza) in consumos_paso5:
+            carga.update(consumos_paso5[(of, pieza)])
+        else:
+            carga['consumo_izquierda'] = valores['consumo_izquierda']
+            carga['consumo_derecha'] = valores['consumo_derecha']
+            carga['valor_columna_l'] = 0
+
+    return {clave: datos_por_pieza[clave] for clave in sorted(datos_por_pieza)}
+
+
+def leer_libro(fichero, modo_lectura='completa'):
+    """Leer la pestaña "Análisis de test" de un libro sin agrupar sus filas.
+
+    Devuelve (referencia_excel, columnas); lanza FormatoExcelError si falta la pestaña o el formato no es el esperado.
+    """
+    if modo_lectura == 'streaming':
+        # Leer solo las columnas usadas hasta la primera fila en blanco
+        try:
+            referencia_excel, columnas, filas_leidas = leer_hoja_streaming(fichero)
+        except KeyError:
+            raise FormatoExcelError('No se encontró la pestaña "Análisis de test"')
+
+        if filas_leidas < 3:
+            raise FormatoExcelError('El archivo Excel no tiene el formato esperado')
+
+        return referencia_excel, columnas
+
+    # Leer solo la pestaña "Análisis de test"
+    try:
+        df = pd.read_excel(fichero, sheet_name=HOJA_ANALISIS, header=None)
+    except ValueError:
+        raise FormatoExcelError('No se encontró la pestaña "Análisis de test"')
+
+    # Extraer referencia del título (fila 0, columna 0)
+    referencia_excel = extraer_referencia(df.iloc[0, 0]) if len(df) > 0 else None
+
+    # Los encabezados están en la fila 2 (índice 2)
+    # Datos empiezan en la fila 3 (índice 3)
+    if len(df) < 3:
+        raise FormatoExcelError('El archivo Excel no tiene el formato esperado')
+
+    return referencia_excel, columnas_desde_dataframe(df)
+
+
+def procesar_libro(fichero, modo_lectura='completa'):
+    """Leer la pestaña "Análisis de test" de un libro y agrupar sus piezas. Devuelve (referencia_excel, TablaPiezas)"""
+    referencia_excel, columnas = leer_libro(fichero, modo_lectura)
+    return referencia_excel, tabla_piezas(columnas)
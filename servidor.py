@@ -0,0 +1,163 @@
+"""Servir la aplicación en producción con varios workers WSGI de varios hilos (gthread).
+
+Uso:
+    python servidor.py
+    gunicorn --preload -c servidor.py 'servidor:crear_app()'
+
+Configuración por variables de entorno: SERVIDOR_BIND (dirección:puerto), SERVIDOR_WORKERS,
+SERVIDOR_THREADS, SERVIDOR_TIMEOUT y SERVIDOR_CALENTAR=0 para no precalentar.
+
+Con más de un worker, los datos de /api/data (y sus esperas de cambios) y la cola de trabajos en segundo
+plano se guardan en la base de datos de estado (ESTADO_DB); si no se indica, se crea en un directorio
+temporal que se borra al parar el servidor.
+
+Antes de crear los workers, el proceso principal importa pandas, openpyxl y ReportLab, carga los
+patrones y las plantillas, y procesa un libro y genera los dos informes con datos mínimos. Los workers
+heredan todo ello al hacer fork y atienden su primera petición con la latencia habitual.
+"""
+import atexit
+import logging
+import os
+import shutil
+import tempfile
+import time
+from io import BytesIO
+
+BIND = os.environ.get('SERVIDOR_BIND', '127.0.0.1:8000')
+WORKERS = int(os.environ.get('SERVIDOR_WORKERS', os.cpu_count() or 1))
+# Cada pestaña abierta de la página principal ocupa un hilo de un worker mientras espera cambios
+# (MAX_ESPERAS_CAMBIOS por worker)
+THREADS = int(os.environ.get('SERVIDOR_THREADS', 32))
+# Los informes masivos grandes tardan: el timeout por defecto de gunicorn (30 s) se queda corto
+TIMEOUT = int(os.environ.get('SERVIDOR_TIMEOUT', 120))
+CALENTAR = os.environ.get('SERVIDOR_CALENTAR', '1') != '0'
+
+registro = logging.getLogger('cargas.servidor')
+
+# Configuración de gunicorn cuando se usa este archivo con -c
+bind = BIND
+workers = WORKERS
+worker_class = 'gthread'
+threads = THREADS
+timeout = TIMEOUT
+preload_app = True
+
+
+def libro_minimo():
+    """Bytes de un .xlsx con la pestaña "Análisis de test" y una pieza con los pasos 0-5"""
+    import openpyxl
+
+    from procesador_excel import HOJA_ANALISIS
+
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet(HOJA_ANALISIS)
+    hoja.append(['Evolución por NumPaso (Referencia calentamiento)'])
+    hoja.append([])
+    hoja.append(['Fecha', 'Pieza', 'Test', 'OF', 'NumPaso', 'CargaIZDA', 'CargaDRCH',
+                 'ParIZDA', 'ParDRCH', 'AmpIZDA', 'AmpDRCH', 'Vibr'])
+    for paso in range(6):
+        hoja.append([None, 1, 0, '1', paso, 18 + paso * 90, 18 + paso * 90,
+                     2.5 + paso, 2.6 + paso, 3.5 + paso, 3.6 + paso, 0.8 if paso == 5 else 0])
+    salida = BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+def calentar(app):
+    """Recorrer una vez los caminos de código costosos para que queden cargados antes del fork"""
+    from evaluacion_tolerancias import evaluar_piezas
+    from informes_pdf import construir_informe, construir_informe_masivo
+    from metricas import metricas
+    from patrones import registro_patrones
+    from procesador_excel import leer_libro, tabla_piezas
+
+    inicio = time.perf_counter()
+    patrones = registro_patrones.todos()
+    referencia_bmw = next(iter(patrones), None)
+
+    datos = libro_minimo()
+    for modo in ('completa', 'streaming'):
+        referencia_excel, columnas = leer_libro(BytesIO(datos), modo)
+    piezas = tabla_piezas(columnas).a_dict()
+    if referencia_bmw:
+        evaluar_piezas(piezas, patrones[referencia_bmw], 5, 5)
+
+    comunes = {'referencia_excel': referencia_excel, 'referencia_bmw': referencia_bmw,
+               'dispersion_par': 5, 'dispersion_consumo': 5}
+    construir_informe_masivo(dict(comunes, piezas=piezas))
+    pieza = next(iter(piezas.values()))
+    construir_informe(dict(comunes, referencia=pieza['referencia'], cargas=pieza['cargas']))
+
+    # Plantillas Jinja compiladas y serializador JSON
+    for plantilla in ('index.html', 'carga_masiva.html'):
+        app.jinja_env.get_template(plantilla)
+    with app.app_context():
+        app.json.dumps(piezas)
+
+    # Las métricas del calentamiento no deben aparecer en /metrics de cada worker
+    metricas.reiniciar()
+    registro.info('Calentamiento completado en %.2f s', time.perf_counter() - inicio)
+
+
+def preparar_estado_compartido(workers):
+    """Con varios workers y sin ESTADO_DB, crear la base de datos de estado en un directorio temporal.
+
+    Debe llamarse antes de importar app; el directorio lo borra el proceso principal al terminar.
+    """
+    if workers <= 1 or os.environ.get('ESTADO_DB'):
+        return
+    directorio = tempfile.mkdtemp(prefix='cargas_estado_')
+    os.environ['ESTADO_DB'] = os.path.join(directorio, 'estado.db')
+    principal = os.getpid()
+
+    def borrar():
+        # Los workers heredan el atexit al hacer fork: solo borra el proceso principal
+        if os.getpid() == principal:
+            shutil.rmtree(directorio, ignore_errors=True)
+
+    atexit.register(borrar)
+    registro.info('Estado compartido de %d workers en %s', workers, os.environ['ESTADO_DB'])
+
+
+def crear_app(workers=None):
+    """Aplicación Flask precalentada (con --preload se ejecuta una sola vez, en el proceso principal)"""
+    preparar_estado_compartido(WORKERS if workers is None else workers)
+    from app import app
+    if CALENTAR:
+        calentar(app)
+    return app
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        BaseApplication = None
+
+    if BaseApplication is None:
+        # Windows (sin fork): waitress con un solo proceso y varios hilos
+        try:
+            from waitress import serve
+        except ImportError:
+            raise SystemExit('Instala gunicorn (Linux) o waitress (Windows) para el modo producción')
+        serve(crear_app(workers=1), listen=BIND, threads=max(THREADS, 4), channel_timeout=TIMEOUT)
+        return
+
+    class Servidor(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', BIND)
+            self.cfg.set('workers', WORKERS)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', THREADS)
+            self.cfg.set('timeout', TIMEOUT)
+            self.cfg.set('preload_app', True)
+
+        def load(self):
+            return crear_app()
+
+    Servidor().run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.fixture
+def cliente():
+    """Cliente de prueba de Flask"""
+    from app import app
+    app.config['TESTING'] = True
+    return app.test_client()
+
+
+@pytest.fixture
+def patron_la():
+    from patrones import registro_patrones
+    return registro_patrones.todos()['LA']
@@ -0,0 +1,64 @@
+"""Libros Excel de prueba con el formato de la pestaña "Análisis de test" del banco"""
+from io import BytesIO
+
+import openpyxl
+import pandas as pd
+
+ENCABEZADOS = ['Fecha', 'Pieza', 'Test', 'OF', 'NumPaso', 'CargaIZDA', 'CargaDRCH',
+               'ParIZDA', 'ParDRCH', 'AmpIZDA', 'AmpDRCH', 'Vibr']
+
+
+def fila(pieza, of, paso, par_izquierda, par_derecha, consumo_izquierda, consumo_derecha, valor_l=0, test=0):
+    """Una fila de datos (OF como texto, igual que en los Excel del banco)"""
+    return [None, pieza, test, str(of), paso, 18 + paso * 90, 18 + paso * 90,
+            par_izquierda, par_derecha, consumo_izquierda, consumo_derecha, valor_l]
+
+
+def filas_pieza(pieza, of, par_0=(2.5, 2.6), consumo_0=(3.5, 3.6), par_100=(6.5, 6.6), consumo_100=(26, 25),
+                valor_l=0.8, pasos=range(6)):
+    """Filas de los pasos de una pieza: 0 (0%), 4 (par al 100%) y 5 (consumo y columna L al 100%)"""
+    filas = []
+    for paso in pasos:
+        par = par_0 if paso == 0 else par_100 if paso == 4 else (1.0, 1.0)
+        consumo = consumo_0 if paso == 0 else consumo_100 if paso == 5 else (9.0, 9.0)
+        filas.append(fila(pieza, of, paso, *par, *consumo, valor_l if paso == 5 else 0))
+    return filas
+
+
+def libro_excel(filas, referencia='e06091800', final=()):
+    """Bytes de un .xlsx con el título, los encabezados y las filas de datos.
+
+    `final` son filas que se añaden después de una fila vacía (el procesado se detiene en ella).
+    """
+    libro = openpyxl.Workbook(write_only=True)
+    hoja = libro.create_sheet('Análisis de test')
+    hoja.append([f'Evolución por NumPaso (Referencia {referencia})'])
+    hoja.append([])
+    hoja.append(ENCABEZADOS)
+    for datos in filas:
+        hoja.append(datos)
+    if final:
+        hoja.append([])
+        for datos in final:
+            hoja.append(datos)
+    salida = BytesIO()
+    libro.save(salida)
+    return salida.getvalue()
+
+
+def filas_variadas(of=347935):
+    """Filas con los casos de los Excel reales: OF y piezas desordenadas, pasos repetidos (vale el último),
+    porcentajes ausentes, celdas vacías, pasos intermedios y filas sin OF"""
+    filas = filas_pieza(2, of + 1) + filas_pieza(10, of, par_100=(7.1, 6.9))
+    filas += filas_pieza(1, of, pasos=[0]) + filas_pieza(3, of, pasos=[0, 4])
+    filas.append(fila(10, of, 0, 2.7, 2.8, 3.7, 3.8))
+    filas.append(fila(4, of, 0, None, 2.6, 3.5, None))
+    filas.append(fila(4, None, 4, 6.5, 6.6, 9.0, 9.0))
+    filas += filas_pieza(5, of, consumo_100=(27.25, 24.75), pasos=[5, 4, 3, 0])
+    return filas
+
+
+def piezas_iterativo(datos):
+    """Piezas de un libro con la implementación original fila a fila (referencia de los tests)"""
+    from procesador_excel import HOJA_ANALISIS, procesar_hoja_iterativo
+    return procesar_hoja_iterativo(pd.read_excel(BytesIO(datos), sheet_name=HOJA_ANALISIS, header=None))
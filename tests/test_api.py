@@ -0,0 +1,121 @@
+import threading
+import time
+from io import BytesIO
+
+import pytest
+
+import app as aplicacion
+from datos_estaciones import AlmacenEstaciones, AlmacenEstacionesCompartido
+from estado_compartido import BaseDatosEstado
+from libros import filas_pieza, libro_excel
+
+
+@pytest.fixture(params=['memoria', 'compartido'])
+def nuevo_almacen(request, tmp_path):
+    """Crea almacenes de estaciones en memoria o en una base de datos de estado nueva (como con varios workers)"""
+    rutas = iter(str(tmp_path / f'estado{i}.db') for i in range(100))
+    if request.param == 'memoria':
+        return AlmacenEstaciones
+    return lambda **parametros: AlmacenEstacionesCompartido(BaseDatosEstado(next(rutas)), **parametros)
+
+
+def test_paginas(cliente):
+    assert cliente.get('/').status_code == 200
+    assert cliente.get('/carga-masiva').status_code == 200
+
+
+def test_metricas(cliente):
+    respuesta = cliente.get('/metrics')
+    assert respuesta.status_code == 200
+    assert 'cargas_esperas_cambios' in respuesta.get_data(as_text=True)
+
+
+def test_datos_por_estacion(cliente, monkeypatch, nuevo_almacen):
+    monkeypatch.setattr(aplicacion, 'datos_estaciones', nuevo_almacen())
+    inicial = cliente.get('/api/data?estacion=banco1')
+    assert inicial.headers['X-Version'] == '0'
+    assert inicial.get_json()['100']['izquierda'] == 0
+    assert cliente.get('/api/data?estacion=banco1', headers={'If-None-Match': inicial.headers['ETag']}).status_code == 304
+
+    actualizada = cliente.post('/api/data?estacion=banco1&cliente=c1', json={'100': {'izquierda': 6.5}}).get_json()
+    assert actualizada['version'] == 1
+    assert actualizada['data']['100']['izquierda'] == 6.5
+    assert cliente.get('/api/data', headers={'X-Estacion': 'banco1'}).get_json()['100']['izquierda'] == 6.5
+    assert cliente.get('/api/data?estacion=banco2').get_json()['100']['izquierda'] == 0
+    assert cliente.get('/api/data?estacion=banco 1').status_code == 400
+
+
+def test_espera_de_cambios(cliente, monkeypatch, nuevo_almacen):
+    monkeypatch.setattr(aplicacion, 'datos_estaciones', nuevo_almacen(max_esperas=1))
+    assert cliente.get('/api/data/cambios?estacion=banco1&version=0&timeout=0').status_code == 204
+    cliente.post('/api/data?estacion=banco1&cliente=c1', json={'0': {'derecha': 2.6}})
+    cambio = cliente.get('/api/data/cambios?estacion=banco1&version=0&timeout=0').get_json()
+    assert (cambio['version'], cambio['origen'], cambio['data']['0']['derecha']) == (1, 'c1', 2.6)
+    assert cliente.get('/api/data/cambios?version=x').status_code == 400
+
+    # Sin hueco para más esperas: 503 y el cliente pasa a consultar /api/data
+    monkeypatch.setattr(aplicacion, 'datos_estaciones', nuevo_almacen(max_esperas=0))
+    agotadas = cliente.get('/api/data/cambios?estacion=banco1&version=0&timeout=1')
+    assert agotadas.status_code == 503
+    assert agotadas.headers['Retry-After'] == str(aplicacion.REINTENTO_CAMBIOS_S)
+
+
+def test_cache_excel(cliente):
+    datos = libro_excel(filas_pieza(1, 913701))
+    clave = cliente.post('/api/procesar-excel', data={'file': (BytesIO(datos), 'prueba.xlsx')},
+                         content_type='multipart/form-data').headers['X-Cache-Clave']
+    assert cliente.get('/api/cache-excel').get_json()['entradas'] >= 1
+    assert cliente.delete(f'/api/cache-excel/{clave}').get_json() == {'success': True, 'eliminadas': 1}
+    assert cliente.delete('/api/cache-excel/no-es-una-clave').status_code == 400
+    repetida = cliente.post('/api/procesar-excel', data={'file': (BytesIO(datos), 'prueba.xlsx')},
+                            content_type='multipart/form-data')
+    assert repetida.headers['X-Cache'] == 'MISS'
+
+
+def test_historico_desactivado(cliente, monkeypatch):
+    monkeypatch.setattr(aplicacion, 'almacen_resultados', None)
+    assert cliente.get('/api/resultados').status_code == 404
+    assert cliente.get('/api/resultados/cargas').status_code == 404
+
+
+def test_estacion_nueva_sustituye_a_la_mas_antigua(cliente, monkeypatch, nuevo_almacen):
+    monkeypatch.setattr(aplicacion, 'datos_estaciones', nuevo_almacen(max_estaciones=2))
+    for estacion, valor in (('banco1', 1.0), ('banco2', 2.0), ('banco1', 1.5), ('banco3', 3.0)):
+        assert cliente.post(f'/api/data?estacion={estacion}', json={'0': {'izquierda': valor}}).status_code == 200
+    # banco2 es la que lleva más tiempo sin actualizarse
+    assert cliente.get('/api/data?estacion=banco2').headers['X-Version'] == '0'
+    assert cliente.get('/api/data?estacion=banco1').get_json()['0']['izquierda'] == 1.5
+    assert cliente.get('/api/data?estacion=banco3').get_json()['0']['izquierda'] == 3.0
+    # Las versiones no se repiten aunque la estación se vuelva a crear
+    assert cliente.post('/api/data?estacion=banco2', json={'0': {'izquierda': 2.0}}).get_json()['version'] == 5
+
+
+def test_sin_cambios_no_hay_version_nueva(cliente, monkeypatch, nuevo_almacen):
+    monkeypatch.setattr(aplicacion, 'datos_estaciones', nuevo_almacen())
+    assert cliente.post('/api/data?estacion=banco1', json={'0': {'izquierda': 2.5}}).get_json()['version'] == 1
+    assert cliente.post('/api/data?estacion=banco1', json={'0': {'izquierda': 2.5}}).get_json()['version'] == 1
+    assert cliente.post('/api/data?estacion=banco1', json={'50': {'izquierda': 9}}).get_json()['version'] == 1
+    assert cliente.get('/api/data/cambios?estacion=banco1&version=1&timeout=0').status_code == 204
+
+
+def test_estaciones_compartidas_entre_workers(tmp_path):
+    # Dos almacenes sobre la misma base de datos, como dos procesos worker
+    ruta = str(tmp_path / 'estado.db')
+    uno = AlmacenEstacionesCompartido(BaseDatosEstado(ruta), intervalo_s=0.05)
+    otro = AlmacenEstacionesCompartido(BaseDatosEstado(ruta), intervalo_s=0.05)
+    instantanea = uno.actualizar('banco1', {'0': {'izquierda': 2.5}}, origen='c1')
+    leida = otro.obtener('banco1')
+    assert (leida.version, leida.origen, leida.json_bytes) == (1, 'c1', instantanea.json_bytes)
+    assert otro.etag('banco1', leida) == uno.etag('banco1', instantanea)
+
+    # Una espera en un worker se despierta con el cambio hecho en el otro
+    cambios = []
+    espera = threading.Thread(target=lambda: cambios.append(otro.esperar_cambio('banco1', 1, 10)))
+    espera.start()
+    time.sleep(0.2)
+    inicio = time.monotonic()
+    uno.actualizar('banco1', {'0': {'izquierda': 2.7}})
+    espera.join()
+    assert time.monotonic() - inicio < 5
+    assert (cambios[0].version, cambios[0].datos['0']['izquierda']) == (2, 2.7)
+    assert len(otro) == 1
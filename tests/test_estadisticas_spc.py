@@ -0,0 +1,87 @@
+from io import BytesIO
+
+import numpy as np
+import pytest
+
+from estadisticas_spc import calcular_estadisticas
+from libros import filas_pieza, libro_excel
+from modelo_piezas import CAMPOS, PORCENTAJES, TablaPiezas
+from procesador_excel import procesar_libro
+
+
+def tabla_libro(filas):
+    return procesar_libro(BytesIO(libro_excel(filas)))[1]
+
+
+def test_valores_iguales_sin_capacidad(patron_la):
+    # 6.6 tres veces no da una media exacta: la desviación de redondeo no debe convertirse en Cp enorme
+    tabla = tabla_libro(filas_pieza(1, 1) + filas_pieza(2, 1, par_100=(7.0, 6.6)) + filas_pieza(3, 2))
+    derecha = calcular_estadisticas(tabla, patron_la, 10, 10)['total']['cargas']['100']['derecha']
+    assert derecha['std'] == 0.0
+    assert derecha['cp'] is None and derecha['cpk'] is None
+
+
+def tabla_aleatoria(n=300, semilla=13):
+    generador = np.random.default_rng(semilla)
+    cargas = np.empty((n, len(PORCENTAJES), len(CAMPOS)))
+    cargas[:, 0, :4] = generador.normal([2.5, 2.6, 3.5, 3.6], 0.2, (n, 4))
+    cargas[:, 1, :4] = generador.normal([6.5, 6.6, 26, 25], [0.3, 0.3, 1.5, 1.5], (n, 4))
+    cargas[:, :, 4] = 0.8
+    presentes = generador.random((n, len(PORCENTAJES))) > 0.1
+    return TablaPiezas(generador.integers(347935, 347939, n), np.arange(n), np.round(cargas, 2), presentes)
+
+
+def esperado(valores, percentiles):
+    valores = valores[~np.isnan(valores)]
+    return {'n': len(valores), 'media': valores.mean(), 'std': valores.std(ddof=1), 'min': valores.min(),
+            'max': valores.max(), **{f'p{p}': np.percentile(valores, p) for p in percentiles}}
+
+
+def test_estadisticas_iguales_que_numpy(patron_la):
+    tabla = tabla_aleatoria()
+    estadisticas = calcular_estadisticas(tabla, patron_la, 10, 8, percentiles=[5, 50, 95])
+    valores = tabla.valores()
+    grupos = {'total': np.ones(len(tabla), dtype=bool)} | {str(of): tabla.of == of for of in np.unique(tabla.of)}
+    assert sorted(estadisticas['por_of']) == sorted(grupos.keys() - {'total'})
+    for nombre, seleccion in grupos.items():
+        resumen = estadisticas['total'] if nombre == 'total' else estadisticas['por_of'][nombre]
+        assert resumen['piezas'] == seleccion.sum()
+        for j, percent in enumerate(PORCENTAJES):
+            for k, campo in enumerate(CAMPOS[:4]):
+                calculadas = resumen['cargas'][percent][campo]
+                numpy = esperado(valores[seleccion, j, k], [5, 50, 95])
+                for metrica, valor in numpy.items():
+                    assert calculadas[metrica] == pytest.approx(valor, abs=1e-4), (nombre, percent, campo, metrica)
+                limites = estadisticas['limites'][percent][campo]
+                cp = (limites['superior'] - limites['inferior']) / (6 * numpy['std'])
+                cpk = min(limites['superior'] - numpy['media'], numpy['media'] - limites['inferior']) / (3 * numpy['std'])
+                assert calculadas['cp'] == pytest.approx(cp, abs=1e-4)
+                assert calculadas['cpk'] == pytest.approx(cpk, abs=1e-4)
+            asimetria = esperado(valores[seleccion, j, 0] - valores[seleccion, j, 1], [5, 50, 95])
+            assert resumen['asimetria'][percent]['par']['media'] == pytest.approx(asimetria['media'], abs=1e-4)
+
+
+def test_endpoints_de_estadisticas(cliente):
+    datos = libro_excel(filas_pieza(1, 913401) + filas_pieza(2, 913401, par_100=(7.0, 6.6))
+                        + filas_pieza(1, 913402, pasos=[0]), referencia='e09134010')
+    cliente.delete('/api/estadisticas/e09134010')
+    piezas = cliente.post('/api/procesar-excel?cache=0', data={'file': (BytesIO(datos), 'prueba.xlsx')},
+                          content_type='multipart/form-data').get_json()['piezas']
+    assert cliente.get('/api/estadisticas').get_json()['e09134010']['piezas'] == 3
+
+    enviadas = cliente.post('/api/estadisticas', json={'piezas': piezas, 'referencia_bmw': 'LA',
+                                                       'dispersion_par': 10, 'percentiles': [50]}).get_json()
+    acumuladas = cliente.get('/api/estadisticas/e09134010?referencia_bmw=LA&dispersion_par=10&percentiles=50')
+    assert acumuladas.status_code == 200
+    acumuladas = acumuladas.get_json()
+    for clave in ('total', 'por_of', 'limites', 'percentiles'):
+        assert acumuladas[clave] == enviadas[clave]
+    # La pieza sin 100% no cuenta en los valores al 100%
+    assert enviadas['total']['cargas']['100']['izquierda']['n'] == 2
+    assert enviadas['total']['cargas']['0']['izquierda']['n'] == 3
+    assert enviadas['por_of']['913401']['cargas']['100']['izquierda']['p50'] == 6.75
+
+    assert cliente.post('/api/estadisticas', json={'piezas': piezas, 'percentiles': [120]}).status_code == 400
+    assert cliente.post('/api/estadisticas', json={'piezas': piezas, 'referencia_bmw': 'ZZ'}).status_code == 404
+    assert cliente.delete('/api/estadisticas/e09134010').get_json()['eliminadas'] == 1
+    assert cliente.get('/api/estadisticas/e09134010').status_code == 404
@@ -0,0 +1,78 @@
+from io import BytesIO
+
+import numpy as np
+
+from evaluacion_tolerancias import NOK, OK, SIN_DATOS, evaluar_piezas
+from exportacion_resultados import tabla_larga
+from libros import filas_pieza, libro_excel
+from modelo_piezas import TablaPiezas
+from procesador_excel import procesar_libro
+
+
+def piezas_excel(cliente, datos):
+    respuesta = cliente.post('/api/procesar-excel?cache=0', data={'file': (BytesIO(datos), 'prueba.xlsx')},
+                             content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    return respuesta.get_json()['piezas']
+
+
+def test_porcentaje_ausente_es_sin_datos(cliente, patron_la):
+    # Pieza 1 dentro de la banda; pieza 2 solo tiene el paso 0 (sin 100%); pieza 3 con el par al 100% fuera
+    datos = libro_excel(filas_pieza(1, 347935) + filas_pieza(2, 347935, pasos=[0])
+                        + filas_pieza(3, 347935, par_100=(9.0, 6.6)))
+    piezas = piezas_excel(cliente, datos)
+    # La API rellena el 100% que falta con ceros
+    assert piezas['OF347935_Pieza2']['cargas']['100']['izquierda'] == 0
+
+    respuesta = cliente.post('/api/evaluar-tolerancias', json={
+        'piezas': piezas, 'referencia_bmw': 'LA', 'dispersion_par': 10, 'dispersion_consumo': 10})
+    evaluacion = respuesta.get_json()
+    assert evaluacion['resumen']['ok'] == 1
+    assert evaluacion['resumen']['nok'] == 1
+    assert evaluacion['resumen']['sin_datos'] == 1
+    assert evaluacion['piezas']['OF347935_Pieza1']['resultado'] == OK
+    assert evaluacion['piezas']['OF347935_Pieza2'] == {
+        'resultado': SIN_DATOS, 'fallos': [],
+        'detalle': evaluacion['piezas']['OF347935_Pieza2']['detalle']}
+    assert evaluacion['piezas']['OF347935_Pieza2']['detalle']['100']['izquierda']['ok'] is None
+    assert evaluacion['piezas']['OF347935_Pieza2']['detalle']['0']['izquierda']['ok'] is True
+    assert evaluacion['piezas']['OF347935_Pieza3'] == {
+        'resultado': NOK, 'fallos': ['100% izquierda'],
+        'detalle': evaluacion['piezas']['OF347935_Pieza3']['detalle']}
+
+
+def test_porcentaje_ausente_en_exportacion(patron_la):
+    datos = libro_excel(filas_pieza(1, 347935) + filas_pieza(2, 347935, pasos=[0]))
+    _, tabla = procesar_libro(BytesIO(datos))
+    columnas = tabla_larga(tabla, 'e06091800', 'prueba.xlsx', patron_la, 10, 10)
+    resultado = dict(zip(columnas['pieza'].tolist(), columnas['resultado_pieza'].tolist()))
+    assert resultado == {1: OK, 2: SIN_DATOS}
+
+
+def test_misma_evaluacion_desde_tabla_y_desde_dict(patron_la):
+    # Los ceros de un porcentaje ausente (dict de la API) y el NaN de la tabla dan el mismo resultado
+    tabla = TablaPiezas([1, 1], [1, 2], np.array([[[2.5, 2.6, 3.5, 3.6, 0], [6.5, 6.6, 26, 25, 0.8]],
+                                                  [[2.5, 2.6, 3.5, 3.6, 0], [np.nan] * 5]]),
+                        [[True, True], [True, False]])
+    evaluacion = evaluar_piezas(tabla.a_dict(), patron_la, 10, 10, detalle=False)
+    assert [pieza['resultado'] for pieza in evaluacion['piezas'].values()] == [OK, SIN_DATOS]
+
+
+def test_magnitud_sin_dispersion_no_se_evalua(patron_la):
+    piezas = TablaPiezas([1], [1], np.array([[[2.5, 2.6, 30, 3.6, 0], [6.5, 6.6, 26, 25, 0.8]]]),
+                         [[True, True]]).a_dict()
+    assert evaluar_piezas(piezas, patron_la, 10, 0, detalle=False)['resumen']['ok'] == 1
+    assert evaluar_piezas(piezas, patron_la, 10, 10, detalle=False)['resumen']['nok'] == 1
+
+
+def test_errores_de_evaluacion(cliente):
+    piezas = TablaPiezas([1], [1], np.array([[[2.5, 2.6, 3.5, 3.6, 0], [6.5, 6.6, 26, 25, 0.8]]]),
+                         [[True, True]]).a_dict()
+    assert cliente.post('/api/evaluar-tolerancias', json={'piezas': {}}).status_code == 400
+    assert cliente.post('/api/evaluar-tolerancias', json={'piezas': piezas}).status_code == 400
+    assert cliente.post('/api/evaluar-tolerancias', json={'piezas': piezas, 'referencia_bmw': 'ZZ'}).status_code == 404
+    assert cliente.post('/api/evaluar-tolerancias', json={'piezas': piezas, 'referencia_bmw': 'LA'}).status_code == 400
+    resumen = cliente.post('/api/evaluar-tolerancias?detalle=0', json={
+        'piezas': piezas, 'referencia_bmw': 'LA', 'dispersion_par': 10}).get_json()
+    assert resumen['resumen']['ok'] == 1
+    assert 'detalle' not in resumen['piezas']['OF1_Pieza1']
@@ -0,0 +1,84 @@
+import csv
+import io
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+from evaluacion_tolerancias import NOK, OK, SIN_DATOS
+from exportacion_resultados import COLUMNAS_EVALUACION, COLUMNAS_EXPORTACION, parquet_disponible
+from libros import filas_pieza, filas_variadas, libro_excel, piezas_iterativo
+
+
+def exportar(cliente, archivos, **parametros):
+    return cliente.post('/api/exportar', data={'files': [(BytesIO(datos), nombre) for nombre, datos in archivos],
+                                               **parametros},
+                        content_type='multipart/form-data')
+
+
+def filas_csv(respuesta):
+    return list(csv.DictReader(io.StringIO(respuesta.get_data(as_text=True))))
+
+
+def filas_xlsx(respuesta):
+    hoja = openpyxl.load_workbook(BytesIO(respuesta.get_data()), read_only=True).active
+    cabecera, *filas = hoja.iter_rows(values_only=True)
+    return [dict(zip(cabecera, fila)) for fila in filas]
+
+
+def assert_igual_que_la_implementacion_original(filas, archivos):
+    exportadas = {(fila['archivo'], int(fila['of']), int(fila['pieza']), str(fila['porcentaje']), fila['campo']):
+                  float(fila['valor']) for fila in filas}
+    assert len(exportadas) == len(filas)
+    esperadas = {}
+    for nombre, datos in archivos:
+        for pieza in piezas_iterativo(datos).values():
+            for percent, carga in pieza['cargas'].items():
+                # Un porcentaje que la pieza no tiene (todo a 0 en la API) no se exporta
+                if any(carga.values()):
+                    esperadas.update({(nombre, pieza['of'], pieza['pieza'], percent, campo): float(valor)
+                                      for campo, valor in carga.items()})
+    assert exportadas == esperadas
+
+
+@pytest.fixture
+def archivos():
+    return [('a.xlsx', libro_excel(filas_variadas())), ('b.xlsx', libro_excel(filas_pieza(7, 913501)))]
+
+
+def test_csv_igual_que_la_implementacion_original(cliente, archivos):
+    respuesta = exportar(cliente, archivos)
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == 'text/csv'
+    assert (respuesta.headers['X-Exportacion-Archivos'], respuesta.headers['X-Exportacion-Errores']) == ('2', '0')
+    filas = filas_csv(respuesta)
+    assert list(filas[0]) == COLUMNAS_EXPORTACION
+    assert_igual_que_la_implementacion_original(filas, archivos)
+
+
+def test_xlsx_igual_que_el_csv(cliente, archivos):
+    respuesta = exportar(cliente, archivos, formato='xlsx')
+    assert respuesta.status_code == 200
+    filas = filas_xlsx(respuesta)
+    assert_igual_que_la_implementacion_original(filas, archivos)
+    assert len(filas) == len(filas_csv(exportar(cliente, archivos)))
+
+
+def test_csv_con_evaluacion(cliente):
+    archivos = [('a.xlsx', libro_excel(filas_pieza(1, 913601) + filas_pieza(2, 913601, par_100=(9.0, 6.6))
+                                       + filas_pieza(3, 913601, pasos=[0])))]
+    filas = filas_csv(exportar(cliente, archivos, referencia_bmw='LA', dispersion_par='10', dispersion_consumo='10'))
+    assert list(filas[0]) == COLUMNAS_EXPORTACION + COLUMNAS_EVALUACION
+    resultados = {fila['pieza']: fila['resultado_pieza'] for fila in filas}
+    assert resultados == {'1': OK, '2': NOK, '3': SIN_DATOS}
+    fuera = [fila for fila in filas if fila['dentro'] == 'False']
+    assert [(fila['pieza'], fila['porcentaje'], fila['campo']) for fila in fuera] == [('2', '100', 'izquierda')]
+
+
+def test_errores_de_exportacion(cliente, archivos):
+    assert cliente.post('/api/exportar').status_code == 400
+    assert exportar(cliente, archivos, formato='ods').status_code == 400
+    assert exportar(cliente, archivos, referencia_bmw='ZZ').status_code == 404
+    assert exportar(cliente, [('c.xlsx', b'no')]).status_code == 400
+    parquet = exportar(cliente, archivos, formato='parquet')
+    assert parquet.status_code == (200 if parquet_disponible() else 501)
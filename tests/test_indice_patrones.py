@@ -0,0 +1,128 @@
+import hashlib
+import json
+import math
+import os
+import random
+
+import pytest
+
+from indice_patrones import RegistroIndice
+from patrones import RegistroPatrones, registro_patrones
+
+
+def patron(par_0, par_100):
+    return {'0': {'izquierda': par_0, 'derecha': par_0, 'consumo_izquierda': 3.5, 'consumo_derecha': 3.6},
+            '100': {'izquierda': par_100, 'derecha': par_100, 'consumo_izquierda': 26, 'consumo_derecha': 25,
+                    'valor_columna_l': 0.8}}
+
+
+def escribir(ruta, patrones, mtime):
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(patrones, f)
+    os.utime(ruta, ns=(mtime, mtime))
+
+
+def test_indice_se_reconstruye_con_los_patrones_de_su_etag(tmp_path):
+    ruta = str(tmp_path / 'patrones_carga.json')
+    escribir(ruta, {'LA': patron(2.5, 6.5)}, 10 ** 18)
+    registro = RegistroPatrones(ruta)
+    indice_patrones = RegistroIndice(registro)
+
+    indice = indice_patrones.obtener()
+    assert indice.ids == ['LA']
+    assert indice_patrones.obtener() is indice
+    assert registro.instantanea() == (registro.todos(), indice.etag)
+
+    escribir(ruta, {'LA': patron(2.5, 6.5), 'LB': patron(3.0, 8.0)}, 2 * 10 ** 18)
+    nuevo = indice_patrones.obtener()
+    assert nuevo.ids == ['LA', 'LB']
+    assert nuevo.etag == registro.todos_json()[1] != indice.etag
+    assert indice_patrones.reconstrucciones == 2
+
+
+def caracteristicas(cargas):
+    """(porcentaje, campo) -> |valor| de una pieza o un patrón, sin los valores a 0"""
+    valores = {}
+    for percent in ('0', '100'):
+        carga = cargas.get(percent) or {}
+        campos = ['izquierda', 'derecha', 'consumo_izquierda', 'consumo_derecha']
+        if all(not carga.get(campo) for campo in campos):
+            continue
+        for campo in campos + (['valor_columna_l'] if percent == '100' else []):
+            if carga.get(campo):
+                valores[percent, campo] = abs(carga[campo])
+    return valores
+
+
+def distancia_directa(pieza, patron):
+    """Media cuadrática de la desviación relativa en las características comunes, pieza a pieza"""
+    x, p = caracteristicas(pieza['cargas']), caracteristicas(patron)
+    comunes = x.keys() & p.keys()
+    if not comunes:
+        return None
+    return math.sqrt(sum(((x[c] - p[c]) / p[c]) ** 2 for c in comunes) / len(comunes))
+
+
+def piezas_aleatorias(patrones, n=200, semilla=24):
+    generador = random.Random(semilla)
+    piezas = {}
+    for i in range(n):
+        patron = patrones[generador.choice(sorted(patrones))]
+        cargas = {percent: {campo: round(valor * generador.uniform(0.85, 1.15), 2)
+                            for campo, valor in patron[percent].items()}
+                  for percent in ('0', '100') if generador.random() > 0.1}
+        piezas[f'OF1_Pieza{i}'] = {'of': 1, 'pieza': i, 'cargas': cargas}
+    return piezas
+
+
+def test_patrones_cercanos_igual_que_el_calculo_directo(cliente):
+    patrones = registro_patrones.todos()
+    piezas = piezas_aleatorias(patrones)
+    respuesta = cliente.post('/api/patrones/cercanos', json={'piezas': piezas})
+    assert respuesta.status_code == 200
+    resultado = respuesta.get_json()
+    for pieza_id, pieza in piezas.items():
+        distancias = sorted(d for d in (distancia_directa(pieza, patron) for patron in patrones.values())
+                            if d is not None)
+        encontrada = resultado['piezas'][pieza_id]
+        if not distancias:
+            assert encontrada['patron'] is None
+            continue
+        assert encontrada['distancia'] == pytest.approx(distancias[0], abs=1e-4)
+        assert encontrada['distancia_segundo'] == pytest.approx(distancias[1], abs=1e-4)
+        assert distancia_directa(pieza, patrones[encontrada['patron']]) == pytest.approx(distancias[0], abs=1e-9)
+    assert resultado['resumen']['piezas'] == len(piezas)
+
+
+def test_patrones_cercanos_errores(cliente):
+    piezas = piezas_aleatorias(registro_patrones.todos(), n=2)
+    assert cliente.post('/api/patrones/cercanos', json={'piezas': {}}).status_code == 400
+    assert cliente.post('/api/patrones/cercanos', json={'piezas': piezas, 'candidatos': 'LA'}).status_code == 400
+    respuesta = cliente.post('/api/patrones/cercanos', json={'piezas': piezas, 'candidatos': ['LA', 'ZZ']})
+    assert respuesta.status_code == 404
+    solo_la = cliente.post('/api/patrones/cercanos?detalle=0', json={'piezas': piezas, 'candidatos': ['LA']})
+    assert solo_la.get_json()['resumen']['patron'] == 'LA'
+    assert 'piezas' not in solo_la.get_json()
+
+
+def test_patrones_con_etag(cliente):
+    todos = cliente.get('/api/patrones')
+    assert todos.get_json() == registro_patrones.todos()
+    assert cliente.get('/api/patrones', headers={'If-None-Match': todos.headers['ETag']}).status_code == 304
+    assert cliente.get('/api/patrones/LA').get_json() == registro_patrones.todos()['LA']
+    assert cliente.get('/api/patrones/ZZ').status_code == 404
+
+
+def test_json_y_etag_de_la_misma_carga(tmp_path):
+    ruta = str(tmp_path / 'patrones_carga.json')
+    registro = RegistroPatrones(ruta)
+    for i, patrones in enumerate(({'LA': patron(2.5, 6.5)}, {'LB': patron(3.0, 8.0)}), start=1):
+        escribir(ruta, patrones, i * 10 ** 18)
+        with open(ruta, 'rb') as f:
+            etag = hashlib.sha1(f.read()).hexdigest()
+        cuerpo, etag_todos = registro.todos_json()
+        assert (json.loads(cuerpo), etag_todos) == (patrones, etag)
+        patron_id = next(iter(patrones))
+        cuerpo, etag_patron = registro.patron_json(patron_id)
+        assert (json.loads(cuerpo), etag_patron) == (patrones[patron_id], f'{etag}-{patron_id}')
+    assert registro.recargas == 2
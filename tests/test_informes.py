@@ -0,0 +1,182 @@
+import threading
+import time
+import zipfile
+from io import BytesIO
+
+import pytest
+
+import app as aplicacion
+import informes_lote
+import trabajos_informes
+from estado_compartido import BaseDatosEstado
+from libros import filas_pieza, libro_excel, piezas_iterativo
+from trabajos_informes import EJECUTANDO, ERROR, TERMINADO, ColaLlenaError, ColaTrabajos, ColaTrabajosCompartida
+
+
+@pytest.fixture(params=['memoria', 'compartida'])
+def nueva_cola(request, tmp_path):
+    """Crea colas de trabajos en memoria o sobre la base de datos de estado (como con varios workers)"""
+    if request.param == 'memoria':
+        return ColaTrabajos
+    return lambda **parametros: ColaTrabajosCompartida(BaseDatosEstado(str(tmp_path / 'estado.db')), **parametros)
+
+
+@pytest.fixture
+def piezas():
+    return piezas_iterativo(libro_excel(filas_pieza(1, 913801) + filas_pieza(2, 913801, pasos=[0])))
+
+
+def test_informe_individual(cliente, piezas):
+    pieza = piezas['OF913801_Pieza1']
+    respuesta = cliente.post('/api/generar-informe', json={'referencia': pieza['referencia'], 'cargas': pieza['cargas'],
+                                                           'referencia_bmw': 'LA', 'dispersion_par': 10})
+    assert respuesta.status_code == 200
+    assert respuesta.mimetype == 'application/pdf'
+    assert respuesta.get_data().startswith(b'%PDF')
+
+
+def test_informe_masivo(cliente, piezas):
+    respuesta = cliente.post('/api/generar-informe-masivo', json={'piezas': piezas, 'referencia_excel': 'e06091800'})
+    assert respuesta.get_data().startswith(b'%PDF')
+    assert cliente.post('/api/generar-informe-masivo', json={'piezas': {}}).status_code == 400
+
+
+def test_informes_en_lote(cliente, piezas):
+    respuesta = cliente.post('/api/generar-informes-lote', json={'piezas': piezas, 'referencia_excel': 'e06091800',
+                                                                 'workers': 1})
+    assert respuesta.status_code == 200
+    assert (respuesta.headers['X-Num-Informes'], respuesta.headers['X-Informes-Workers']) == ('2', '1')
+    with zipfile.ZipFile(BytesIO(respuesta.get_data())) as archivo:
+        informes = [nombre for nombre in archivo.namelist() if nombre.endswith('.pdf')]
+        assert sorted(informes) == ['Informe_Pieza_1_-_OF_913801.pdf', 'Informe_Pieza_2_-_OF_913801.pdf']
+        assert all(archivo.read(nombre).startswith(b'%PDF') for nombre in informes)
+
+    assert cliente.post('/api/generar-informes-lote', json={'piezas': {}}).status_code == 400
+    assert cliente.post('/api/generar-informes-lote', json={'piezas': piezas, 'workers': 0}).status_code == 400
+    assert cliente.post('/api/generar-informes-lote', json={'piezas': {'x': 'no es una pieza'}}).status_code == 400
+
+
+def test_informes_en_lote_no_pasan_de_los_workers_configurados(cliente, piezas, monkeypatch):
+    monkeypatch.setattr(informes_lote, 'WORKERS_INFORMES', 2)
+    respuesta = cliente.post('/api/generar-informes-lote', json={'piezas': piezas, 'workers': 500})
+    assert respuesta.status_code == 200
+    assert respuesta.headers['X-Informes-Workers'] == '2'
+    with zipfile.ZipFile(BytesIO(respuesta.get_data())) as archivo:
+        assert len([nombre for nombre in archivo.namelist() if nombre.endswith('.pdf')]) == 2
+
+
+def test_trabajo_de_informe(cliente, piezas, monkeypatch, tmp_path, nueva_cola):
+    cola = nueva_cola(max_concurrentes=1, directorio=str(tmp_path / 'trabajos'))
+    monkeypatch.setattr(aplicacion, 'cola_informes', cola)
+    enviado = cliente.post('/api/trabajos/informe-masivo', json={'piezas': piezas})
+    assert enviado.status_code == 202
+    trabajo = enviado.get_json()
+    limite = time.monotonic() + 60
+    while cliente.get(trabajo['url_estado']).get_json()['estado'] not in (TERMINADO, ERROR):
+        assert time.monotonic() < limite
+        time.sleep(0.05)
+    descarga = cliente.get(trabajo['url_descarga'])
+    assert descarga.status_code == 200
+    assert descarga.get_data().startswith(b'%PDF')
+    descarga.close()
+
+    assert cliente.get('/api/trabajos/no-existe').status_code == 404
+    assert cliente.post('/api/trabajos/informe-masivo', json={'piezas': {}}).status_code == 400
+    cola.cerrar()
+
+
+def test_cola_de_trabajos_llena(cliente, piezas, monkeypatch, tmp_path, nueva_cola):
+    cola = nueva_cola(directorio=str(tmp_path / 'trabajos'), max_pendientes=0)
+    monkeypatch.setattr(aplicacion, 'cola_informes', cola)
+    respuesta = cliente.post('/api/trabajos/informe-masivo', json={'piezas': piezas})
+    assert respuesta.status_code == 503
+    assert respuesta.headers['Retry-After'] == str(aplicacion.REINTENTO_TRABAJOS_S)
+    cola.cerrar()
+
+
+def test_cerrar_con_un_trabajo_en_marcha(tmp_path):
+    cola = ColaTrabajos(max_concurrentes=1, directorio=str(tmp_path))
+    empezado, seguir = threading.Event(), threading.Event()
+
+    def informe_lento(data, progreso):
+        empezado.set()
+        seguir.wait(10)
+        return BytesIO(b'%PDF-1.4'), 'lento.pdf'
+
+    id_trabajo = cola.enviar('informe', informe_lento, {})
+    assert empezado.wait(10)
+    cola.cerrar()
+    seguir.set()
+    cola._ejecutor.shutdown(wait=True)
+    assert cola.estado(id_trabajo) is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def informe_rapido(data, progreso):
+    progreso(0.5)
+    return BytesIO(b'%PDF-1.4'), data['nombre']
+
+
+def esperar_estado(cola, id_trabajo, estados):
+    limite = time.monotonic() + 10
+    while cola.estado(id_trabajo)['estado'] not in estados:
+        assert time.monotonic() < limite
+        time.sleep(0.02)
+    return cola.estado(id_trabajo)
+
+
+def test_trabajos_compartidos_entre_workers(tmp_path):
+    # Dos colas sobre la misma base de datos, como dos procesos worker
+    ruta = str(tmp_path / 'estado.db')
+    uno = ColaTrabajosCompartida(BaseDatosEstado(ruta), max_concurrentes=1, max_pendientes=2)
+    otro = ColaTrabajosCompartida(BaseDatosEstado(ruta), max_concurrentes=1, max_pendientes=2)
+    assert uno.directorio == otro.directorio == str(tmp_path / 'trabajos_informes')
+
+    id_trabajo = uno.enviar('informe', informe_rapido, {'nombre': 'a.pdf'})
+    assert esperar_estado(otro, id_trabajo, (TERMINADO, ERROR))['estado'] == TERMINADO
+    ruta_pdf, nombre = otro.resultado(id_trabajo)
+    assert nombre == 'a.pdf'
+    with open(ruta_pdf, 'rb') as f:
+        assert f.read() == b'%PDF-1.4'
+
+    # El límite de pendientes es para todos los workers
+    empezado, seguir = threading.Event(), threading.Event()
+
+    def informe_lento(data, progreso):
+        empezado.set()
+        seguir.wait(10)
+        return BytesIO(b'%PDF-1.4'), 'lento.pdf'
+
+    lento = uno.enviar('informe', informe_lento, {})
+    assert empezado.wait(10)
+    otro.enviar('informe', informe_lento, {})
+    with pytest.raises(ColaLlenaError):
+        uno.enviar('informe', informe_rapido, {'nombre': 'b.pdf'})
+    assert otro.pendientes() == 2
+
+    # Al cerrar un worker sus trabajos sin terminar pasan a error; los PDF terminados siguen disponibles
+    uno.cerrar()
+    assert otro.estado(lento)['error'] == 'Servidor detenido'
+    assert otro.resultado(id_trabajo) is not None
+    seguir.set()
+    otro.cerrar()
+
+
+def test_trabajo_de_un_worker_terminado_pasa_a_error(tmp_path, monkeypatch):
+    cola = ColaTrabajosCompartida(BaseDatosEstado(str(tmp_path / 'estado.db')), max_concurrentes=1)
+    empezado, seguir = threading.Event(), threading.Event()
+
+    def informe_lento(data, progreso):
+        empezado.set()
+        seguir.wait(10)
+        return BytesIO(b'%PDF-1.4'), 'lento.pdf'
+
+    id_trabajo = cola.enviar('informe', informe_lento, {})
+    assert empezado.wait(10)
+    assert cola.estado(id_trabajo)['estado'] == EJECUTANDO
+    # El proceso que lo ejecutaba ya no existe (reinicio o timeout del worker)
+    monkeypatch.setattr(trabajos_informes, '_proceso_vivo', lambda pid: False)
+    estado = cola.estado(id_trabajo)
+    assert (estado['estado'], cola.pendientes()) == (ERROR, 0)
+    seguir.set()
+    cola.cerrar()
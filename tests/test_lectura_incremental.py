@@ -0,0 +1,63 @@
+from io import BytesIO
+
+import lectura_incremental
+from lectura_incremental import RegistroIncremental, leer_libro_incremental
+from libros import filas_pieza, libro_excel
+from procesador_excel import leer_libro, tabla_piezas
+
+
+def filas_ofs(num_piezas, of=347935):
+    return [fila for pieza in range(1, num_piezas + 1) for fila in filas_pieza(pieza, of)]
+
+
+def assert_mismas_piezas(columnas, datos):
+    # Las filas guardadas están compactadas: se comparan las piezas agregadas con las de la lectura completa
+    assert tabla_piezas(columnas).a_dict() == tabla_piezas(leer_libro(BytesIO(datos), 'completa')[1]).a_dict()
+
+
+def test_filas_anadidas_se_leen_de_forma_incremental():
+    registro = RegistroIncremental()
+    leer_libro_incremental(libro_excel(filas_ofs(3)), registro)
+    datos = libro_excel(filas_ofs(5))
+    _, columnas, info = leer_libro_incremental(datos, registro)
+    assert info == {'modo': 'incremental', 'filas_reutilizadas': 18, 'filas_leidas': 12}
+    assert_mismas_piezas(columnas, datos)
+
+
+def test_prefijo_cambiado_lee_el_libro_completo():
+    registro = RegistroIncremental()
+    filas = filas_ofs(3)
+    leer_libro_incremental(libro_excel(filas), registro)
+    cambiadas = [list(fila) for fila in filas + filas_ofs(1, of=347936)]
+    cambiadas[2][7] = 9.9
+    datos = libro_excel(cambiadas)
+    _, columnas, info = leer_libro_incremental(datos, registro)
+    assert info == {'modo': 'completa', 'filas_reutilizadas': 0, 'filas_leidas': 24}
+    assert_mismas_piezas(columnas, datos)
+
+
+def test_sin_internos_de_openpyxl_lee_el_libro_completo(monkeypatch):
+    # Otra versión de openpyxl sin los atributos privados que usa la lectura incremental
+    registro = RegistroIncremental()
+    monkeypatch.setattr(lectura_incremental, '_internos', lambda libro, hoja: None)
+    leer_libro_incremental(libro_excel(filas_ofs(3)), registro)
+    datos = libro_excel(filas_ofs(5))
+    _, columnas, info = leer_libro_incremental(datos, registro)
+    assert info['modo'] == 'completa'
+    assert len(registro) == 0
+    assert_mismas_piezas(columnas, datos)
+
+
+def test_constructor_distinto_de_openpyxl_lee_el_libro_completo(monkeypatch):
+    # Constructor con otros argumentos: la llamada falla con TypeError
+    class HojaOtraVersion:
+        def __init__(self, libro, titulo, ruta):
+            pass
+
+    registro = RegistroIncremental()
+    leer_libro_incremental(libro_excel(filas_ofs(3)), registro)
+    monkeypatch.setattr(lectura_incremental, '_HojaParcial', HojaOtraVersion)
+    datos = libro_excel(filas_ofs(5))
+    _, columnas, info = leer_libro_incremental(datos, registro)
+    assert info['modo'] == 'completa'
+    assert_mismas_piezas(columnas, datos)
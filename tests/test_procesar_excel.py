@@ -0,0 +1,210 @@
+import json
+import math
+import os
+import zipfile
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import openpyxl
+import pytest
+
+import app as aplicacion
+import ingesta_lote
+import pool_procesos
+from almacen_resultados import AlmacenResultados
+from procesador_excel import procesar_libro
+from libros import filas_pieza, filas_variadas, libro_excel, piezas_iterativo
+
+
+def subir(cliente, datos, consulta='', nombre='prueba.xlsx'):
+    return cliente.post(f'/api/procesar-excel{consulta}', data={'file': (BytesIO(datos), nombre)},
+                        content_type='multipart/form-data')
+
+
+def lineas(respuesta):
+    return [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines()]
+
+
+def piezas_lineas(lineas_ndjson):
+    return {linea.pop('id'): {clave: valor for clave, valor in linea.items() if clave != 'tipo'}
+            for linea in lineas_ndjson if linea['tipo'] == 'pieza'}
+
+
+@pytest.fixture
+def datos_variados():
+    return libro_excel(filas_variadas(), final=filas_pieza(99, 1))
+
+
+@pytest.mark.parametrize('lectura', ['completa', 'streaming'])
+def test_json_igual_que_la_implementacion_original(cliente, datos_variados, lectura):
+    respuesta = subir(cliente, datos_variados, f'?cache=0&lectura={lectura}')
+    assert respuesta.status_code == 200
+    resultado = respuesta.get_json()
+    esperadas = piezas_iterativo(datos_variados)
+    assert resultado['referencia_excel'] == 'e06091800'
+    assert resultado['piezas'] == esperadas
+    assert list(resultado['piezas']) == list(esperadas)
+
+
+def test_ndjson_igual_que_la_implementacion_original(cliente, datos_variados):
+    respuesta = subir(cliente, datos_variados, '?cache=0&formato=ndjson')
+    assert respuesta.mimetype == 'application/x-ndjson'
+    recibidas = lineas(respuesta)
+    assert recibidas[0] == {'tipo': 'inicio', 'referencia_excel': 'e06091800'}
+    assert recibidas[-1] == {'tipo': 'fin', 'num_piezas': 6}
+    # Orden numérico de OF y pieza (no el de las claves de texto)
+    assert [linea['id'] for linea in recibidas[1:-1]] == [
+        'OF347935_Pieza1', 'OF347935_Pieza3', 'OF347935_Pieza4', 'OF347935_Pieza5', 'OF347935_Pieza10',
+        'OF347936_Pieza2']
+    assert piezas_lineas(recibidas) == piezas_iterativo(datos_variados)
+
+
+def test_cache_devuelve_el_mismo_resultado(cliente):
+    datos = libro_excel(filas_variadas(of=913001))
+    primera = subir(cliente, datos)
+    segunda = subir(cliente, datos)
+    assert (primera.headers['X-Cache'], segunda.headers['X-Cache']) == ('MISS', 'HIT')
+    assert segunda.get_data() == primera.get_data()
+    ndjson = subir(cliente, datos, '?formato=ndjson')
+    assert ndjson.headers['X-Cache'] == 'HIT'
+    assert piezas_lineas(lineas(ndjson)) == primera.get_json()['piezas']
+
+
+@pytest.mark.parametrize('formato, of', [('json', 913051), ('ndjson', 913052)])
+def test_cache_alimenta_estadisticas_e_historico(cliente, monkeypatch, tmp_path, formato, of):
+    datos = libro_excel(filas_variadas(of=of), referencia='e09130510')
+    assert subir(cliente, datos).headers['X-Cache'] == 'MISS'
+    cliente.delete('/api/estadisticas/e09130510')
+    monkeypatch.setattr(aplicacion, 'almacen_resultados', AlmacenResultados(str(tmp_path / 'resultados.db')))
+
+    respuesta = subir(cliente, datos, f'?formato={formato}')
+    assert respuesta.headers['X-Cache'] == 'HIT'
+    respuesta.get_data()
+    assert cliente.get('/api/estadisticas').get_json()['e09130510']['piezas'] == 6
+    cargas = cliente.get('/api/resultados/cargas').get_json()
+    assert (cargas['total'], cargas['resultados'][0]['num_piezas']) == (1, 6)
+    # Otro acierto no duplica las piezas ni la carga
+    subir(cliente, datos).get_data()
+    assert cliente.get('/api/estadisticas').get_json()['e09130510']['piezas'] == 6
+    assert cliente.get('/api/resultados/cargas').get_json()['total'] == 1
+
+
+def test_ndjson_llena_cache_e_historico_desde_la_tabla(cliente, monkeypatch, tmp_path):
+    monkeypatch.setattr(aplicacion, 'almacen_resultados', AlmacenResultados(str(tmp_path / 'resultados.db')))
+    datos = libro_excel(filas_variadas(of=913101))
+    ndjson = subir(cliente, datos, '?formato=ndjson')
+    assert ndjson.headers['X-Cache'] == 'MISS'
+    lineas(ndjson)
+
+    json_cache = subir(cliente, datos)
+    assert json_cache.headers['X-Cache'] == 'HIT'
+    assert json_cache.get_data() == subir(cliente, datos, '?cache=0').get_data()
+
+    cargas = cliente.get('/api/resultados/cargas').get_json()
+    assert cargas['total'] == 1
+    assert cargas['resultados'][0]['num_piezas'] == 6
+    resultados = cliente.get('/api/resultados?of=913101&pieza=10').get_json()
+    assert {(fila['porcentaje'], fila['par_izquierda']) for fila in resultados['resultados']} == {(0, 2.7), (100, 7.1)}
+
+
+def con_menos_cero(datos):
+    """El mismo libro con las celdas -0 escritas como -0.0 (openpyxl las lee entonces como float)"""
+    salida = BytesIO()
+    with zipfile.ZipFile(BytesIO(datos)) as origen, zipfile.ZipFile(salida, 'w') as destino:
+        for entrada in origen.infolist():
+            contenido = origen.read(entrada)
+            if entrada.filename.startswith('xl/worksheets/'):
+                contenido = contenido.replace(b'<v>-0</v>', b'<v>-0.0</v>')
+            destino.writestr(entrada, contenido)
+    return salida.getvalue()
+
+
+def test_consumo_menos_cero_no_cambia_el_signo_de_otros_ceros():
+    # En streaming las columnas son de tipo objeto: -0.0 y 0 no deben convertirse al mismo valor
+    datos = con_menos_cero(libro_excel(filas_pieza(1, 913601, consumo_0=(-0.0, 0.0))
+                                       + filas_pieza(2, 913601, consumo_0=(0, -0.0))))
+    _, tabla = procesar_libro(BytesIO(datos), 'streaming')
+    piezas = tabla.a_dict()
+    signos = [math.copysign(1, piezas[f'OF913601_Pieza{pieza}']['cargas']['0'][campo])
+              for pieza in (1, 2) for campo in ('consumo_izquierda', 'consumo_derecha')]
+    assert signos == [-1, 1, 1, -1]
+
+
+@pytest.mark.parametrize('consulta, error', [
+    ('?lectura=rapida', 'Modo de lectura no válido: rapida'),
+    ('?formato=xml', 'Formato no válido: xml'),
+])
+def test_parametros_no_validos(cliente, consulta, error):
+    respuesta = subir(cliente, libro_excel(filas_pieza(1, 1)), consulta)
+    assert respuesta.status_code == 400
+    assert respuesta.get_json() == {'error': error}
+
+
+def test_sin_archivo_o_sin_pestana(cliente):
+    assert cliente.post('/api/procesar-excel').status_code == 400
+    libro = openpyxl.Workbook()
+    salida = BytesIO()
+    libro.save(salida)
+    respuesta = subir(cliente, salida.getvalue(), '?cache=0')
+    assert respuesta.status_code == 400
+    assert 'Análisis de test' in respuesta.get_json()['error']
+
+
+def test_lectura_incremental_desde_el_endpoint(cliente):
+    filas = filas_variadas(of=913201)
+    primera = subir(cliente, libro_excel(filas, referencia='e09132010'), '?cache=0&incremental=1')
+    assert primera.headers['X-Lectura-Incremental'].startswith('completa;')
+
+    # Filas añadidas al final: solo se leen esas
+    anadidas = filas + filas_pieza(11, 913201) + filas_pieza(10, 913201, par_100=(8.0, 8.0), pasos=[4])
+    datos = libro_excel(anadidas, referencia='e09132010')
+    segunda = subir(cliente, datos, '?cache=0&incremental=1')
+    assert segunda.headers['X-Lectura-Incremental'] == f'incremental; reutilizadas={len(filas)}; leidas=7'
+    assert segunda.get_json()['piezas'] == piezas_iterativo(datos)
+
+    # Prefijo cambiado (una fila ya leída con otro valor): se vuelve a leer completo
+    cambiadas = [list(fila) for fila in anadidas]
+    cambiadas[0][7] = 3.1
+    datos = libro_excel(cambiadas, referencia='e09132010')
+    tercera = subir(cliente, datos, '?cache=0&incremental=1')
+    assert tercera.headers['X-Lectura-Incremental'].startswith('completa;')
+    assert tercera.get_json()['piezas'] == piezas_iterativo(datos)
+
+
+def test_lote_combina_los_archivos(cliente):
+    primero = libro_excel(filas_pieza(1, 913301) + filas_pieza(2, 913301))
+    segundo = libro_excel(filas_pieza(2, 913301, par_100=(7.0, 7.0)) + filas_pieza(1, 913302))
+    respuesta = cliente.post('/api/procesar-excel-lote?workers=1', data={
+        'files': [(BytesIO(primero), 'a.xlsx'), (BytesIO(segundo), 'b.xlsx'), (BytesIO(b'no'), 'c.xlsx')]},
+        content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    resultado = respuesta.get_json()
+    assert (resultado['num_archivos'], resultado['num_errores'], resultado['num_piezas']) == (3, 1, 3)
+    assert resultado['piezas_reemplazadas'] == 1
+    piezas = resultado['referencias']['e06091800']
+    esperadas = piezas_iterativo(primero) | piezas_iterativo(segundo)
+    assert {clave: {campo: valor for campo, valor in pieza.items() if campo != 'archivo'}
+            for clave, pieza in piezas.items()} == esperadas
+    assert piezas['OF913301_Pieza2']['archivo'] == 'b.xlsx'
+
+
+def test_lote_no_pasa_de_los_workers_configurados(cliente, monkeypatch):
+    monkeypatch.setattr(ingesta_lote, 'WORKERS_INGESTA', 2)
+    respuesta = cliente.post('/api/procesar-excel-lote?workers=500', data={
+        'files': [(BytesIO(libro_excel(filas_pieza(1, 913401))), 'a.xlsx')]}, content_type='multipart/form-data')
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['workers'] == 2
+
+
+def test_pool_de_ingesta_roto_se_sustituye(monkeypatch):
+    monkeypatch.setattr(ingesta_lote, 'WORKERS_INGESTA', 1)
+    excel = [('a.xlsx', libro_excel(filas_pieza(1, 913501)))]
+    pool = pool_procesos.obtener_pool('ingesta', 1)
+    # Un proceso que muere rompe el pool compartido
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+    with pytest.raises(BrokenProcessPool):
+        ingesta_lote.procesar_archivos(excel)
+    infos, _ = ingesta_lote.procesar_archivos(excel)
+    assert infos[0]['estado'] == 'ok'
+    assert pool_procesos.obtener_pool('ingesta', 1) is not pool
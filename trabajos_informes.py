@@ -0,0 +1,307 @@
+"""Cola de trabajos en segundo plano para generar informes PDF sin bloquear la petición.
+
+`ColaTrabajos` guarda los trabajos en la memoria del proceso. Con varios procesos worker se usa
+`ColaTrabajosCompartida`, con los trabajos en la base de datos de estado (ESTADO_DB) y los PDF en un
+directorio común, para que el estado y la descarga se puedan pedir a cualquier worker.
+"""
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from metricas import iniciar_peticion, metricas, terminar_peticion
+
+EN_COLA = 'en_cola'
+EJECUTANDO = 'ejecutando'
+TERMINADO = 'terminado'
+ERROR = 'error'
+
+# Campos de cada trabajo (columnas de la tabla `trabajos` en la base de datos de estado)
+CAMPOS_TRABAJO = ('id', 'tipo', 'estado', 'progreso', 'creado', 'iniciado', 'terminado', 'error',
+                  'nombre_archivo', 'bytes', 'ruta')
+
+
+class ColaLlenaError(RuntimeError):
+    """Hay demasiados trabajos pendientes (en cola o ejecutándose) para aceptar otro"""
+
+
+class ColaTrabajos:
+    """Cola en proceso con concurrencia limitada y retención de los resultados.
+
+    Cada trabajo llama a `funcion(data, progreso=callback)`, que debe devolver
+    (buffer, nombre_archivo). El PDF se guarda en disco hasta que se purga el trabajo. Como mucho hay
+    `max_pendientes` trabajos en cola o ejecutándose y `max_trabajos` en total; por encima, `enviar`
+    lanza ColaLlenaError.
+    """
+
+    def __init__(self, max_concurrentes=2, directorio=None, retencion_s=3600, max_trabajos=200,
+                 max_pendientes=20):
+        # Un directorio temporal propio se borra entero al cerrar; en uno configurado solo se borran los PDF
+        self._directorio_propio = not directorio
+        self.directorio = directorio or tempfile.mkdtemp(prefix='trabajos_informes_')
+        os.makedirs(self.directorio, exist_ok=True)
+        self.retencion_s = retencion_s
+        self.max_trabajos = max_trabajos
+        self.max_pendientes = max_pendientes
+        self._ejecutor = ThreadPoolExecutor(max_workers=max_concurrentes, thread_name_prefix='informe')
+        self._trabajos = {}
+        self._lock = threading.Lock()
+        self._limpiar_directorio()
+
+    def _limpiar_directorio(self):
+        # Los PDF de un arranque anterior ya no tienen trabajo que los descargue
+        self._borrar_archivos(glob.glob(os.path.join(self.directorio, '*.pdf')))
+
+    def enviar(self, tipo, funcion, data):
+        """Encolar un trabajo y devolver su id (ColaLlenaError si no caben más)"""
+        self._purgar()
+        id_trabajo = uuid.uuid4().hex
+        self._insertar({
+            'id': id_trabajo,
+            'tipo': tipo,
+            'estado': EN_COLA,
+            'progreso': 0.0,
+            'creado': time.time(),
+            'iniciado': None,
+            'terminado': None,
+            'error': None,
+            'nombre_archivo': None,
+            'bytes': None,
+            'ruta': None
+        })
+        self._ejecutor.submit(self._ejecutar, id_trabajo, tipo, funcion, data)
+        return id_trabajo
+
+    @staticmethod
+    def _error_cola_llena(pendientes):
+        return ColaLlenaError(f'Cola de informes llena ({pendientes} trabajos pendientes); inténtalo más tarde')
+
+    def _insertar(self, trabajo):
+        with self._lock:
+            pendientes = sum(t['estado'] in (EN_COLA, EJECUTANDO) for t in self._trabajos.values())
+            if pendientes >= self.max_pendientes or len(self._trabajos) >= self.max_trabajos:
+                raise self._error_cola_llena(pendientes)
+            self._trabajos[trabajo['id']] = trabajo
+
+    def _actualizar(self, id_trabajo, **campos):
+        """Actualizar un trabajo; False si ya no existe (la cola se ha cerrado)"""
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None:
+                return False
+            trabajo.update(campos)
+            return True
+
+    def _obtener(self, id_trabajo):
+        """Copia de un trabajo o None"""
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            return dict(trabajo) if trabajo is not None else None
+
+    def _ejecutar(self, id_trabajo, tipo, funcion, data):
+        if not self._actualizar(id_trabajo, estado=EJECUTANDO, iniciado=time.time()):
+            return
+        # Los tramos del informe se registran con el tipo de trabajo como endpoint
+        token = iniciar_peticion(f'trabajo_{tipo}')
+        try:
+            buffer, nombre_archivo = funcion(
+                data, progreso=lambda fraccion: self._actualizar(id_trabajo, progreso=round(fraccion, 3))
+            )
+            ruta = os.path.join(self.directorio, f'{id_trabajo}.pdf')
+            with buffer, open(ruta, 'wb') as f:
+                shutil.copyfileobj(buffer, f)
+            tamano = os.path.getsize(ruta)
+            if not self._actualizar(id_trabajo, estado=TERMINADO, progreso=1.0, terminado=time.time(),
+                                    nombre_archivo=nombre_archivo, bytes=tamano, ruta=ruta):
+                # La cola se cerró mientras se generaba: nadie va a descargar el PDF
+                self._borrar_archivos([ruta])
+            metricas.observar('cargas_pdf_bytes', tamano, tipo=f'trabajo_{tipo}')
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            self._actualizar(id_trabajo, estado=ERROR, terminado=time.time(), error=str(e))
+        finally:
+            terminar_peticion(token)
+
+    def estado(self, id_trabajo):
+        """Estado público de un trabajo (sin la ruta interna) o None si no existe"""
+        self._purgar()
+        trabajo = self._obtener(id_trabajo)
+        if trabajo is None:
+            return None
+        estado = {clave: valor for clave, valor in trabajo.items() if clave != 'ruta'}
+        estado['posicion_cola'] = self._posicion(id_trabajo) if estado['estado'] == EN_COLA else 0
+        return estado
+
+    def _en_cola(self):
+        """(creado, id) de los trabajos en cola"""
+        with self._lock:
+            return [(t['creado'], t['id']) for t in self._trabajos.values() if t['estado'] == EN_COLA]
+
+    def _posicion(self, id_trabajo):
+        en_cola = sorted(self._en_cola())
+        return next((i + 1 for i, (_, id_) in enumerate(en_cola) if id_ == id_trabajo), 0)
+
+    def resultado(self, id_trabajo):
+        """(ruta, nombre_archivo) del PDF de un trabajo terminado, o None"""
+        self._purgar()
+        trabajo = self._obtener(id_trabajo)
+        if trabajo is None or trabajo['estado'] != TERMINADO:
+            return None
+        return trabajo['ruta'], trabajo['nombre_archivo']
+
+    def pendientes(self):
+        with self._lock:
+            return sum(t['estado'] in (EN_COLA, EJECUTANDO) for t in self._trabajos.values())
+
+    @staticmethod
+    def _caducados(finalizados, total, max_trabajos, retencion_s):
+        """Trabajos finalizados (ordenados por `terminado`) que hay que purgar"""
+        ahora = time.time()
+        sobrantes = max(0, total - max_trabajos + 1)
+        return [t for i, t in enumerate(finalizados) if i < sobrantes or ahora - t['terminado'] > retencion_s]
+
+    def _eliminar_caducados(self):
+        """Quitar de la cola los trabajos a purgar y devolverlos"""
+        with self._lock:
+            finalizados = sorted(
+                (t for t in self._trabajos.values() if t['estado'] in (TERMINADO, ERROR)),
+                key=lambda t: t['terminado']
+            )
+            eliminar = self._caducados(finalizados, len(self._trabajos), self.max_trabajos, self.retencion_s)
+            for trabajo in eliminar:
+                del self._trabajos[trabajo['id']]
+        return eliminar
+
+    def _purgar(self):
+        """Eliminar los trabajos terminados más antiguos que la retención o que excedan el máximo, y sus PDF"""
+        eliminar = self._eliminar_caducados()
+        self._borrar_archivos(trabajo['ruta'] for trabajo in eliminar if trabajo['ruta'])
+
+    @staticmethod
+    def _borrar_archivos(rutas):
+        for ruta in rutas:
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+
+    def cerrar(self):
+        """Cancelar los trabajos en cola y borrar los PDF (y el directorio temporal propio)"""
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            rutas = [t['ruta'] for t in self._trabajos.values() if t['ruta']]
+            self._trabajos.clear()
+        self._borrar_archivos(rutas)
+        if self._directorio_propio:
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def _proceso_vivo(pid):
+    if pid == os.getpid():
+        return True
+    if sys.platform == 'win32':
+        # En Windows os.kill termina el proceso; allí solo hay un proceso worker (waitress)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class ColaTrabajosCompartida(ColaTrabajos):
+    """ColaTrabajos con los trabajos en la base de datos de estado, común a todos los workers.
+
+    Cada trabajo se ejecuta en el proceso que lo recibe, pero cualquier worker puede dar su estado y su
+    PDF, que se guarda en `directorio` (por defecto, `trabajos_informes` junto a la base de datos). Los
+    límites de pendientes y de trabajos son para todos los procesos. Un trabajo sin terminar cuyo proceso
+    ya no existe pasa a error.
+    """
+
+    def __init__(self, base_datos, max_concurrentes=2, directorio=None, retencion_s=3600, max_trabajos=200,
+                 max_pendientes=20):
+        self.base_datos = base_datos
+        directorio = directorio or os.path.join(os.path.dirname(os.path.abspath(base_datos.ruta)),
+                                                'trabajos_informes')
+        super().__init__(max_concurrentes, directorio, retencion_s, max_trabajos, max_pendientes)
+
+    def _limpiar_directorio(self):
+        # Solo los PDF sin trabajo: los demás pueden ser de otro worker
+        conocidos = {fila['id'] for fila in self.base_datos.leer('SELECT id FROM trabajos')}
+        self._borrar_archivos(ruta for ruta in glob.glob(os.path.join(self.directorio, '*.pdf'))
+                              if os.path.basename(ruta)[:-len('.pdf')] not in conocidos)
+
+    def _insertar(self, trabajo):
+        with self.base_datos.transaccion() as conexion:
+            pendientes, total = conexion.execute(
+                'SELECT COALESCE(SUM(estado IN (?, ?)), 0), COUNT(*) FROM trabajos', (EN_COLA, EJECUTANDO)
+            ).fetchone()
+            if pendientes >= self.max_pendientes or total >= self.max_trabajos:
+                raise self._error_cola_llena(pendientes)
+            conexion.execute(f'INSERT INTO trabajos ({", ".join(CAMPOS_TRABAJO)}, pid) '
+                             f'VALUES ({", ".join("?" * (len(CAMPOS_TRABAJO) + 1))})',
+                             [trabajo[campo] for campo in CAMPOS_TRABAJO] + [os.getpid()])
+
+    def _actualizar(self, id_trabajo, **campos):
+        asignaciones = ', '.join(f'{campo} = ?' for campo in campos if campo in CAMPOS_TRABAJO)
+        conexion = self.base_datos.conectar()
+        try:
+            cursor = conexion.execute(f'UPDATE trabajos SET {asignaciones} WHERE id = ?',
+                                      list(campos.values()) + [id_trabajo])
+            return cursor.rowcount > 0
+        finally:
+            conexion.close()
+
+    def _obtener(self, id_trabajo):
+        filas = self.base_datos.leer(f'SELECT {", ".join(CAMPOS_TRABAJO)} FROM trabajos WHERE id = ?', (id_trabajo,))
+        return dict(filas[0]) if filas else None
+
+    def _en_cola(self):
+        return [tuple(fila) for fila in self.base_datos.leer('SELECT creado, id FROM trabajos WHERE estado = ?',
+                                                            (EN_COLA,))]
+
+    def resultado(self, id_trabajo):
+        resultado = super().resultado(id_trabajo)
+        # El PDF puede haberse borrado con el directorio temporal de un arranque anterior
+        return resultado if resultado is not None and os.path.exists(resultado[0]) else None
+
+    def pendientes(self):
+        return self.base_datos.leer('SELECT COUNT(*) FROM trabajos WHERE estado IN (?, ?)',
+                                    (EN_COLA, EJECUTANDO))[0][0]
+
+    def _eliminar_caducados(self):
+        with self.base_datos.transaccion() as conexion:
+            # Trabajos de un worker que ha terminado (reinicio, timeout) sin acabarlos
+            for fila in conexion.execute('SELECT DISTINCT pid FROM trabajos WHERE estado IN (?, ?)',
+                                         (EN_COLA, EJECUTANDO)).fetchall():
+                if not _proceso_vivo(fila['pid']):
+                    conexion.execute('UPDATE trabajos SET estado = ?, terminado = ?, error = ? '
+                                     'WHERE pid = ? AND estado IN (?, ?)',
+                                     (ERROR, time.time(), 'El proceso que generaba el informe ha terminado',
+                                      fila['pid'], EN_COLA, EJECUTANDO))
+            finalizados = [dict(fila) for fila in conexion.execute(
+                'SELECT id, terminado, ruta FROM trabajos WHERE estado IN (?, ?) ORDER BY terminado',
+                (TERMINADO, ERROR))]
+            total = conexion.execute('SELECT COUNT(*) FROM trabajos').fetchone()[0]
+            eliminar = self._caducados(finalizados, total, self.max_trabajos, self.retencion_s)
+            conexion.executemany('DELETE FROM trabajos WHERE id = ?', [(trabajo['id'],) for trabajo in eliminar])
+        return eliminar
+
+    def cerrar(self):
+        """Cancelar los trabajos en cola de este proceso; los PDF terminados siguen disponibles para los demás"""
+        self._ejecutor.shutdown(wait=False, cancel_futures=True)
+        try:
+            with self.base_datos.transaccion() as conexion:
+                conexion.execute('UPDATE trabajos SET estado = ?, terminado = ?, error = ? '
+                                 'WHERE pid = ? AND estado IN (?, ?)',
+                                 (ERROR, time.time(), 'Servidor detenido', os.getpid(), EN_COLA, EJECUTANDO))
+        except Exception as e:
+            print(f"Error al cerrar la cola de informes: {e}")